@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -123,6 +125,226 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media files are stored under their SHA-256 so identical outputs share a blob.
+STORAGES = {
+    'default': {
+        'BACKEND': 'app.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+
+# Storage lifecycle
+# `manage.py storage_lifecycle` deletes records older than STORAGE_RETENTION
+# seconds and evicts the least recently downloaded files of a media type once
+# it uses more than STORAGE_QUOTAS bytes (missing or None means unlimited).
+# It also reports stored files no record references, older than
+# STORAGE_ORPHAN_GRACE seconds, and records whose file is gone; pass --delete to
+# remove them. Only files the storage laid out itself are considered. With
+# STORAGE_RECOMPRESS_AFTER set, images not downloaded for that many seconds are
+# re-encoded as WebP, up to STORAGE_RECOMPRESS_BATCH per run.
+
+STORAGE_RETENTION = {}
+STORAGE_QUOTAS = {}
+STORAGE_ORPHAN_GRACE = 24 * 60 * 60
+STORAGE_RECOMPRESS_AFTER = None
+STORAGE_RECOMPRESS_QUALITY = 85
+STORAGE_RECOMPRESS_BATCH = 200
+
+
+# Library bulk operations
+# /api/records/delete/ and list payloads to /api/records/create/ handle at most
+# RECORDS_BULK_MAX_ITEMS records per request. Files left unreferenced by deletes
+# are removed after the commit by FILE_CLEANUP_WORKERS background threads.
+
+RECORDS_BULK_MAX_ITEMS = 5000
+FILE_CLEANUP_WORKERS = 2
+
+
+# Media downloads
+# Set MEDIA_SENDFILE_MODE to 'nginx' (X-Accel-Redirect to MEDIA_SENDFILE_PREFIX,
+# which must map to MEDIA_ROOT as an internal location) or 'apache'
+# (X-Sendfile) to let the web server send file bytes instead of Python.
+
+MEDIA_SENDFILE_MODE = None
+MEDIA_SENDFILE_PREFIX = '/protected-media/'
+
+
+# Thumbnails, video posters and audio waveforms for the library, built in
+# background threads. Video posters and non-WAV audio need an ffmpeg binary.
+
+DERIVATIVES_ENABLED = True
+DERIVATIVE_WORKERS = 2
+FFMPEG_BINARY = 'ffmpeg'
+
+
+# Generation deadlines
+# Seconds a prediction may take per xinference service model, including time
+# queued inside xinference; past it the gradio job is cancelled and the request
+# fails with 504. Models not listed use GENERATION_DEFAULT_DEADLINE (None: no limit).
+
+GENERATION_DEADLINES = {
+    'sd3.5-medium': 300,
+    'FishSpeech-1.5': 300,
+    'Wan2.1-1.3B': 1800,
+}
+GENERATION_DEFAULT_DEADLINE = 600
+
+
+# Long-form speech
+# Audio prompts longer than TTS_LONG_FORM_MIN_CHARS characters (or requests with
+# "long_form": true) are split at sentence boundaries into segments of at most
+# TTS_SEGMENT_MAX_CHARS characters, synthesized TTS_SEGMENT_CONCURRENCY at a time
+# across the xinference backends and joined into one file. Each segment gets the
+# full FishSpeech deadline. Send "stream": true to /api/audio/ to receive the
+# segments as they finish.
+
+TTS_LONG_FORM_MIN_CHARS = 300
+TTS_SEGMENT_MAX_CHARS = 150
+TTS_SEGMENT_CONCURRENCY = 4
+
+
+# Admission control
+# Per media type: generations one user ('user') and all users together
+# ('global') may run at once, counting synchronous requests and running jobs;
+# a per-user token bucket refilled at 'rate' generations per minute holding up
+# to 'burst'; and how many jobs one user may have waiting ('queued'). Requests
+# over a limit get 429 with Retry-After ('retry_after' seconds when a slot, not
+# the rate, is the problem). Queued jobs are handed to workers by least recent
+# use per user over ADMISSION_FAIR_WINDOW seconds, scaled by
+# ADMISSION_USER_WEIGHTS ({username: weight}, default 1). State is kept in the
+# database, so the limits hold across processes.
+
+ADMISSION_ENABLED = True
+ADMISSION_LIMITS = {
+    'image': {'user': 2, 'global': 4, 'rate': 12, 'burst': 6, 'queued': 20, 'retry_after': 10},
+    'audio': {'user': 4, 'global': 8, 'rate': 30, 'burst': 10, 'queued': 50, 'retry_after': 5},
+    'video': {'user': 1, 'global': 2, 'rate': 2, 'burst': 2, 'queued': 5, 'retry_after': 60},
+}
+ADMISSION_USER_WEIGHTS = {}
+ADMISSION_FAIR_WINDOW = 10 * 60
+
+
+# Generation workers
+# Concurrent jobs per media type for `manage.py run_generation_workers`, which is
+# what runs jobs in a deployment. GENERATION_INLINE_WORKERS (ABSAIGEN_INLINE_WORKERS=1)
+# makes the web process start a pool of its own on the first submitted job, for a
+# single `runserver` during development only: every gunicorn/uvicorn worker would
+# start one, multiplying the caps below by the number of processes. Without
+# either, /api/jobs/ answers 503 "no_workers" and the UI generates through the
+# synchronous /api/<media_type>/ endpoints instead.
+
+GENERATION_WORKER_CONCURRENCY = {
+    'image': 2,
+    'audio': 4,
+    'video': 1,
+}
+GENERATION_INLINE_WORKERS = os.environ.get('ABSAIGEN_INLINE_WORKERS') == '1'
+
+
+# Bulk generation
+# CSV/JSONL prompt files posted to /api/batches/ or passed to
+# `manage.py generate_batch` run BULK_GENERATION_CONCURRENCY generations at a
+# time (a request may ask for up to BULK_GENERATION_MAX_CONCURRENCY). Each item
+# is claimed when it starts and its record saved as soon as it finishes; items
+# left running for BULK_GENERATION_CLAIM_TIMEOUT seconds by a runner that died
+# are picked up again by the next resume.
+
+BULK_GENERATION_CONCURRENCY = 4
+BULK_GENERATION_MAX_CONCURRENCY = 16
+BULK_GENERATION_CLAIM_TIMEOUT = 60 * 60
+BULK_GENERATION_MAX_ITEMS = 5000
+
+
+# Job progress events
+# /api/jobs/<id>/events/ is a Server-Sent Events stream of a job's progress,
+# checked every JOB_EVENTS_POLL_INTERVAL seconds. Under WSGI each stream holds
+# a worker thread, so it ends after JOB_EVENTS_MAX_DURATION seconds and the
+# browser reconnects; the async view keeps it open for JOB_EVENTS_ASYNC_MAX_DURATION.
+
+JOB_EVENTS_POLL_INTERVAL = 0.5
+JOB_EVENTS_MAX_DURATION = 30
+JOB_EVENTS_ASYNC_MAX_DURATION = 30 * 60
+JOB_EVENTS_HEARTBEAT = 15
+
+
+# Xinference backends
+# Generation calls are spread over these backends by least outstanding
+# requests per unit of weight. Each entry is {"url": ..., "weight": 1,
+# "models": [...]}; "models" limits a backend to those service models. When
+# empty, XINFERENCE_BASE_URL (environment, env.local or .env) is used and may
+# list several comma-separated URLs. A backend failing XINFERENCE_BREAKER_FAILURES
+# times in a row is ejected for XINFERENCE_BREAKER_COOLDOWN seconds; connection
+# failures and 502/503/504 are retried on up to XINFERENCE_RETRY_ATTEMPTS other
+# backends. With more than one backend, XINFERENCE_HEALTH_PATH is probed every
+# XINFERENCE_HEALTH_INTERVAL seconds (0 disables probing).
+
+XINFERENCE_BACKENDS = []
+XINFERENCE_BREAKER_FAILURES = 3
+XINFERENCE_BREAKER_COOLDOWN = 30
+XINFERENCE_RETRY_ATTEMPTS = 1
+XINFERENCE_HEALTH_PATH = '/status'
+XINFERENCE_HEALTH_INTERVAL = 15
+XINFERENCE_HEALTH_TIMEOUT = 5
+
+
+# gradio_client connections to xinference
+# Idle clients kept per service URL, and how long an idle client stays usable.
+# The fetched app config / API schema is cached on disk so new workers skip
+# the handshake.
+
+GRADIO_CLIENT_MAX_IDLE = 4
+GRADIO_CLIENT_IDLE_TIMEOUT = 300
+GRADIO_SCHEMA_CACHE_DIR = Path(tempfile.gettempdir()) / 'absaigen' / 'gradio_schema'
+GRADIO_SCHEMA_CACHE_TTL = 24 * 60 * 60
+
+# Largest generation result accepted into MEDIA_ROOT.
+GENERATION_MAX_RESULT_BYTES = 2 * 1024 * 1024 * 1024
+
+
+# Result cache
+# When enabled, identical generation requests reuse the stored file instead of
+# calling xinference again; send "cache": "bypass" to force a fresh run.
+
+GENERATION_CACHE_ENABLED = False
+GENERATION_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+GENERATION_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024
+
+
+# Records listing cache
+# /api/records/ responses always carry an ETag derived from a library version
+# counter kept in the database, so conditional polls get a 304. Bodies are also
+# kept in the Django cache for this many seconds; 0 disables only the body cache.
+
+RECORDS_LIST_CACHE_TIMEOUT = 30
+
+
+# Image micro-batching
+# Identical image requests arriving within IMAGE_BATCH_MAX_WAIT seconds in the
+# same process are sent to xinference as one call with n > 1.
+
+IMAGE_BATCHING_ENABLED = False
+IMAGE_BATCH_MAX_SIZE = 4
+IMAGE_BATCH_MAX_WAIT = 0.05
+
+
+# Async views
+# Under ASGI the generate/list/download endpoints are served by app.async_views,
+# which talk to xinference with a non-blocking HTTP client. asgi.py turns this on.
+
+USE_ASYNC_VIEWS = os.environ.get('ABSAIGEN_ASYNC_VIEWS') == '1'
+ASYNC_HTTP_MAX_CONNECTIONS = 200
+
+# Metrics
+# /metrics serves per-process stage timings in the Prometheus text format to
+# staff users and to scrapes sending "Authorization: Bearer <token>" with
+# ABSAIGEN_METRICS_TOKEN. With no token set it is refused unless DEBUG is on.
+# Each timed stage is also logged as JSON on the "app.metrics" logger at INFO.
+
+METRICS_TOKEN = os.environ.get('ABSAIGEN_METRICS_TOKEN', '')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,230 @@
+"""
+Admission control for the GPU-bound generation endpoints.
+
+Per media type, ``ADMISSION_LIMITS`` sets how many generations one user and
+everybody together may have on the GPU at once, and a token bucket (``rate``
+per minute, up to ``burst`` at once) for how often a user may start one.
+Synchronous generations hold an ``AdmissionLease`` while they run; running
+jobs count against the same limits. A request over a limit fails right away
+with ``Rejected`` (429 with ``Retry-After``) instead of queueing in a worker.
+
+Jobs are admitted into the queue (rate-limited, with at most ``queued``
+waiting per user) and ``fair_candidates`` decides which user's job a worker
+takes next: the one with the least weighted service over the last
+``ADMISSION_FAIR_WINDOW`` seconds, so one user's backlog cannot starve
+everybody else.
+
+All state lives in the database, so the limits hold across worker
+processes.
+"""
+import math
+from contextlib import asynccontextmanager, contextmanager
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .generation import SERVICES, GenerationError, deadline_for
+from .models import AdmissionBucket, AdmissionLease, GenerationJob
+
+DEFAULT_LIMITS = {"user": 1, "global": 1, "rate": 10, "burst": 5, "queued": 10, "retry_after": 10}
+# leases outlive their generation's deadline by this much before they are
+# assumed to belong to a dead process
+LEASE_GRACE = 60
+_LABELS = {"image": "图像", "audio": "音频", "video": "视频"}
+
+
+class Rejected(GenerationError):
+    """Over an admission limit; ``retry_after`` is sent as the Retry-After header."""
+
+    def __init__(self, error: str, detail: str, retry_after: float):
+        super().__init__(error, detail, status=429)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def is_enabled() -> bool:
+    return settings.ADMISSION_ENABLED
+
+
+def limits(media_type: str) -> dict:
+    return {**DEFAULT_LIMITS, **settings.ADMISSION_LIMITS.get(media_type, {})}
+
+
+def _user_id(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def lock(media_type: str) -> None:
+    """
+    Serialize admission decisions for ``media_type`` until the transaction
+    ends (a no-op while admission is disabled). Callers take it only when
+    they are about to change something: a worker only once it has a job to
+    claim, a request only when it asks to be admitted.
+    """
+    if not is_enabled():
+        return
+    key = f"{media_type}:global"
+    # one UPDATE takes the row lock on every backend, SQLite's write lock included
+    if not AdmissionBucket.objects.filter(key=key).update(updated_at=timezone.now()):
+        AdmissionBucket.objects.get_or_create(key=key)
+        AdmissionBucket.objects.filter(key=key).update(updated_at=timezone.now())
+
+
+def _by_user(qs) -> dict:
+    return dict(qs.order_by().values("user_id").annotate(n=Count("pk")).values_list("user_id", "n"))
+
+
+def _in_flight(media_type: str, now) -> tuple:
+    """``(total, per user id)`` of running jobs and live leases."""
+    jobs = _by_user(GenerationJob.objects.filter(
+        media_type=media_type, status=GenerationJob.STATUS_RUNNING
+    ))
+    leases = _by_user(AdmissionLease.objects.filter(media_type=media_type, expires_at__gt=now))
+    per_user = {
+        user_id: jobs.get(user_id, 0) + leases.get(user_id, 0)
+        for user_id in set(jobs) | set(leases)
+    }
+    return sum(per_user.values()), per_user
+
+
+def _check_concurrency(user_id, media_type: str, limit: dict, now) -> None:
+    total, per_user = _in_flight(media_type, now)
+    label = _LABELS.get(media_type, media_type)
+    if per_user.get(user_id, 0) >= limit["user"]:
+        raise Rejected("并发生成数已达上限",
+                       f"每位用户最多同时进行 {limit['user']} 个{label}生成", limit["retry_after"])
+    if total >= limit["global"]:
+        raise Rejected("生成服务繁忙", f"{label}生成服务已满负荷，请稍后重试", limit["retry_after"])
+
+
+def _take_token(user_id, media_type: str, limit: dict, now) -> None:
+    rate = limit["rate"] / 60
+    bucket, _ = AdmissionBucket.objects.select_for_update().get_or_create(
+        key=f"{media_type}:user:{user_id}",
+        defaults={"tokens": limit["burst"], "updated_at": now},
+    )
+    elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+    tokens = min(limit["burst"], bucket.tokens + elapsed * rate)
+    if tokens < 1:
+        raise Rejected("请求过于频繁",
+                       f"每分钟最多发起 {limit['rate']:g} 次{_LABELS.get(media_type, media_type)}生成",
+                       (1 - tokens) / rate)
+    AdmissionBucket.objects.filter(pk=bucket.pk).update(tokens=tokens - 1, updated_at=now)
+
+
+def _lease_ttl(media_type: str) -> float:
+    deadline = deadline_for(SERVICES[media_type].service_model)
+    return (deadline or 60 * 60) + LEASE_GRACE
+
+
+def acquire(user, media_type: str):
+    """
+    Admit a synchronous generation: returns a lease id to ``release`` once
+    it is done (None while admission is disabled), or raises ``Rejected``.
+    """
+    if not is_enabled():
+        return None
+    limit = limits(media_type)
+    user_id = _user_id(user)
+    now = timezone.now()
+    with transaction.atomic():
+        lock(media_type)
+        # leases of processes that died mid-generation
+        AdmissionLease.objects.filter(media_type=media_type, expires_at__lte=now).delete()
+        _check_concurrency(user_id, media_type, limit, now)
+        _take_token(user_id, media_type, limit, now)
+        lease = AdmissionLease.objects.create(
+            user_id=user_id,
+            media_type=media_type,
+            expires_at=now + timedelta(seconds=_lease_ttl(media_type)),
+        )
+    return lease.pk
+
+
+def release(lease_id) -> None:
+    if lease_id is not None:
+        AdmissionLease.objects.filter(pk=lease_id).delete()
+
+
+@contextmanager
+def admit(user, media_type: str):
+    lease_id = acquire(user, media_type)
+    try:
+        yield
+    finally:
+        release(lease_id)
+
+
+@asynccontextmanager
+async def aadmit(user, media_type: str):
+    lease_id = await sync_to_async(acquire)(user, media_type)
+    try:
+        yield
+    finally:
+        await sync_to_async(release)(lease_id)
+
+
+def admit_job(user, media_type: str) -> None:
+    """Rate-limit a job submission and cap how many jobs one user has queued."""
+    if not is_enabled():
+        return
+    limit = limits(media_type)
+    user_id = _user_id(user)
+    now = timezone.now()
+    with transaction.atomic():
+        lock(media_type)
+        queued = GenerationJob.objects.filter(
+            user_id=user_id, media_type=media_type, status=GenerationJob.STATUS_QUEUED
+        ).count()
+        if queued >= limit["queued"]:
+            raise Rejected("排队任务过多",
+                           f"每位用户最多排队 {limit['queued']} 个{_LABELS.get(media_type, media_type)}任务",
+                           limit["retry_after"])
+        _take_token(user_id, media_type, limit, now)
+
+
+def _weights(user_ids) -> dict:
+    configured = settings.ADMISSION_USER_WEIGHTS
+    weights = {user_id: 1.0 for user_id in user_ids}
+    if configured:
+        names = get_user_model().objects.filter(pk__in=[pk for pk in user_ids if pk is not None])
+        for pk, username in names.values_list("pk", "username"):
+            weights[pk] = max(float(configured.get(username, 1)), 0.001)
+    return weights
+
+
+def fair_candidates(media_type: str) -> list:
+    """
+    Queued job ids of ``media_type`` in the order workers should try them:
+    the oldest job of every user below their concurrency limit, users with
+    the least recent service (jobs started within ``ADMISSION_FAIR_WINDOW``
+    divided by their ``ADMISSION_USER_WEIGHTS`` weight) first. Empty while
+    the media type is at its global limit.
+    """
+    queued = GenerationJob.objects.filter(media_type=media_type, status=GenerationJob.STATUS_QUEUED)
+    if not is_enabled():
+        return list(queued.order_by("created_at", "id").values_list("pk", flat=True)[:5])
+    if not queued.exists():
+        # the common idle poll: one read, no lock
+        return []
+    limit = limits(media_type)
+    now = timezone.now()
+    total, per_user = _in_flight(media_type, now)
+    if total >= limit["global"]:
+        return []
+    heads = dict(queued.order_by().values("user_id").annotate(first=Min("pk")).values_list("user_id", "first"))
+    served = _by_user(GenerationJob.objects.filter(
+        media_type=media_type,
+        started_at__gte=now - timedelta(seconds=settings.ADMISSION_FAIR_WINDOW),
+    ))
+    weights = _weights(list(heads))
+    eligible = [
+        (served.get(user_id, 0) / weights[user_id], first)
+        for user_id, first in heads.items()
+        if per_user.get(user_id, 0) < limit["user"]
+    ]
+    return [first for _, first in sorted(eligible)]
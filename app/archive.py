@@ -0,0 +1,77 @@
+import time
+import zipfile
+from pathlib import Path
+
+CHUNK_SIZE = 256 * 1024
+
+# Formats that are already compressed; deflating them only burns CPU.
+STORED_SUFFIXES = {
+    ".mp4", ".webm", ".mov", ".mkv",
+    ".png", ".jpg", ".jpeg", ".webp", ".gif",
+    ".mp3", ".aac", ".m4a", ".ogg", ".opus", ".flac",
+    ".zip",
+}
+
+
+class _StreamBuffer:
+    """Write-only sink for ``ZipFile``; the generator drains it after each write."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_arcnames(paths):
+    """Pair each path with an archive name, suffixing duplicates as ``name (1).ext``."""
+    seen = set()
+    for path in paths:
+        path = Path(path)
+        arcname = path.name
+        index = 1
+        while arcname in seen:
+            arcname = f"{path.stem} ({index}){path.suffix}"
+            index += 1
+        seen.add(arcname)
+        yield path, arcname
+
+
+def iter_zip(entries, chunk_size: int = CHUNK_SIZE):
+    """
+    Yield a ZIP archive of ``(path, arcname)`` entries as it is built, so the
+    first bytes go out before later files are even opened. Entries larger
+    than 4 GiB and archives with many files switch to ZIP64 automatically.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as zip_file:
+        for path, arcname in entries:
+            stat = path.stat()
+            info = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[:6])
+            info.file_size = stat.st_size
+            if path.suffix.lower() in STORED_SUFFIXES:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with path.open("rb") as src, zip_file.open(info, "w") as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
@@ -0,0 +1,272 @@
+"""
+Non-blocking generation for the ASGI views.
+
+gradio_client has no asyncio API, so this talks to gradio's REST endpoints
+directly with ``httpx.AsyncClient``: ``POST <prefix>/call/<api>`` queues the
+prediction and ``GET <prefix>/call/<api>/<event_id>`` streams its events.
+Inputs are ordered using the API schema shared with ``app.clients``, and
+result files are streamed to a temp file before being handed to storage.
+"""
+import asyncio
+import json
+import logging
+from pathlib import Path
+from uuid import uuid4
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import backends, clients, metrics, mp4, tts
+from .generation import (
+    SERVICES,
+    GenerationError,
+    GenerationTimeout,
+    _build_record,
+    _cached_file,
+    deadline_for,
+    generate,
+    save_rendered,
+    store_video_file,
+)
+from .ingest import CHUNK_SIZE, check_size, store_result
+from .models import MediaRecord
+from .storage import INCOMING_DIR
+
+logger = logging.getLogger(__name__)
+
+_http = None
+_http_loop = None
+
+
+def _client() -> httpx.AsyncClient:
+    """
+    One pooled AsyncClient per event loop. The client of a previous loop is
+    closed on that loop if it still runs; a closed loop took its connections
+    with it.
+    """
+    global _http, _http_loop
+    loop = asyncio.get_running_loop()
+    if _http is None or _http_loop is not loop:
+        if _http is not None and _http_loop.is_running() and not _http_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(_http.aclose(), _http_loop)
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, read=None),
+            limits=httpx.Limits(max_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS),
+        )
+        _http_loop = loop
+    return _http
+
+
+async def _schema(src: str) -> dict:
+    schema = await sync_to_async(clients.load_schema, thread_sensitive=False)(src)
+    if schema is not None:
+        return schema
+    http = _client()
+    resp = await http.get(f"{src}config")
+    resp.raise_for_status()
+    config = resp.json()
+    prefix = config.get("api_prefix", "").strip("/")
+    prefix = f"{prefix}/" if prefix else ""
+    resp = await http.get(f"{src}{prefix}info", params={"serialize": "False"})
+    resp.raise_for_status()
+    schema = {"config": config, "info": resp.json()}
+    await sync_to_async(clients.save_schema, thread_sensitive=False)(src, schema)
+    return schema
+
+
+def _prefixed(src: str, schema: dict) -> str:
+    prefix = schema["config"].get("api_prefix", "").strip("/")
+    return f"{src}{prefix}/" if prefix else src
+
+
+def _positional(schema: dict, api_name: str, inputs: dict) -> list:
+    parameters = schema["info"]["named_endpoints"][api_name]["parameters"]
+    data = []
+    for parameter in parameters:
+        name = parameter.get("parameter_name")
+        if name in inputs:
+            data.append(inputs[name])
+        else:
+            data.append(parameter.get("parameter_default"))
+    return data
+
+
+async def _iter_events(resp: httpx.Response):
+    event = None
+    async for line in resp.aiter_lines():
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event, line[len("data:"):].strip()
+
+
+def _fn_index(schema: dict, api_name: str):
+    for index, dependency in enumerate(schema["config"].get("dependencies", [])):
+        if dependency.get("api_name") == api_name.lstrip("/"):
+            return dependency.get("id", index)
+    return None
+
+
+async def _acancel(base: str, schema: dict, api_name: str, event_id: str, session_hash: str) -> None:
+    """Ask gradio to drop a queued or running event; best effort."""
+    try:
+        await _client().post(
+            f"{base}cancel",
+            json={
+                "event_id": event_id,
+                "session_hash": session_hash,
+                "fn_index": _fn_index(schema, api_name),
+            },
+            timeout=5,
+        )
+    except httpx.HTTPError:
+        logger.warning("could not cancel gradio event %s", event_id, exc_info=True)
+
+
+async def _apredict_on(base_url: str, service_model: str, api_name: str, inputs: dict):
+    src = f"{base_url}/{service_model}/"
+    schema = await _schema(src)
+    base = _prefixed(src, schema)
+    call_url = f"{base}call/{api_name.lstrip('/')}"
+    http = _client()
+    # our own session hash lets a cancelled request be cancelled upstream too
+    session_hash = uuid4().hex
+    resp = await http.post(
+        call_url, json={"data": _positional(schema, api_name, inputs), "session_hash": session_hash}
+    )
+    if resp.status_code == 404:
+        clients.invalidate_schema(src)
+    resp.raise_for_status()
+    event_id = resp.json()["event_id"]
+
+    try:
+        async with http.stream("GET", f"{call_url}/{event_id}") as stream:
+            stream.raise_for_status()
+            async for event, data in _iter_events(stream):
+                if event == "complete":
+                    return base, json.loads(data)
+                if event == "error":
+                    raise RuntimeError(data if data and data != "null" else "xinference 返回错误")
+    except asyncio.CancelledError:
+        # the client went away or the deadline passed
+        await _acancel(base, schema, api_name, event_id, session_hash)
+        raise
+    raise RuntimeError("生成服务连接意外中断")
+
+
+async def apredict(service_model: str, api_name: str, inputs: dict):
+    """Queue a prediction and wait for its ``complete`` event without blocking the loop."""
+    return await backends.acall(
+        service_model,
+        lambda base_url: _apredict_on(base_url, service_model, api_name, inputs),
+    )
+
+
+def _find_file(value):
+    """Depth-first search for the first gradio FileData dict in a result."""
+    if isinstance(value, dict):
+        if isinstance(value.get("path"), str) or isinstance(value.get("url"), str):
+            return value
+        for item in value.values():
+            found = _find_file(item)
+            if found:
+                return found
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            found = _find_file(item)
+            if found:
+                return found
+    return None
+
+
+def _file_url(base: str, file_data: dict) -> str:
+    if file_data.get("url"):
+        return file_data["url"]
+    return f"{base}file={file_data['path']}"
+
+
+async def astore_url(url: str, name: str, store=None):
+    """
+    Stream ``url`` into a temp file next to the storage, then move it in
+    with ``store(path, name)`` (by default ``store_result``), which runs in
+    a thread and whose result is returned.
+    """
+    incoming = Path(default_storage.path(INCOMING_DIR))
+    await sync_to_async(incoming.mkdir, thread_sensitive=False)(parents=True, exist_ok=True)
+    tmp_path = incoming / f"async_{uuid4().hex}"
+    try:
+        async with _client().stream("GET", url) as resp:
+            resp.raise_for_status()
+            length = resp.headers.get("Content-Length")
+            if length and length.isdigit():
+                check_size(int(length))
+            received = 0
+            dest = await sync_to_async(tmp_path.open, thread_sensitive=False)("wb")
+            try:
+                async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                    received += len(chunk)
+                    check_size(received)
+                    await sync_to_async(dest.write, thread_sensitive=False)(chunk)
+            finally:
+                await sync_to_async(dest.close, thread_sensitive=False)()
+        if store is not None:
+            return await sync_to_async(store, thread_sensitive=False)(tmp_path, name)
+        return await sync_to_async(store_result, thread_sensitive=False)(
+            str(tmp_path), name, move=True
+        )
+    finally:
+        await sync_to_async(tmp_path.unlink, thread_sensitive=False)(missing_ok=True)
+
+
+async def agenerate(media_type: str, params: dict) -> MediaRecord:
+    """Async counterpart of ``generation.generate``; ORM work runs in sync_to_async."""
+    if tts.is_long_form(params):
+        # segments are synthesized on their own thread pool anyway
+        return await sync_to_async(generate, thread_sensitive=False)(media_type, params)
+    service = SERVICES[media_type]
+    with metrics.bind(media_type=media_type, model=service.service_model), metrics.timed("total"):
+        return await _agenerate(media_type, service, params)
+
+
+async def _agenerate(media_type: str, service, params: dict) -> MediaRecord:
+    inputs = service.inputs(params)
+    cache_key, cached_path = await sync_to_async(_cached_file)(
+        media_type, service, params, inputs
+    )
+    if cached_path is not None:
+        # reads a cached video's metadata from disk
+        record = await sync_to_async(_build_record, thread_sensitive=False)(
+            media_type, params, cached_path
+        )
+        return (await sync_to_async(save_rendered)([(record, None)]))[0]
+
+    timeout = deadline_for(service.service_model)
+    try:
+        with metrics.timed("predict"):
+            try:
+                async with asyncio.timeout(timeout):
+                    base, data = await apredict(service.service_model, service.api_name, inputs)
+            except TimeoutError as exc:
+                raise GenerationTimeout(timeout) from exc
+        file_data = _find_file(data)
+        if not file_data:
+            raise ValueError(f"未找到结果文件路径，返回内容: {data!r}")
+        url = _file_url(base, file_data)
+        suffix = Path(file_data.get("orig_name") or file_data.get("path") or "").suffix
+        filename = f"{media_type}_{uuid4().hex}{suffix or service.default_suffix}"
+        info = None
+        with metrics.timed("store"):
+            if media_type == "video" and mp4.handles(suffix or service.default_suffix):
+                saved_path, info = await astore_url(url, f"{media_type}/{filename}", store_video_file)
+            else:
+                saved_path = await astore_url(url, f"{media_type}/{filename}")
+    except GenerationError:
+        raise
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("%s generation request failed", media_type)
+        raise GenerationError(service.error, service.error_detail(str(exc))) from exc
+
+    record = _build_record(media_type, params, saved_path, info)
+    return (await sync_to_async(save_rendered)([(record, cache_key)]))[0]
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.http.response import HttpResponseNotFound
+from django.views.decorators.http import require_GET, require_POST
+
+from . import admission, metrics, tts
+from .archive import iter_zip, unique_arcnames
+from .async_generation import agenerate
+from .generation import GenerationError, InvalidParams, parse_params
+from .models import GenerationJob
+from .views import (
+    _batch_stream_response,
+    _cached_list_records_response,
+    _generation_error_response,
+    _job_event,
+    _job_events_response,
+    _job_snapshot,
+    _long_form_stream_response,
+    _prepare_batch,
+    _record_file_response,
+    _serialize_record,
+    _sse,
+    _zip_files,
+    _zip_response,
+)
+
+
+async def aiter_sync(iterator):
+    """Drive a blocking iterator from a worker thread, one item at a time."""
+    iterator = iter(iterator)
+    sentinel = object()
+    next_item = sync_to_async(next, thread_sensitive=False)
+    while True:
+        item = await next_item(iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+
+async def _generate_response(request, media_type: str):
+    try:
+        payload = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON body")
+
+    try:
+        params = parse_params(media_type, payload)
+        if payload.get("stream") and tts.is_long_form(params):
+            lease = await sync_to_async(admission.acquire)(request.user, media_type)
+            return _long_form_stream_response(media_type, params, lease, wrap=aiter_sync)
+        async with admission.aadmit(request.user, media_type):
+            record = await agenerate(media_type, params)
+    except InvalidParams as exc:
+        return HttpResponseBadRequest(str(exc))
+    except GenerationError as exc:
+        return _generation_error_response(exc)
+
+    return JsonResponse({"record": _serialize_record(record)}, status=201)
+
+
+@login_required
+@require_POST
+async def generate_audio(request):
+    return await _generate_response(request, "audio")
+
+
+@login_required
+@require_POST
+async def generate_image(request):
+    return await _generate_response(request, "image")
+
+
+@login_required
+@require_POST
+async def generate_video(request):
+    return await _generate_response(request, "video")
+
+
+@login_required
+@require_GET
+async def list_records(request):
+    return await sync_to_async(_cached_list_records_response)(request)
+
+
+@login_required
+@require_GET
+async def download_record(request, pk: int):
+    return await sync_to_async(_record_file_response)(
+        request, pk, as_attachment=True, wrap=aiter_sync
+    )
+
+
+@login_required
+@require_GET
+async def stream_record(request, pk: int):
+    return await sync_to_async(_record_file_response)(
+        request, pk, as_attachment=False, wrap=aiter_sync
+    )
+
+
+@login_required
+@require_POST
+async def download_records_zip(request):
+    try:
+        payload = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON body")
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest("Invalid JSON body")
+
+    ids = payload.get("ids") or []
+    if not isinstance(ids, list) or not ids:
+        return HttpResponseBadRequest("ids is required")
+    if not all(isinstance(pk, int) for pk in ids):
+        return HttpResponseBadRequest("ids must be integers")
+
+    files = await sync_to_async(_zip_files)(ids)
+    if not files:
+        return HttpResponseNotFound("no files to download")
+
+    return _zip_response(
+        aiter_sync(metrics.timed_iter("zip", iter_zip(unique_arcnames(files))))
+    )
+
+
+async def _aiter_job_events(pk: int):
+    poll_interval = settings.JOB_EVENTS_POLL_INTERVAL
+    yield f"retry: {int(poll_interval * 1000)}\n\n".encode()
+    snapshot_of = sync_to_async(_job_snapshot)
+    deadline = time.monotonic() + settings.JOB_EVENTS_ASYNC_MAX_DURATION
+    heartbeat_at = time.monotonic() + settings.JOB_EVENTS_HEARTBEAT
+    last = None
+    while True:
+        snapshot = await snapshot_of(pk)
+        if snapshot is None:
+            yield _sse("done", {"error": "job not found"})
+            return
+        message = _job_event(snapshot, last)
+        last = snapshot
+        if message:
+            yield message
+            if snapshot["status"] in GenerationJob.FINISHED_STATUSES:
+                return
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now >= heartbeat_at:
+            heartbeat_at = now + settings.JOB_EVENTS_HEARTBEAT
+            yield b": keep-alive\n\n"
+        await asyncio.sleep(poll_interval)
+
+
+@login_required
+@require_GET
+async def job_events(request, pk: int):
+    exists = await GenerationJob.objects.filter(pk=pk).aexists()
+    if not exists:
+        return HttpResponseNotFound("job not found")
+    return _job_events_response(_aiter_job_events(pk))
+
+
+@login_required
+@require_POST
+async def submit_batch(request):
+    batch, concurrency = await sync_to_async(_prepare_batch)(request)
+    if concurrency is None:
+        return batch
+    return _batch_stream_response(batch, concurrency, wrap=aiter_sync)
+
+
+@login_required
+@require_POST
+async def resume_batch(request, pk: int):
+    batch, concurrency = await sync_to_async(_prepare_batch)(request, pk)
+    if concurrency is None:
+        return batch
+    return _batch_stream_response(batch, concurrency, wrap=aiter_sync)
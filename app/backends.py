@@ -0,0 +1,314 @@
+"""
+Routing of generation calls over one or more xinference backends.
+
+Each call goes to the healthy backend with the fewest outstanding requests
+relative to its weight. A backend that fails ``XINFERENCE_BREAKER_FAILURES``
+times in a row is ejected for ``XINFERENCE_BREAKER_COOLDOWN`` seconds; after
+that one trial request (or a successful health probe) decides whether it is
+re-admitted. Failures that happen before the backend could have started the
+work (connection refused, 502/503/504) are retried on another backend.
+"""
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+class NoBackendAvailable(RuntimeError):
+    """Every backend able to serve the model is ejected or excluded."""
+
+
+def _load_env_file(path: Path) -> dict:
+    env = {}
+    if not path.exists():
+        return env
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        env[key.strip()] = value.strip()
+    return env
+
+
+@functools.cache
+def xinference_base_url() -> str:
+    """
+    The XINFERENCE_BASE_URL setting, resolved once per process on first use
+    rather than at import: the environment wins over env.local, then .env.
+    May hold several comma-separated URLs; see ``configured_backends``.
+    """
+    env_val = os.environ.get("XINFERENCE_BASE_URL")
+    if env_val:
+        return env_val.rstrip("/")
+
+    for fname in ("env.local", ".env"):
+        env_map = _load_env_file(BASE_DIR / fname)
+        if "XINFERENCE_BASE_URL" in env_map:
+            return env_map["XINFERENCE_BASE_URL"].rstrip("/")
+
+    return "http://127.0.0.1:9997"
+
+
+def configured_backends() -> list:
+    """
+    ``settings.XINFERENCE_BACKENDS`` if set, otherwise one backend per
+    comma-separated URL in ``XINFERENCE_BASE_URL``.
+    """
+    if settings.XINFERENCE_BACKENDS:
+        return [dict(entry) for entry in settings.XINFERENCE_BACKENDS]
+    return [
+        {"url": url.strip()}
+        for url in xinference_base_url().split(",")
+        if url.strip()
+    ]
+
+
+class Backend:
+    def __init__(self, url: str, weight: float = 1, models=None):
+        self.url = url.rstrip("/")
+        self.weight = max(float(weight), 0.001)
+        self.models = set(models) if models else None
+        self.inflight = 0
+        self.failures = 0
+        self.open_until = None  # set while the breaker is open
+        self.trial = False  # a half-open trial request is in flight
+
+    def serves(self, service_model: str) -> bool:
+        return self.models is None or service_model in self.models
+
+    def available(self, now: float) -> bool:
+        if self.open_until is None:
+            return True
+        return now >= self.open_until and not self.trial
+
+    def as_dict(self, now: float) -> dict:
+        if self.open_until is None:
+            state = "closed"
+        elif now >= self.open_until:
+            state = "half-open"
+        else:
+            state = "open"
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "models": sorted(self.models) if self.models else None,
+            "inflight": self.inflight,
+            "failures": self.failures,
+            "state": state,
+        }
+
+
+class Router:
+    """Least-outstanding-requests routing with a per-backend circuit breaker."""
+
+    def __init__(self, backends, failure_threshold: int, cooldown: float):
+        self.backends = [Backend(**entry) for entry in backends]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._rotation = itertools.count()
+
+    def acquire(self, service_model: str, exclude=()):
+        """Reserve the least loaded usable backend, or return ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                backend
+                for backend in self.backends
+                if backend.serves(service_model)
+                and backend.url not in exclude
+                and backend.available(now)
+            ]
+            if not candidates:
+                return None
+            # rotate so that ties are spread instead of always hitting the first
+            offset = next(self._rotation) % len(candidates)
+            candidates = candidates[offset:] + candidates[:offset]
+            backend = min(candidates, key=lambda b: (b.inflight + 1) / b.weight)
+            backend.inflight += 1
+            if backend.open_until is not None:
+                backend.trial = True
+            return backend
+
+    def release(self, backend: Backend, failed: bool) -> None:
+        with self._lock:
+            backend.inflight -= 1
+            if failed:
+                self._record_failure(backend)
+            else:
+                self._record_success(backend)
+
+    def _record_failure(self, backend: Backend) -> None:
+        half_open = backend.trial
+        backend.trial = False
+        backend.failures += 1
+        if half_open or backend.failures >= self.failure_threshold:
+            if backend.open_until is None or half_open:
+                logger.warning("ejecting xinference backend %s", backend.url)
+            backend.open_until = time.monotonic() + self.cooldown
+
+    def _record_success(self, backend: Backend) -> None:
+        if backend.open_until is not None:
+            logger.info("re-admitting xinference backend %s", backend.url)
+        backend.failures = 0
+        backend.open_until = None
+        backend.trial = False
+
+    def probe(self) -> None:
+        """Check every backend once and update its breaker."""
+        import httpx
+
+        path = settings.XINFERENCE_HEALTH_PATH
+        for backend in self.backends:
+            try:
+                resp = httpx.get(f"{backend.url}{path}", timeout=settings.XINFERENCE_HEALTH_TIMEOUT)
+                healthy = resp.status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+            with self._lock:
+                if healthy:
+                    self._record_success(backend)
+                elif not backend.trial:
+                    self._record_failure(backend)
+
+    def snapshot(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [backend.as_dict(now) for backend in self.backends]
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Errors that say something about the backend rather than the request."""
+    import httpx
+
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Failures after which the backend cannot have started the generation."""
+    import httpx
+
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, ConnectionRefusedError))
+
+
+_router = None
+_router_lock = threading.Lock()
+_prober = None
+
+
+def _probe_forever(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        router = _router
+        if router is None:
+            continue
+        try:
+            router.probe()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("xinference health probe failed", exc_info=True)
+
+
+def get_router() -> Router:
+    global _router, _prober
+    with _router_lock:
+        if _router is None:
+            _router = Router(
+                configured_backends(),
+                failure_threshold=settings.XINFERENCE_BREAKER_FAILURES,
+                cooldown=settings.XINFERENCE_BREAKER_COOLDOWN,
+            )
+            interval = settings.XINFERENCE_HEALTH_INTERVAL
+            if interval and len(_router.backends) > 1 and _prober is None:
+                _prober = threading.Thread(
+                    target=_probe_forever,
+                    args=(interval,),
+                    name="xinference-health",
+                    daemon=True,
+                )
+                _prober.start()
+        return _router
+
+
+def reset_router() -> None:
+    """Rebuild the router from settings (and the environment) on next use."""
+    global _router
+    with _router_lock:
+        _router = None
+        xinference_base_url.cache_clear()
+
+
+def _next_backend(router: Router, service_model: str, tried: set, last_exc):
+    backend = router.acquire(service_model, exclude=tried)
+    if backend is None:
+        if last_exc is not None:
+            raise last_exc
+        raise NoBackendAvailable(f"没有可用的 xinference 后端: {service_model}")
+    return backend
+
+
+def _should_retry(router: Router, backend: Backend, exc: BaseException, tried: set, attempt: int) -> bool:
+    router.release(backend, failed=is_backend_failure(exc))
+    tried.add(backend.url)
+    if attempt >= settings.XINFERENCE_RETRY_ATTEMPTS or not is_retryable(exc):
+        return False
+    logger.warning("xinference backend %s failed (%s), retrying elsewhere", backend.url, exc)
+    return True
+
+
+def call(service_model: str, fn):
+    """Run ``fn(base_url)`` on a routed backend, retrying on another one if safe."""
+    router = get_router()
+    tried = set()
+    last_exc = None
+    for attempt in itertools.count():
+        backend = _next_backend(router, service_model, tried, last_exc)
+        try:
+            result = fn(backend.url)
+        except Exception as exc:
+            if not _should_retry(router, backend, exc, tried, attempt):
+                raise
+            last_exc = exc
+            continue
+        except BaseException:
+            router.release(backend, failed=False)
+            raise
+        router.release(backend, failed=False)
+        return result
+
+
+async def acall(service_model: str, fn):
+    """``call`` for coroutine functions: awaits ``fn(base_url)``."""
+    router = get_router()
+    tried = set()
+    last_exc = None
+    for attempt in itertools.count():
+        backend = _next_backend(router, service_model, tried, last_exc)
+        try:
+            result = await fn(backend.url)
+        except Exception as exc:
+            if not _should_retry(router, backend, exc, tried, attempt):
+                raise
+            last_exc = exc
+            continue
+        except BaseException:
+            router.release(backend, failed=False)
+            raise
+        router.release(backend, failed=False)
+        return result
@@ -0,0 +1,98 @@
+import json
+import threading
+
+from django.conf import settings
+
+
+class _Batch:
+    def __init__(self, inputs: dict):
+        self.inputs = inputs
+        self.size = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesce identical concurrent calls into one call that asks for ``n``
+    outputs, then hand one output back to each caller.
+
+    The first caller for a given set of inputs becomes the leader: it waits
+    up to ``max_wait`` seconds (or until ``max_batch`` callers joined), runs
+    ``call(inputs, n)`` in its own thread and fans the returned list out.
+    Later callers only block until the leader is done, so the extra latency
+    is bounded by ``max_wait``.
+    """
+
+    def __init__(self, call, max_batch: int, max_wait: float):
+        self._call = call
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, inputs: dict):
+        key = json.dumps(inputs, sort_keys=True, default=str)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch(inputs)
+                self._pending[key] = batch
+            index = batch.size
+            batch.size += 1
+            if batch.size >= self.max_batch:
+                del self._pending[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            try:
+                batch.results = self._call(batch.inputs, batch.size)
+            except BaseException as exc:  # pylint: disable=broad-except
+                batch.error = exc
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        if index >= len(batch.results):
+            raise ValueError(f"批量生成只返回了 {len(batch.results)} 个结果")
+        return batch.results[index]
+
+
+def split_results(result, n: int) -> list:
+    """Split a gallery-style result for ``n`` outputs into one result per caller."""
+    if n == 1:
+        return [result]
+    if isinstance(result, (list, tuple)):
+        return [[item] for item in result]
+    return [result]
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return settings.IMAGE_BATCHING_ENABLED
+
+
+def get_batcher(name: str, call) -> MicroBatcher:
+    with _batchers_lock:
+        batcher = _batchers.get(name)
+        if batcher is None:
+            batcher = MicroBatcher(
+                call,
+                max_batch=settings.IMAGE_BATCH_MAX_SIZE,
+                max_wait=settings.IMAGE_BATCH_MAX_WAIT,
+            )
+            _batchers[name] = batcher
+        return batcher
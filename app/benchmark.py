@@ -0,0 +1,312 @@
+"""
+Benchmark scenarios driven through Django's test clients against an isolated
+database, media root and a ``FakeXinference`` server.
+
+Each scenario issues ``requests`` calls with ``concurrency`` workers and
+reports throughput, latency percentiles and the process' peak RSS. Under
+``USE_ASYNC_VIEWS`` the async views are driven from one event loop with
+``AsyncClient``; otherwise threads with one ``Client`` each.
+"""
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Max, Min
+from django.test import AsyncClient, Client
+
+from .models import MediaRecord
+from .pagination import encode_cursor
+
+SCENARIOS = (
+    "generate_image",
+    "generate_audio",
+    "generate_video",
+    "list_first_page",
+    "list_cursor",
+    "list_filtered",
+    "list_search",
+    "download_record",
+    "download_zip",
+)
+
+SEED_BLOBS = 8
+ZIP_SIZE = 10
+
+# what a fresh web worker imports before serving its first request
+STARTUP_CODE = "import django; django.setup(); import app.urls"
+# dependencies that only the generation, bulk and derivative paths need
+HEAVY_MODULES = ("gradio_client", "huggingface_hub", "httpx", "requests", "numpy", "pandas", "PIL")
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(name: str, latencies: list, errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _importtime(stderr: str) -> list:
+    """``(module, self_us, cumulative_us, depth)`` rows of ``-X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(own), int(cumulative), depth))
+    return rows
+
+
+def startup_report(runs: int = 5, top: int = 15) -> dict:
+    """
+    Cold-start cost of a worker: run ``STARTUP_CODE`` under ``python -X
+    importtime`` in ``runs`` fresh interpreters and report the median wall
+    time, the median total import time, the slowest top-level imports of the
+    last run and which heavy optional dependencies were loaded eagerly.
+    """
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get(
+        "DJANGO_SETTINGS_MODULE", "absaigen.settings")}
+    walls, imports, rows = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        walls.append(time.perf_counter() - start)
+        rows = _importtime(proc.stderr)
+        imports.append(sum(cumulative for _, _, cumulative, depth in rows if depth == 0))
+    loaded = {name.split(".", 1)[0] for name, _, _, _ in rows}
+    slowest = sorted((row for row in rows if row[3] == 0), key=lambda row: row[2], reverse=True)
+    return {
+        "runs": runs,
+        "wall_ms": round(statistics.median(walls) * 1000, 1),
+        "import_ms": round(statistics.median(imports) / 1000, 1),
+        "eager_heavy_modules": [name for name in HEAVY_MODULES if name in loaded],
+        "slowest_imports": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1),
+             "self_ms": round(own / 1000, 1)}
+            for name, own, cumulative, _ in slowest[:top]
+        ],
+    }
+
+
+def seed_records(count: int, batch_size: int = 10000, progress=None) -> None:
+    """
+    Bulk-insert ``count`` records pointing at a few shared files. Signals do
+    not run for ``bulk_create``, so blob reference counts are not touched;
+    the benchmark database is thrown away afterwards.
+    """
+    suffixes = {"image": ".png", "audio": ".mp3", "video": ".mp4"}
+    names = {
+        media_type: [
+            default_storage.save(
+                f"{media_type}/seed{suffix}", ContentFile(f"{media_type}-{i}".encode() * 4096)
+            )
+            for i in range(SEED_BLOBS)
+        ]
+        for media_type, suffix in suffixes.items()
+    }
+    media_types = list(suffixes)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        batch = []
+        for offset in range(size):
+            media_type = media_types[(created + offset) % len(media_types)]
+            name = names[media_type][(created + offset) % SEED_BLOBS]
+            batch.append(MediaRecord(
+                media_type=media_type,
+                model="广科院",
+                prompt=f"seed prompt {created + offset}",
+                file=name,
+                result_url=default_storage.url(name),
+            ))
+        MediaRecord.objects.bulk_create(batch)
+        created += size
+        if progress:
+            progress(created)
+
+
+def _body(response) -> int:
+    if getattr(response, "streaming", False):
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+async def _abody(response) -> int:
+    if getattr(response, "streaming", False):
+        total = 0
+        async for chunk in response.streaming_content:
+            total += len(chunk)
+        return total
+    return len(response.content)
+
+
+class Runner:
+    def __init__(self, user, requests: int, concurrency: int, use_async: bool):
+        self.user = user
+        self.requests = requests
+        self.concurrency = concurrency
+        self.use_async = use_async
+        self._local = threading.local()
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+
+    def _next(self) -> int:
+        with self._counter_lock:
+            self._counter += 1
+            return self._counter
+
+    # -- request builders: (method, path, json body or query) -----------------
+
+    def _generate(self, media_type: str):
+        def build():
+            return "post", f"/api/{media_type}/", {"prompt": f"benchmark {self._next()}"}, 201
+        return build
+
+    def _list_first_page(self):
+        return "get", "/api/records/", {"page_size": 20, "total": "approx"}, 200
+
+    def _list_cursor(self):
+        return "get", "/api/records/", {"cursor": random.choice(self._cursors), "page_size": 20}, 200
+
+    def _list_filtered(self):
+        return "get", "/api/records/", {
+            "cursor": "", "page_size": 20, "media_type": random.choice(["image", "audio", "video"])
+        }, 200
+
+    def _list_search(self):
+        return "get", "/api/records/", {
+            "q": str(random.randint(100, 999999)), "cursor": "", "page_size": 20
+        }, 200
+
+    def _download_record(self):
+        return "get", f"/api/records/{random.choice(self._ids)}/download/", None, 200
+
+    def _download_zip(self):
+        ids = random.sample(self._ids, min(ZIP_SIZE, len(self._ids)))
+        return "post", "/api/records/download/", {"ids": ids}, 200
+
+    def prepare(self) -> None:
+        """Sample record ids and cursors spread over the whole table."""
+        bounds = MediaRecord.objects.aggregate(low=Min("id"), high=Max("id"))
+        if bounds["low"] is None:
+            self._ids, self._cursors = [0], [""]
+            return
+        population = range(bounds["low"], bounds["high"] + 1)
+        self._ids = random.sample(population, min(1000, len(population)))
+        self._cursors = [
+            encode_cursor(record)
+            for record in MediaRecord.objects.filter(id__in=self._ids[:200])
+        ] or [""]
+
+    def builder(self, scenario: str):
+        if scenario.startswith("generate_"):
+            return self._generate(scenario[len("generate_"):])
+        return getattr(self, f"_{scenario}")
+
+    # -- drivers ----------------------------------------------------------------
+
+    def _client(self) -> Client:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            # a failing view counts as an error instead of aborting the run
+            client = self._local.client = Client(raise_request_exception=False)
+            client.force_login(self.user)
+        return client
+
+    def _call(self, build) -> tuple:
+        method, path, data, expected = build()
+        client = self._client()
+        start = time.perf_counter()
+        if method == "post":
+            response = client.post(path, json.dumps(data), content_type="application/json")
+        else:
+            response = client.get(path, data or {})
+        _body(response)
+        return time.perf_counter() - start, response.status_code == expected
+
+    def run(self, scenario: str) -> dict:
+        build = self.builder(scenario)
+        if self.use_async:
+            return asyncio.run(self._arun(scenario, build))
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for latency, ok in pool.map(lambda _: self._call(build), range(self.requests)):
+                latencies.append(latency)
+                errors += not ok
+        return summarize(scenario, latencies, errors, time.perf_counter() - start)
+
+    async def _arun(self, scenario: str, build) -> dict:
+        client = AsyncClient(raise_request_exception=False)
+        await client.aforce_login(self.user)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies, errors = [], 0
+
+        async def one():
+            nonlocal errors
+            method, path, data, expected = build()
+            async with semaphore:
+                start = time.perf_counter()
+                if method == "post":
+                    response = await client.post(path, json.dumps(data), content_type="application/json")
+                else:
+                    response = await client.get(path, data or {})
+                await _abody(response)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != expected
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(self.requests)))
+        return summarize(scenario, latencies, errors, time.perf_counter() - start)
+
+
+def regressions(results: list, baseline: list, tolerance: float) -> list:
+    """Scenarios whose p95 or throughput is worse than ``baseline`` by more than ``tolerance``."""
+    previous = {row["scenario"]: row for row in baseline}
+    found = []
+    for row in results:
+        before = previous.get(row["scenario"])
+        if not before:
+            continue
+        if before["p95_ms"] and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(f"{row['scenario']}: p95 {before['p95_ms']}ms -> {row['p95_ms']}ms")
+        if before["throughput"] and row["throughput"] < before["throughput"] * (1 - tolerance):
+            found.append(
+                f"{row['scenario']}: throughput {before['throughput']}/s -> {row['throughput']}/s"
+            )
+    return found
@@ -0,0 +1,201 @@
+import contextvars
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from . import derivatives
+from .models import GenerationCacheEntry, MediaBlob, MediaRecord
+
+logger = logging.getLogger(__name__)
+
+# names per ``IN`` lookup, well below SQLite's bound parameter limit
+IN_BATCH_SIZE = 500
+
+# names released inside ``deferred_releases``, with how often
+_deferred = contextvars.ContextVar("blob_releases", default=None)
+_cleanup_executor = None
+_cleanup_lock = threading.Lock()
+
+
+def _size(name: str) -> int:
+    try:
+        return default_storage.size(name)
+    except (OSError, NotImplementedError):
+        return 0
+
+
+class MissingBlob(FileNotFoundError):
+    """A reference was taken to a stored file that has been deleted meanwhile."""
+
+
+def acquire(name: str) -> None:
+    """
+    Count one more reference to the stored file ``name``. Raises
+    ``MissingBlob`` when the file is gone, which happens when storage
+    deduplicated a new result onto a blob whose last reference was dropped
+    and whose file was then deleted; the caller's transaction should roll
+    back rather than keep a record pointing at nothing.
+    """
+    if not name:
+        return
+    with transaction.atomic():
+        updated = MediaBlob.objects.filter(name=name).update(ref_count=F("ref_count") + 1)
+        if updated:
+            # the row lock taken by the update keeps ``delete_if_unreferenced`` off the file
+            return
+        blob, created = MediaBlob.objects.select_for_update().get_or_create(
+            name=name, defaults={"size": _size(name), "ref_count": 1}
+        )
+        if not created:
+            MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1)
+        elif not default_storage.exists(name):
+            raise MissingBlob(name)
+
+
+def release(name: str) -> None:
+    """
+    Drop one reference to ``name``; once the last one is gone and the
+    transaction has committed, the file is deleted unless it was acquired
+    again in the meantime (see ``delete_if_unreferenced``).
+    """
+    if not name:
+        return
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred[name] += 1
+        return
+    with transaction.atomic():
+        blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            # not tracked yet: fall back to looking for remaining references
+            orphaned = not (
+                MediaRecord.objects.filter(file=name).exists()
+                or GenerationCacheEntry.objects.filter(file_name=name).exists()
+            )
+        else:
+            orphaned = blob.ref_count <= 1
+            if orphaned:
+                blob.delete()
+            else:
+                MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") - 1)
+        if orphaned:
+            transaction.on_commit(lambda: delete_if_unreferenced(name))
+
+
+def delete_if_unreferenced(name: str) -> bool:
+    """
+    Delete the file ``name`` if nothing references it, holding the blob row
+    lock while the file goes away: an ``acquire`` that comes first keeps the
+    file, one that comes later finds it missing and raises ``MissingBlob``.
+    Returns whether the file was deleted.
+    """
+    with transaction.atomic():
+        blob, _ = MediaBlob.objects.select_for_update().get_or_create(
+            name=name, defaults={"size": 0, "ref_count": 0}
+        )
+        # a write, so that SQLite (which ignores FOR UPDATE) takes its lock here
+        if not MediaBlob.objects.filter(pk=blob.pk, ref_count__lte=0).delete()[0]:
+            return False
+        if _still_referenced([name]):
+            return False
+        delete_file(name)
+    return True
+
+
+def _still_referenced(names: list) -> set:
+    return set(
+        MediaRecord.objects.filter(file__in=names).values_list("file", flat=True)
+    ) | set(
+        GenerationCacheEntry.objects.filter(file_name__in=names).values_list("file_name", flat=True)
+    )
+
+
+def release_many(counts: dict) -> list:
+    """
+    ``release`` for many files at once: ``counts`` maps each name to the
+    number of references dropped. Orphaned files are deleted on the cleanup
+    pool after the transaction commits; their names are returned.
+    """
+    names = [name for name, count in counts.items() if name and count]
+    orphaned = []
+    with transaction.atomic():
+        for start in range(0, len(names), IN_BATCH_SIZE):
+            chunk = names[start:start + IN_BATCH_SIZE]
+            tracked = {
+                blob.name: blob
+                for blob in MediaBlob.objects.select_for_update().filter(name__in=chunk)
+            }
+            untracked = [name for name in chunk if name not in tracked]
+            if untracked:
+                referenced = _still_referenced(untracked)
+                orphaned.extend(name for name in untracked if name not in referenced)
+            gone = []
+            for name, blob in tracked.items():
+                if blob.ref_count <= counts[name]:
+                    gone.append(blob.pk)
+                    orphaned.append(name)
+                else:
+                    MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") - counts[name])
+            MediaBlob.objects.filter(pk__in=gone).delete()
+        if orphaned:
+            transaction.on_commit(lambda: delete_files_later(orphaned))
+    return orphaned
+
+
+@contextmanager
+def deferred_releases():
+    """
+    Collect the releases made inside the block, such as those a bulk
+    ``QuerySet.delete()`` sends one row at a time, instead of applying them.
+    Yields the counter of released names for the caller to hand to
+    ``release_many`` in the same transaction.
+    """
+    counts = Counter()
+    token = _deferred.set(counts)
+    try:
+        yield counts
+    finally:
+        _deferred.reset(token)
+
+
+def discard(name: str) -> None:
+    """Delete a freshly stored file that was never referenced, unless another record shares it."""
+    if name:
+        transaction.on_commit(lambda: delete_if_unreferenced(name))
+
+
+def delete_files_later(names: list) -> None:
+    """``delete_if_unreferenced`` for ``names`` on the background cleanup pool."""
+    global _cleanup_executor
+    with _cleanup_lock:
+        if _cleanup_executor is None:
+            _cleanup_executor = ThreadPoolExecutor(
+                max_workers=settings.FILE_CLEANUP_WORKERS, thread_name_prefix="file-cleanup"
+            )
+    for name in names:
+        _cleanup_executor.submit(_delete_quietly, name)
+
+
+def _delete_quietly(name: str) -> None:
+    try:
+        delete_if_unreferenced(name)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("failed to clean up blob %s", name)
+    finally:
+        close_old_connections()
+
+
+def delete_file(name: str) -> None:
+    try:
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        derivatives.delete_for(name)
+    except OSError:
+        logger.exception("failed to delete blob %s", name)
@@ -0,0 +1,271 @@
+"""
+Bulk generation from CSV or JSONL prompt files.
+
+An upload becomes a ``GenerationBatch`` with one ``GenerationBatchItem`` per
+row. ``run_batch`` fans the pending items out to xinference on a bounded
+thread pool, claiming each item as it starts, and saves every finished
+record together with its item, so an interrupted batch resumes with the
+items that were not recorded yet. Every item holds an admission lease of
+the batch's user while it runs, so a batch stays within the same per-user
+and global limits as synchronous generations and jobs.
+"""
+import io
+import json
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import admission
+from .generation import MEDIA_TYPES, GenerationError, InvalidParams, parse_params, render, save_rendered
+from .models import GenerationBatch, GenerationBatchItem
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+
+
+class InvalidBatch(ValueError):
+    pass
+
+
+def detect_format(name: str, content_type: str = "") -> str:
+    suffix = PurePosixPath(name or "").suffix.lower()
+    if suffix in {".jsonl", ".ndjson", ".json"} or "json" in content_type:
+        return "jsonl"
+    return "csv"
+
+
+def _cell(value):
+    # JSON numbers, booleans and objects become their JSON text
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _read_jsonl(data: bytes) -> list:
+    rows = []
+    for number, line in enumerate(data.decode("utf-8-sig").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            raise InvalidBatch(f"could not parse jsonl line {number}: {exc}") from exc
+        if not isinstance(row, dict):
+            raise InvalidBatch(f"jsonl line {number} is not an object")
+        rows.append({str(key).strip(): _cell(value) for key, value in row.items()})
+    if not any("prompt" in row for row in rows):
+        raise InvalidBatch("a prompt column is required")
+    return rows
+
+
+def read_rows(data: bytes, fmt: str) -> list:
+    """Rows of a CSV (with a header line) or JSONL file as dicts of strings (or None)."""
+    if fmt not in FORMATS:
+        raise InvalidBatch(f"unsupported format: {fmt}")
+    if fmt == "jsonl":
+        try:
+            return _read_jsonl(data)
+        except UnicodeDecodeError as exc:
+            raise InvalidBatch(f"could not parse jsonl: {exc}") from exc
+
+    import pandas as pd
+
+    try:
+        frame = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    except ValueError as exc:
+        raise InvalidBatch(f"could not parse csv: {exc}") from exc
+    frame.columns = [str(column).strip() for column in frame.columns]
+    if "prompt" not in frame.columns:
+        raise InvalidBatch("a prompt column is required")
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict(orient="records")
+
+
+def create_batch(rows: list, media_type: str | None = None, user=None,
+                 source_name: str = "") -> GenerationBatch:
+    """
+    Store ``rows`` as a new batch. A row's own ``media_type`` overrides the
+    batch default; rows whose parameters do not validate are stored as
+    failed items so the rest of the batch still runs.
+    """
+    if not rows:
+        raise InvalidBatch("no rows")
+    if len(rows) > settings.BULK_GENERATION_MAX_ITEMS:
+        raise InvalidBatch(f"at most {settings.BULK_GENERATION_MAX_ITEMS} rows per batch")
+    items = []
+    for index, row in enumerate(rows):
+        row_type = row.get("media_type") or media_type
+        item = GenerationBatchItem(index=index, media_type=row_type or "")
+        try:
+            if row_type not in MEDIA_TYPES:
+                raise InvalidParams("Invalid media_type")
+            item.params = parse_params(row_type, row)
+        except InvalidParams as exc:
+            item.status, item.error, item.detail = GenerationBatchItem.STATUS_FAILED, "参数无效", str(exc)
+            item.params = {k: v for k, v in row.items() if v is not None}
+        except GenerationError as exc:
+            item.status, item.error, item.detail = GenerationBatchItem.STATUS_FAILED, exc.error, exc.detail
+            item.params = {k: v for k, v in row.items() if v is not None}
+        if item.status == GenerationBatchItem.STATUS_FAILED:
+            item.finished_at = timezone.now()
+        items.append(item)
+    with transaction.atomic():
+        batch = GenerationBatch.objects.create(
+            user=user if user is not None and user.is_authenticated else None,
+            source_name=source_name[:255],
+        )
+        for item in items:
+            item.batch = batch
+        GenerationBatchItem.objects.bulk_create(items)
+    return batch
+
+
+def get_concurrency(requested=None) -> int:
+    limit = settings.BULK_GENERATION_MAX_CONCURRENCY
+    if requested in (None, ""):
+        return min(settings.BULK_GENERATION_CONCURRENCY, limit)
+    try:
+        return max(1, min(int(requested), limit))
+    except (TypeError, ValueError) as exc:
+        raise InvalidBatch("invalid concurrency") from exc
+
+
+def _render_item(item: GenerationBatchItem):
+    try:
+        return render(item.media_type, item.params)
+    finally:
+        close_old_connections()
+
+
+def _claimable(items):
+    """Pending ``items``, and running ones whose runner has been gone too long."""
+    abandoned = timezone.now() - timedelta(seconds=settings.BULK_GENERATION_CLAIM_TIMEOUT)
+    return items.filter(
+        Q(status=GenerationBatchItem.STATUS_PENDING)
+        | Q(status=GenerationBatchItem.STATUS_RUNNING, claimed_at__lt=abandoned)
+    )
+
+
+def _claim(item: GenerationBatchItem) -> bool:
+    """Atomically take ``item`` for this runner; False if another one has it."""
+    now = timezone.now()
+    claimed = _claimable(GenerationBatchItem.objects.filter(pk=item.pk)).update(
+        status=GenerationBatchItem.STATUS_RUNNING, claimed_at=now
+    )
+    if claimed:
+        item.status, item.claimed_at = GenerationBatchItem.STATUS_RUNNING, now
+    return bool(claimed)
+
+
+def _finish(item: GenerationBatchItem, rendered) -> GenerationBatchItem:
+    """Insert the item's record, if it has one, and store its outcome."""
+    with transaction.atomic():
+        if rendered is not None:
+            try:
+                item.record = save_rendered([rendered])[0]
+                item.status = GenerationBatchItem.STATUS_SUCCEEDED
+            except GenerationError as exc:
+                item.status = GenerationBatchItem.STATUS_FAILED
+                item.error, item.detail = exc.error, exc.detail
+        item.finished_at = timezone.now()
+        item.save(update_fields=["status", "record", "error", "detail", "finished_at"])
+    return item
+
+
+def _failed(item: GenerationBatchItem, error: str, detail: str) -> GenerationBatchItem:
+    item.status = GenerationBatchItem.STATUS_FAILED
+    item.error, item.detail = error, detail
+    return _finish(item, None)
+
+
+def run_batch(batch: GenerationBatch, concurrency: int):
+    """
+    Generate every pending item of ``batch`` with at most ``concurrency``
+    calls in flight, saving and yielding each item as soon as it finishes.
+    Items are claimed one at a time just before they start, so runners
+    resuming the same batch concurrently share the work instead of doing
+    it twice. An item only starts once ``admission`` grants it a lease; while
+    the batch's user is at a limit the batch waits instead of failing items.
+    Closing the generator stops scheduling new items; the ones already
+    running are waited for and recorded.
+    """
+    pending = deque(_claimable(batch.items).order_by("index"))
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"batch-{batch.pk}")
+
+    def submit_next():
+        """Start the next claimable item; the seconds to wait if admission refused it."""
+        while pending:
+            item = pending[0]
+            try:
+                lease = admission.acquire(batch.user, item.media_type)
+            except admission.Rejected as exc:
+                return exc.retry_after
+            pending.popleft()
+            if _claim(item):
+                running[executor.submit(_render_item, item)] = (item, lease)
+                return None
+            admission.release(lease)
+        return None
+
+    def fill():
+        while len(running) < concurrency and pending:
+            retry_after = submit_next()
+            if retry_after is not None:
+                return retry_after
+        return None
+
+    try:
+        retry_after = fill()
+        while running or pending:
+            if not running:
+                time.sleep(retry_after or 0)
+                retry_after = fill()
+                continue
+            finished, _ = wait(running, timeout=retry_after, return_when=FIRST_COMPLETED)
+            for future in finished:
+                item, lease = running.pop(future)
+                admission.release(lease)
+                try:
+                    rendered = future.result()
+                except GenerationError as exc:
+                    _failed(item, exc.error, exc.detail)
+                except Exception as exc:  # pylint: disable=broad-except
+                    logger.exception("batch %s item %s crashed", batch.pk, item.index)
+                    _failed(item, "生成任务执行失败", str(exc))
+                else:
+                    _finish(item, rendered)
+                yield item
+            retry_after = fill()
+    finally:
+        # reached on early close too: record whatever still finishes and
+        # hand items that never started back to the queue
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future, (item, lease) in running.items():
+            admission.release(lease)
+            if future.cancelled() or future.exception() is not None:
+                GenerationBatchItem.objects.filter(
+                    pk=item.pk, status=GenerationBatchItem.STATUS_RUNNING
+                ).update(status=GenerationBatchItem.STATUS_PENDING, claimed_at=None)
+            else:
+                _finish(item, future.result())
+        if not batch.items.exclude(status__in=GenerationBatchItem.FINISHED_STATUSES).exists():
+            GenerationBatch.objects.filter(pk=batch.pk).update(finished_at=timezone.now())
+
+
+def summary(batch: GenerationBatch) -> dict:
+    counts = {status: 0 for status, _ in GenerationBatchItem.STATUS_CHOICES}
+    for row in batch.items.values("status").annotate(n=Count("pk")):
+        counts[row["status"]] = row["n"]
+    return {"total": sum(counts.values()), **counts}
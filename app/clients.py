@@ -0,0 +1,200 @@
+"""
+Pooled gradio_client connections to xinference.
+
+gradio_client (and huggingface_hub behind it) takes longer to import than the
+rest of the app, so it is imported on the first connection rather than when
+the views load; management commands and workers that never generate do not
+pay for it.
+"""
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def _app_errors() -> tuple:
+    """Errors raised by the remote app itself; the connection is still usable."""
+    from gradio_client.exceptions import AppError, ValidationError
+
+    return (AppError, ValidationError)
+
+
+def _schema_cache_path(src: str) -> Path:
+    digest = hashlib.sha1(src.encode("utf-8")).hexdigest()
+    return Path(settings.GRADIO_SCHEMA_CACHE_DIR) / f"{digest}.json"
+
+
+def load_schema(src: str):
+    """The cached config and API info of the gradio app at ``src``, or None when missing or stale."""
+    path = _schema_cache_path(src)
+    try:
+        if time.time() - path.stat().st_mtime > settings.GRADIO_SCHEMA_CACHE_TTL:
+            return None
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def save_schema(src: str, schema: dict) -> None:
+    """Cache ``schema`` for every process; failures are logged, not raised."""
+    path = _schema_cache_path(src)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(schema))
+        tmp.replace(path)
+    except (OSError, TypeError, ValueError):
+        logger.warning("could not write gradio schema cache for %s", src, exc_info=True)
+
+
+def invalidate_schema(src: str) -> None:
+    _schema_cache_path(src).unlink(missing_ok=True)
+
+
+@functools.cache
+def client_class():
+    """
+    ``CachedSchemaClient``, defined on first use so that importing this
+    module does not import gradio_client.
+    """
+    from gradio_client import Client
+
+    class CachedSchemaClient(Client):
+        """
+        A gradio ``Client`` that reuses the app config and API info fetched by
+        any earlier process instead of downloading them on every construction.
+        """
+
+        def __init__(self, src: str, **kwargs):
+            self._cached_schema = load_schema(src)
+            super().__init__(src, **kwargs)
+            if self._cached_schema is None:
+                save_schema(src, {"config": self.config, "info": self._info})
+
+        def _get_config(self) -> dict:
+            if self._cached_schema is not None:
+                return self._cached_schema["config"]
+            return super()._get_config()
+
+        def _get_api_info(self):
+            if self._cached_schema is not None:
+                return self._cached_schema["info"]
+            return super()._get_api_info()
+
+    return CachedSchemaClient
+
+
+class ClientPool:
+    """Idle clients for a single service URL, handed out one caller at a time."""
+
+    def __init__(self, src: str, max_idle: int, idle_timeout: float):
+        self.src = src
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (client, released_at)
+        self._lock = threading.Lock()
+
+    def _create(self):
+        try:
+            return client_class()(self.src, verbose=False, analytics_enabled=False)
+        except Exception:
+            # a stale cached schema must not keep a broken client alive
+            invalidate_schema(self.src)
+            raise
+
+    def acquire(self):
+        now = time.monotonic()
+        expired = []
+        client = None
+        with self._lock:
+            while self._idle:
+                candidate, released_at = self._idle.pop()
+                if now - released_at > self.idle_timeout:
+                    expired.append(candidate)
+                    continue
+                client = candidate
+                break
+        for stale in expired:
+            _close(stale)
+        return client or self._create()
+
+    def release(self, client) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((client, time.monotonic()))
+                return
+        _close(client)
+
+    def discard(self, client) -> None:
+        invalidate_schema(self.src)
+        _close(client)
+
+    def clear(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            _close(client)
+
+
+def _close(client) -> None:
+    try:
+        client.close()
+    except Exception:  # pylint: disable=broad-except
+        logger.debug("error closing gradio client", exc_info=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(src: str) -> ClientPool:
+    with _pools_lock:
+        pool = _pools.get(src)
+        if pool is None:
+            pool = ClientPool(
+                src,
+                max_idle=settings.GRADIO_CLIENT_MAX_IDLE,
+                idle_timeout=settings.GRADIO_CLIENT_IDLE_TIMEOUT,
+            )
+            _pools[src] = pool
+        return pool
+
+
+def clear_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.clear()
+
+
+@contextmanager
+def checkout(src: str):
+    """
+    Borrow a connected client for ``src``. Clients are returned to the pool
+    afterwards unless the call failed for a non-application reason, in which
+    case the client (and its cached schema) is dropped and rebuilt next time.
+    """
+    pool = get_pool(src)
+    with metrics.timed("connect"):
+        client = pool.acquire()
+    try:
+        yield client
+    except BaseException as exc:
+        if isinstance(exc, _app_errors()):
+            pool.release(client)
+        else:
+            pool.discard(client)
+        raise
+    pool.release(client)
@@ -0,0 +1,30 @@
+"""
+Named counters kept in the database, so that every process (web server,
+``run_generation_workers``, management commands) sees the same values no
+matter which cache backend is configured.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Counter
+
+
+def increment(name: str, by: int = 1) -> None:
+    if Counter.objects.filter(name=name).update(value=F("value") + by):
+        return
+    try:
+        with transaction.atomic():
+            Counter.objects.create(name=name, value=by)
+    except IntegrityError:
+        # another process created the row first
+        Counter.objects.filter(name=name).update(value=F("value") + by)
+
+
+def get(name: str) -> int:
+    return Counter.objects.filter(name=name).values_list("value", flat=True).first() or 0
+
+
+def get_many(names) -> dict:
+    """``{name: value}`` for every name, 0 for the ones never incremented."""
+    values = dict(Counter.objects.filter(name__in=names).values_list("name", "value"))
+    return {name: values.get(name, 0) for name in names}
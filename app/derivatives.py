@@ -0,0 +1,238 @@
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+from . import listing_cache
+from .models import MediaRecord
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = "derivatives"
+THUMBNAIL_SIZE = (320, 320)
+WAVEFORM_BUCKETS = 120
+
+_KINDS = {
+    "image": ("thumb", ".webp"),
+    "video": ("poster", ".jpg"),
+    "audio": ("waveform", ".png"),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def _relative(source_name: str, kind: str, suffix: str) -> str:
+    stem = PurePosixPath(source_name).stem
+    return f"{DERIVATIVE_DIR}/{kind}/{stem[:2]}/{stem}{suffix}"
+
+
+def _path(relative: str) -> Path:
+    return Path(settings.MEDIA_ROOT) / relative
+
+
+def _url(relative: str) -> str:
+    return f"{settings.MEDIA_URL.rstrip('/')}/{relative}"
+
+
+def thumbnail_name(source_name: str, media_type: str) -> str:
+    kind, suffix = _KINDS[media_type]
+    return _relative(source_name, kind, suffix)
+
+
+def peaks_name(source_name: str) -> str:
+    return _relative(source_name, "waveform", ".json")
+
+
+def urls_for(source_name: str, media_type: str, ready: bool) -> dict:
+    """
+    URLs of the derivatives of ``source_name``, or ``None`` while they are
+    not ``ready`` (the record's ``derivative_state``); nothing is looked up
+    on disk.
+    """
+    if not source_name or media_type not in _KINDS:
+        return {"thumbnail_url": None}
+    urls = {"thumbnail_url": _url(thumbnail_name(source_name, media_type)) if ready else None}
+    if media_type == "audio":
+        urls["waveform_url"] = _url(peaks_name(source_name)) if ready else None
+    return urls
+
+
+def _write(relative: str, data: bytes) -> None:
+    target = _path(relative)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, target)
+
+
+def _ffmpeg():
+    return shutil.which(settings.FFMPEG_BINARY)
+
+
+def _image_thumbnail(source: Path) -> bytes:
+    from PIL import Image
+
+    with Image.open(source) as img:
+        img.thumbnail(THUMBNAIL_SIZE)
+        if img.mode not in {"RGB", "RGBA"}:
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        out = io.BytesIO()
+        img.save(out, format="WEBP", quality=80, method=4)
+        return out.getvalue()
+
+
+def _video_poster(source: Path) -> bytes:
+    ffmpeg = _ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is not available")
+    for offset in ("1", "0"):
+        proc = subprocess.run(
+            [
+                ffmpeg, "-v", "error", "-ss", offset, "-i", str(source),
+                "-frames:v", "1", "-vf", f"scale={THUMBNAIL_SIZE[0]}:-2",
+                "-f", "image2pipe", "-vcodec", "mjpeg", "pipe:1",
+            ],
+            capture_output=True,
+            timeout=60,
+            check=False,
+        )
+        if proc.returncode == 0 and proc.stdout:
+            return proc.stdout
+    raise RuntimeError(proc.stderr.decode(errors="replace") or "ffmpeg produced no frame")
+
+
+def _decode_pcm(source: Path):
+    """Mono 16-bit samples of ``source`` as a numpy array."""
+    import numpy as np
+
+    ffmpeg = _ffmpeg()
+    if ffmpeg:
+        proc = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", str(source), "-ac", "1", "-ar", "8000",
+             "-f", "s16le", "pipe:1"],
+            capture_output=True,
+            timeout=120,
+            check=True,
+        )
+        return np.frombuffer(proc.stdout, dtype="<i2")
+    with wave.open(str(source), "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise RuntimeError("only 16-bit WAV can be decoded without ffmpeg")
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+        return samples[:: wav.getnchannels()]
+
+
+def _waveform(source: Path):
+    """Return ``(peaks, png_bytes)``: normalised per-bucket peaks and a rendered strip."""
+    import numpy as np
+
+    samples = _decode_pcm(source).astype(np.float32)
+    if samples.size == 0:
+        peaks = [0.0] * WAVEFORM_BUCKETS
+    else:
+        buckets = np.array_split(np.abs(samples), WAVEFORM_BUCKETS)
+        values = np.array([b.max() if b.size else 0.0 for b in buckets])
+        top = values.max() or 1.0
+        peaks = [round(float(v / top), 3) for v in values]
+
+    from PIL import Image, ImageDraw
+
+    width, height = THUMBNAIL_SIZE[0], 64
+    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    step = width / len(peaks)
+    for index, peak in enumerate(peaks):
+        half = max(peak * (height / 2 - 2), 1)
+        x = int(index * step + step / 2)
+        draw.line(
+            [(x, height / 2 - half), (x, height / 2 + half)],
+            fill=(52, 211, 153, 255),
+            width=max(int(step) - 1, 1),
+        )
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True)
+    return peaks, out.getvalue()
+
+
+def mark(source_name: str, state: str) -> None:
+    """
+    Record ``state`` on every record of ``source_name``. Listings carry the
+    thumbnail URL that depends on it, so the listing version is bumped.
+    """
+    if MediaRecord.objects.filter(file=source_name).update(derivative_state=state):
+        listing_cache.bump()
+
+
+def build(source_name: str, media_type: str) -> None:
+    """Generate the derivatives for one stored file, skipping those that exist."""
+    source = Path(default_storage.path(source_name))
+    thumb = thumbnail_name(source_name, media_type)
+    if not source.exists():
+        return
+    if not _path(thumb).exists():
+        if media_type == "image":
+            _write(thumb, _image_thumbnail(source))
+        elif media_type == "video":
+            _write(thumb, _video_poster(source))
+        elif media_type == "audio":
+            peaks, png = _waveform(source)
+            _write(peaks_name(source_name), json.dumps(peaks).encode())
+            _write(thumb, png)
+    mark(source_name, MediaRecord.DERIVATIVES_READY)
+
+
+def _build_quietly(source_name: str, media_type: str) -> None:
+    try:
+        build(source_name, media_type)
+    except Exception:  # pylint: disable=broad-except
+        logger.warning("could not build %s derivative for %s", media_type, source_name, exc_info=True)
+        mark(source_name, MediaRecord.DERIVATIVES_FAILED)
+    finally:
+        with _executor_lock:
+            _pending.discard(source_name)
+        close_old_connections()
+
+
+def schedule(source_name: str, media_type: str) -> None:
+    """
+    Build derivatives in a background thread; repeated calls are coalesced.
+    A failed build is recorded on the records and retried by
+    ``build_derivatives --retry-failed``.
+    """
+    global _executor
+    if not settings.DERIVATIVES_ENABLED or media_type not in _KINDS:
+        return
+    with _executor_lock:
+        if source_name in _pending:
+            return
+        _pending.add(source_name)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.DERIVATIVE_WORKERS, thread_name_prefix="derivatives"
+            )
+    _executor.submit(_build_quietly, source_name, media_type)
+
+
+def names_for(source_name: str) -> list:
+    """Every derivative path ``source_name`` may have, relative to MEDIA_ROOT."""
+    relatives = [_relative(source_name, kind, suffix) for kind, suffix in _KINDS.values()]
+    relatives.append(peaks_name(source_name))
+    return relatives
+
+
+def delete_for(source_name: str) -> None:
+    """Remove every derivative of ``source_name`` (called when the blob is deleted)."""
+    for relative in names_for(source_name):
+        _path(relative).unlink(missing_ok=True)
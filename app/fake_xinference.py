@@ -0,0 +1,386 @@
+"""
+A local stand-in for the xinference gradio apps, for benchmarks and load tests.
+
+It serves each model in ``generation.SERVICES`` under ``/<service_model>/``
+with enough of the gradio protocol for both clients used by the app:
+``gradio_client`` (``config``/``info``, ``queue/join`` + ``queue/data`` SSE)
+and the REST ``call/<api>`` endpoints used by the async views. Every
+prediction sleeps for the configured latency, reporting queue estimation and
+step progress the way diffusion pipelines do, and returns a unique file of
+the configured size, so content-addressed storage does not dedupe results.
+A ``cancel`` call stops the event early.
+"""
+import json
+import os
+import struct
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+from .generation import SERVICES
+
+API_PREFIX = "gradio_api"
+
+_OUTPUT_COMPONENTS = {"image": "gallery", "audio": "audio", "video": "video"}
+# progress messages sent while a prediction runs
+PROGRESS_STEPS = 4
+# frame size and length of the fake videos, roughly Wan2.1 at 480p
+VIDEO_SIZE = (832, 480)
+VIDEO_SECONDS = 5
+
+
+def _box(box_type: bytes, *parts: bytes) -> bytes:
+    body = b"".join(parts)
+    return struct.pack(">I4s", len(body) + 8, box_type) + body
+
+
+def fake_mp4(data: bytes) -> bytes:
+    """
+    ``data`` wrapped as the media data of a one-track MP4 whose ``moov``
+    comes last, the way encoders write it before a fast-start pass. Not
+    playable, but its structure is what ``app.mp4`` parses and rewrites.
+    """
+    ftyp = _box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomiso2avc1mp41")
+    width, height = VIDEO_SIZE
+    mvhd = _box(b"mvhd", struct.pack(">IIIII", 0, 0, 0, 1000, VIDEO_SECONDS * 1000), bytes(80))
+    tkhd = _box(b"tkhd", struct.pack(">IIIIII", 3, 0, 0, 1, 0, VIDEO_SECONDS * 1000), bytes(52),
+                struct.pack(">II", width << 16, height << 16))
+    hdlr = _box(b"hdlr", bytes(8), b"vide", bytes(12), b"VideoHandler\0")
+    stco = _box(b"stco", struct.pack(">III", 0, 1, len(ftyp) + 8))
+    trak = _box(b"trak", tkhd, _box(b"mdia", hdlr, _box(b"minf", _box(b"stbl", stco))))
+    return ftyp + _box(b"mdat", data) + _box(b"moov", mvhd, trak)
+
+
+def _endpoint(media_type: str, service) -> dict:
+    sample = service.parse({"prompt": "sample"})
+    names = list(service.inputs(sample))
+    if service.batch_input and service.batch_input not in names:
+        names.append(service.batch_input)
+    return {
+        "media_type": media_type,
+        "api_name": service.api_name,
+        "parameters": names,
+        "suffix": service.default_suffix,
+        "batch_input": service.batch_input,
+    }
+
+
+ENDPOINTS = {service.service_model: _endpoint(mt, service) for mt, service in SERVICES.items()}
+
+
+class _Event:
+    def __init__(self, endpoint: dict, data: list, latency: float):
+        self.id = uuid4().hex
+        self.endpoint = endpoint
+        self.count = 1
+        batch_input = endpoint["batch_input"]
+        if batch_input:
+            value = data[endpoint["parameters"].index(batch_input)]
+            self.count = max(int(value or 1), 1)
+        self.ready_at = time.monotonic() + latency
+        self.cancelled = threading.Event()
+
+    def wait(self) -> bool:
+        """Sleep until ready; False if the event was cancelled first."""
+        return not self.cancelled.wait(max(self.ready_at - time.monotonic(), 0))
+
+    def steps(self):
+        """Sleep until ready in ``PROGRESS_STEPS`` slices, yielding each step index."""
+        remaining = self.ready_at - time.monotonic()
+        for step in range(PROGRESS_STEPS):
+            if self.cancelled.wait(max(remaining, 0) / PROGRESS_STEPS):
+                return
+            yield step + 1
+
+
+class _Session:
+    def __init__(self):
+        self.events = []
+        self.cond = threading.Condition()
+
+
+class FakeXinference(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 payload_size: int = 256 * 1024):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.payload = os.urandom(payload_size)
+        self.events = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeXinference":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-xinference", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def submit(self, endpoint: dict, data: list) -> _Event:
+        event = _Event(endpoint, data, self.latency)
+        with self.lock:
+            self.events[event.id] = event
+        return event
+
+    def session(self, session_hash: str) -> _Session:
+        with self.lock:
+            return self.sessions.setdefault(session_hash, _Session())
+
+    def cancel(self, event_id: str) -> None:
+        event = self.events.get(event_id)
+        if event is not None:
+            event.cancelled.set()
+
+    def content(self, event_id: str) -> bytes:
+        # a unique prefix keeps every result a distinct blob
+        data = event_id.encode() + self.payload
+        if self.events[event_id].endpoint["media_type"] == "video":
+            return fake_mp4(data)
+        return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeXinference
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    # -- helpers -----------------------------------------------------------
+
+    def _send_json(self, obj, status: int = 200) -> None:
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self) -> None:
+        self._send_json({"detail": "Not Found"}, HTTPStatus.NOT_FOUND)
+
+    def _start_stream(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _route(self):
+        """Split the path into ``(endpoint, service_model, rest, query)``."""
+        parts = urlsplit(self.path)
+        model, _, rest = parts.path.lstrip("/").partition("/")
+        endpoint = ENDPOINTS.get(model)
+        return endpoint, model, rest, parse_qs(parts.query)
+
+    def _base(self, model: str) -> str:
+        return f"{self.server.url}/{model}/{API_PREFIX}"
+
+    def _output(self, model: str, endpoint: dict, event: _Event):
+        def file_data(index: int) -> dict:
+            name = f"output_{index}{endpoint['suffix']}"
+            path = f"/tmp/gradio/{event.id}/{index}/{name}"
+            return {
+                "path": path,
+                "url": f"{self._base(model)}/file={path}",
+                "orig_name": name,
+                "size": len(self.server.content(event.id)),
+                "meta": {"_type": "gradio.FileData"},
+            }
+
+        media_type = endpoint["media_type"]
+        if media_type == "image":
+            return [{"image": file_data(i), "caption": None} for i in range(event.count)]
+        if media_type == "video":
+            return {"video": file_data(0), "subtitles": None}
+        return file_data(0)
+
+    # -- gradio app description -------------------------------------------
+
+    def _config(self, endpoint: dict) -> dict:
+        names = endpoint["parameters"]
+        components = [
+            {"id": index + 1, "type": "textbox", "props": {"label": name}}
+            for index, name in enumerate(names)
+        ]
+        output_id = len(names) + 1
+        components.append({
+            "id": output_id,
+            "type": _OUTPUT_COMPONENTS[endpoint["media_type"]],
+            "props": {},
+        })
+        return {
+            "version": "5.0.0",
+            "protocol": "sse_v3",
+            "api_prefix": f"/{API_PREFIX}",
+            "connect_heartbeat": False,
+            "components": components,
+            "dependencies": [{
+                "id": 0,
+                "api_name": endpoint["api_name"].lstrip("/"),
+                "inputs": list(range(1, output_id)),
+                "outputs": [output_id],
+                "backend_fn": True,
+                "js": None,
+                "queue": True,
+                "types": {"generator": False, "cancel": False},
+                "cancels": [],
+            }],
+        }
+
+    def _info(self, endpoint: dict) -> dict:
+        parameters = [
+            {
+                "label": name,
+                "parameter_name": name,
+                "parameter_has_default": True,
+                "parameter_default": None,
+                "type": {},
+                "python_type": {"type": "Any", "description": ""},
+                "component": "Textbox",
+            }
+            for name in endpoint["parameters"]
+        ]
+        return {
+            "named_endpoints": {endpoint["api_name"]: {"parameters": parameters, "returns": []}},
+            "unnamed_endpoints": {},
+        }
+
+    # -- request handling --------------------------------------------------
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.startswith("/status"):
+            return self._send_json({})
+        endpoint, model, rest, query = self._route()
+        if endpoint is None:
+            return self._not_found()
+        if rest == "config":
+            return self._send_json(self._config(endpoint))
+        if not rest.startswith(f"{API_PREFIX}/"):
+            return self._not_found()
+        rest = rest[len(API_PREFIX) + 1:]
+        if rest == "info":
+            return self._send_json(self._info(endpoint))
+        if rest.startswith("file="):
+            return self._send_file(rest[len("file="):])
+        if rest == "queue/data":
+            return self._stream_session(model, endpoint, query.get("session_hash", [""])[0])
+        if rest.startswith("call/"):
+            return self._stream_call(model, endpoint, rest.rsplit("/", 1)[-1])
+        return self._not_found()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        endpoint, _, rest, _ = self._route()
+        if endpoint is None:
+            return self._not_found()
+        body = self._read_json()
+        rest = rest[len(API_PREFIX) + 1:] if rest.startswith(f"{API_PREFIX}/") else rest
+        if rest == f"call{endpoint['api_name']}":
+            event = self.server.submit(endpoint, body.get("data") or [])
+            return self._send_json({"event_id": event.id})
+        if rest == "queue/join":
+            event = self.server.submit(endpoint, body.get("data") or [])
+            session = self.server.session(body.get("session_hash", ""))
+            with session.cond:
+                session.events.append(event)
+                session.cond.notify_all()
+            return self._send_json({"event_id": event.id})
+        if rest in {"reset", "cancel"}:
+            self.server.cancel(body.get("event_id", ""))
+            return self._send_json({"success": True})
+        return self._not_found()
+
+    def _send_file(self, path: str) -> None:
+        # paths look like /tmp/gradio/<event_id>/<index>/<name>
+        parts = path.strip("/").split("/")
+        event_id = parts[2] if len(parts) >= 3 else ""
+        if event_id not in self.server.events:
+            return self._not_found()
+        body = self.server.content(event_id)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_call(self, model: str, endpoint: dict, event_id: str) -> None:
+        event = self.server.events.get(event_id)
+        if event is None:
+            return self._not_found()
+        self._start_stream()
+        self.wfile.write(b"event: generating\ndata: null\n\n")
+        self.wfile.flush()
+        if not event.wait():
+            self.wfile.write(b"event: error\ndata: null\n\n")
+            return
+        data = json.dumps([self._output(model, endpoint, event)])
+        self.wfile.write(f"event: complete\ndata: {data}\n\n".encode())
+
+    def _stream_session(self, model: str, endpoint: dict, session_hash: str) -> None:
+        session = self.server.session(session_hash)
+        self._start_stream()
+        while True:
+            with session.cond:
+                if not session.events:
+                    session.cond.wait(timeout=0.1)
+                if not session.events:
+                    break
+                event = session.events.pop(0)
+                queued = len(session.events)
+            self._sse({
+                "msg": "estimation",
+                "event_id": event.id,
+                "rank": 0,
+                "queue_size": queued + 1,
+                "rank_eta": max(event.ready_at - time.monotonic(), 0),
+            })
+            self._sse({"msg": "process_starts", "event_id": event.id})
+            for step in event.steps():
+                self._sse({
+                    "msg": "progress",
+                    "event_id": event.id,
+                    "progress_data": [{
+                        "index": step,
+                        "length": PROGRESS_STEPS,
+                        "unit": "steps",
+                        "progress": None,
+                        "desc": None,
+                    }],
+                })
+            if event.cancelled.is_set():
+                self._sse({
+                    "msg": "process_completed",
+                    "event_id": event.id,
+                    "success": False,
+                    "output": {"error": "Cancelled"},
+                })
+                continue
+            self._sse({
+                "msg": "process_completed",
+                "event_id": event.id,
+                "success": True,
+                "output": {"data": [self._output(model, endpoint, event)]},
+            })
+        self._sse({"msg": "close_stream"})
+
+    def _sse(self, message: dict) -> None:
+        self.wfile.write(f"data: {json.dumps(message)}\n\n".encode())
+        self.wfile.flush()
@@ -0,0 +1,568 @@
+import logging
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import closing
+from functools import partial
+from pathlib import Path
+from typing import Callable, NamedTuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import backends, batching, blobs, clients, derivatives, listing_cache, metrics, mp4, result_cache, tts
+from .ingest import fetch_result, scratch_dir, store_result
+from .models import MediaRecord
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = ("image", "audio", "video")
+DEFAULT_MODEL = "广科院"
+# how often a running prediction's status is sampled for ``on_progress``
+PROGRESS_INTERVAL = 0.5
+
+
+class InvalidParams(ValueError):
+    """The request payload is invalid; answered with a plain 400."""
+
+
+class GenerationError(Exception):
+    """Generation failed; ``error``/``detail`` are shown to the user as-is."""
+
+    def __init__(self, error: str, detail: str = "", status: int = 502):
+        super().__init__(detail or error)
+        self.error = error
+        self.detail = detail
+        self.status = status
+
+    def as_dict(self) -> dict:
+        data = {"error": self.error}
+        if self.detail:
+            data["detail"] = self.detail
+        return data
+
+
+class GenerationCancelled(GenerationError):
+    """The caller gave up; the xinference job has been asked to stop."""
+
+    def __init__(self, detail: str = ""):
+        super().__init__("生成已取消", detail, status=409)
+
+
+class GenerationTimeout(GenerationError):
+    """The generation ran past its model's deadline and was cancelled."""
+
+    def __init__(self, seconds: float):
+        super().__init__("生成超时", f"超过 {seconds:g} 秒仍未完成，已取消该任务", status=504)
+
+
+def deadline_for(service_model: str):
+    """Seconds a prediction on ``service_model`` may take, or None for no limit."""
+    return settings.GENERATION_DEADLINES.get(service_model, settings.GENERATION_DEFAULT_DEADLINE)
+
+
+def _result_path(result):
+    """Extract the file path or URL from a gradio_client result."""
+    candidate = result
+    if isinstance(candidate, (list, tuple)) and candidate:
+        candidate = candidate[0]
+    if isinstance(candidate, dict):
+        return (
+            candidate.get("name")
+            or candidate.get("path")
+            or candidate.get("url")
+            or candidate.get("video")
+            or candidate.get("file")
+            or candidate.get("filepath")
+            or candidate.get("image")
+        )
+    if isinstance(candidate, str):
+        return candidate
+    return None
+
+
+def _result_source(result):
+    """
+    Resolve a gradio_client result to something ``store_result`` can ingest.
+    The result may be:
+    - raw bytes
+    - a local file path (str)
+    - a URL (str)
+    - a list containing the above or dicts with name/path/url
+    - a dict with name/path/url
+    """
+    if isinstance(result, (bytes, bytearray)):
+        return bytes(result)
+
+    path = _result_path(result)
+    if not path:
+        raise ValueError(f"未找到结果文件路径，返回内容: {result!r}")
+    return path
+
+
+def _result_suffix(result, default: str) -> str:
+    path = _result_path(result)
+    if isinstance(path, str) and path:
+        return Path(path.split("?", 1)[0]).suffix or default
+    return default
+
+
+def _parse_text_params(payload: dict) -> dict:
+    prompt = (payload.get("prompt") or "").strip()
+    if not prompt:
+        raise InvalidParams("prompt is required")
+    params = {
+        "prompt": prompt,
+        "model": (payload.get("model") or "").strip() or DEFAULT_MODEL,
+    }
+    if payload.get("cache") == "bypass":
+        params["cache_bypass"] = True
+    return params
+
+
+def _parse_image_params(payload: dict) -> dict:
+    params = _parse_text_params(payload)
+    if params["model"] != DEFAULT_MODEL:
+        raise GenerationError("暂未实现该模型的图像生成", status=400)
+    params["style"] = payload.get("style", "") or ""
+    return params
+
+
+def _parse_audio_params(payload: dict) -> dict:
+    params = _parse_text_params(payload)
+    if params["model"] not in {DEFAULT_MODEL, "FishSpeech-1.5"}:
+        raise GenerationError("暂未实现该模型的音频生成", status=400)
+    params["voice"] = (payload.get("voice") or "").strip()
+    if tts.wants_long_form(params["prompt"], payload.get("long_form")):
+        params["long_form"] = True
+    return params
+
+
+def _parse_video_params(payload: dict) -> dict:
+    params = _parse_text_params(payload)
+    try:
+        params.update(
+            negative_prompt=payload.get("negative_prompt", "") or "",
+            num_frames=int(payload.get("num_frames", 16) or 16),
+            fps=int(payload.get("fps", 8) or 8),
+            num_inference_steps=int(payload.get("num_inference_steps", 25) or 25),
+            guidance_scale=float(payload.get("guidance_scale", 7.5) or 7.5),
+            width=int(payload.get("width", 512) or 512),
+            height=int(payload.get("height", 512) or 512),
+        )
+    except (TypeError, ValueError) as exc:
+        raise InvalidParams(f"invalid video parameter: {exc}") from exc
+    if params["model"] != DEFAULT_MODEL:
+        raise GenerationError("暂未实现该模型的视频生成", status=400)
+    return params
+
+
+def _image_inputs(params: dict) -> dict:
+    return {
+        "prompt": params["prompt"],
+        "n": 1,
+        "size_width": 1024,
+        "size_height": 1024,
+        "guidance_scale": -1,
+        "num_inference_steps": -1,
+        "negative_prompt": None,
+        "sampler_name": "default",
+    }
+
+
+def _audio_inputs(params: dict) -> dict:
+    return {
+        "input_text": params["prompt"],
+        "voice": params.get("voice") or "",
+        "speed": 1,
+        "prompt_speech_file": None,
+        "prompt_text": params["prompt"],
+    }
+
+
+def _video_inputs(params: dict) -> dict:
+    return {
+        "prompt": params["prompt"],
+        "negative_prompt": params["negative_prompt"],
+        "num_frames": params["num_frames"],
+        "fps": params["fps"],
+        "num_inference_steps": params["num_inference_steps"],
+        "guidance_scale": params["guidance_scale"],
+        "width": params["width"],
+        "height": params["height"],
+    }
+
+
+def _video_error_detail(message: str) -> str:
+    if "ftfy" in message.lower():
+        return "xinference 模型环境缺少 ftfy，请在运行 xinference 的环境执行 `pip install ftfy` 并重启服务。"
+    return message
+
+
+class _Service(NamedTuple):
+    service_model: str
+    api_name: str
+    parse: Callable[[dict], dict]
+    inputs: Callable[[dict], dict]
+    error: str
+    default_suffix: str
+    error_detail: Callable[[str], str] = str
+    # input that asks the service for several outputs at once, if any
+    batch_input: str | None = None
+
+
+SERVICES = {
+    "image": _Service(
+        "sd3.5-medium",
+        "/text_generate_image",
+        _parse_image_params,
+        _image_inputs,
+        "图像生成失败",
+        ".png",
+        batch_input="n",
+    ),
+    "audio": _Service(
+        "FishSpeech-1.5",
+        "/tts_generate",
+        _parse_audio_params,
+        _audio_inputs,
+        "请求生成服务失败",
+        ".mp3",
+    ),
+    "video": _Service(
+        "Wan2.1-1.3B",
+        "/text_generate_video",
+        _parse_video_params,
+        _video_inputs,
+        "视频生成失败",
+        ".mp4",
+        _video_error_detail,
+    ),
+}
+
+
+def parse_params(media_type: str, payload: dict) -> dict:
+    """Validate a request payload into the parameters stored on jobs."""
+    if media_type not in SERVICES:
+        raise InvalidParams("Invalid media_type")
+    return SERVICES[media_type].parse(payload)
+
+
+def _progress(status) -> dict:
+    """Reduce a gradio_client ``StatusUpdate`` to what the job API reports."""
+    stage = status.code.value.lower()
+    progress = {
+        # PROGRESS is only a processing update that carries step data
+        "stage": "processing" if stage == "progress" else stage,
+        "queue_position": status.rank,
+        "queue_size": status.queue_size,
+        "eta": status.eta,
+    }
+    if status.progress_data:
+        unit = status.progress_data[-1]
+        fraction = unit.progress
+        if fraction is None and unit.index is not None and unit.length:
+            fraction = unit.index / unit.length
+        progress.update(
+            step=unit.index,
+            total_steps=unit.length,
+            unit=unit.unit,
+            desc=unit.desc,
+            fraction=fraction,
+        )
+    return progress
+
+
+def _wait(job, timeout, on_progress=None, should_cancel=None):
+    """
+    Wait for a gradio_client job, passing each new status to ``on_progress``.
+    The job is cancelled upstream once ``timeout`` seconds pass or
+    ``should_cancel()`` turns true.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    last = None
+    while True:
+        try:
+            return job.result(timeout=PROGRESS_INTERVAL)
+        except FutureTimeout:
+            pass
+        if should_cancel is not None and should_cancel():
+            job.cancel()
+            raise GenerationCancelled()
+        if deadline is not None and time.monotonic() >= deadline:
+            job.cancel()
+            raise GenerationTimeout(timeout)
+        if on_progress is not None:
+            progress = _progress(job.status())
+            if progress != last:
+                on_progress(progress)
+                last = progress
+
+
+def _predict(service: _Service, inputs: dict, on_progress=None, should_cancel=None):
+    timeout = deadline_for(service.service_model)
+
+    def call(base_url: str):
+        with clients.checkout(f"{base_url}/{service.service_model}/") as client:
+            with metrics.timed("predict"):
+                job = client.submit(**inputs, api_name=service.api_name)
+                return _wait(job, timeout, on_progress, should_cancel)
+
+    return backends.call(service.service_model, call)
+
+
+def _predict_batch(service: _Service, inputs: dict, n: int) -> list:
+    return batching.split_results(
+        _predict(service, {**inputs, service.batch_input: n}), n
+    )
+
+
+def _segment_synthesizer(media_type: str, service: _Service, params: dict, should_cancel=None):
+    def synthesize_one(text: str, dest_stem: Path) -> Path:
+        # runs on a pool thread, outside the caller's metrics labels
+        with metrics.bind(media_type=media_type, model=service.service_model):
+            result = _predict(service, service.inputs({**params, "prompt": text}),
+                              should_cancel=should_cancel)
+        suffix = _result_suffix(result, service.default_suffix)
+        return fetch_result(_result_source(result), dest_stem.with_suffix(suffix))
+    return synthesize_one
+
+
+def _iter_segments(media_type: str, service: _Service, params: dict, directory: Path,
+                   on_progress=None, should_cancel=None):
+    """
+    Synthesize ``params["prompt"]`` in segments, yielding ``(index, total,
+    path)`` in order. A failed segment, or closing the generator, cancels
+    the segments still running.
+    """
+    texts = tts.split_text(params["prompt"])
+    stop = threading.Event()
+
+    def cancelled() -> bool:
+        return stop.is_set() or (should_cancel is not None and should_cancel())
+
+    segments = tts.synthesize(texts, _segment_synthesizer(media_type, service, params, cancelled),
+                              directory)
+    try:
+        for index, path in segments:
+            if on_progress is not None:
+                on_progress({
+                    "stage": "processing",
+                    "queue_position": None,
+                    "queue_size": None,
+                    "eta": None,
+                    "step": index + 1,
+                    "total_steps": len(texts),
+                    "unit": "segments",
+                    "desc": None,
+                    "fraction": (index + 1) / len(texts),
+                })
+            yield index, len(texts), path
+    finally:
+        stop.set()
+        segments.close()
+
+
+def _store_segments(media_type: str, paths: list, directory: Path) -> str:
+    joined = tts.stitch(paths, directory / f"joined{paths[0].suffix}")
+    return store_result(joined, f"{media_type}/{media_type}_{uuid4().hex}{joined.suffix}",
+                        move=True)
+
+
+def store_video_file(path: Path, name: str) -> tuple:
+    """
+    Validate the local MP4 ``path``, rewrite it for progressive playback and
+    move it into storage; returns the saved name and its ``mp4.Mp4Info``.
+    """
+    try:
+        prepared, info = mp4.prepare(path)
+    except mp4.InvalidMp4 as exc:
+        raise GenerationError(SERVICES["video"].error, f"生成的视频文件无效：{exc}") from exc
+    try:
+        return store_result(prepared, name, move=True), info
+    finally:
+        prepared.unlink(missing_ok=True)
+
+
+def _store_video(source, suffix: str, name: str) -> tuple:
+    with scratch_dir("mp4-") as directory:
+        return store_video_file(fetch_result(source, directory / f"result{suffix}"), name)
+
+
+def _stored_info(media_type: str, saved_path: str):
+    """``mp4.Mp4Info`` of an already stored video (a cache hit), or None."""
+    if media_type != "video" or not mp4.handles(Path(saved_path).suffix):
+        return None
+    try:
+        return mp4.probe(Path(default_storage.path(saved_path)))
+    except (OSError, mp4.InvalidMp4):
+        logger.warning("could not read metadata of %s", saved_path, exc_info=True)
+        return None
+
+
+def _build_record(media_type: str, params: dict, saved_path: str, info=None) -> MediaRecord:
+    info = info or _stored_info(media_type, saved_path)
+    return MediaRecord(
+        media_type=media_type,
+        model=params["model"],
+        prompt=params["prompt"],
+        style=params.get("style", ""),
+        voice=params.get("voice", ""),
+        file=saved_path,
+        result_url=default_storage.url(saved_path),
+        duration=info.duration if info else None,
+        width=info.width if info else None,
+        height=info.height if info else None,
+    )
+
+
+def _cached_file(media_type: str, service: _Service, params: dict, inputs: dict):
+    """Return ``(cache_key, file_name)``; ``file_name`` is set on a cache hit."""
+    if not result_cache.is_enabled():
+        return None, None
+    cache_key = result_cache.make_key(service.service_model, service.api_name, inputs)
+    if not params.get("cache_bypass"):
+        with metrics.timed("cache_lookup"):
+            entry = result_cache.lookup(cache_key, media_type)
+        if entry is not None:
+            return None, entry.file_name
+    return cache_key, None
+
+
+def save_rendered(rendered: list) -> list:
+    """
+    Insert the records returned by ``render`` and finish their bookkeeping.
+    More than one record is inserted with a single ``bulk_create``, which
+    skips model signals, so blob references and the listing version are
+    updated here instead.
+    """
+    records = [record for record, _ in rendered]
+    with metrics.timed("db"):
+        try:
+            if len(records) == 1:
+                # atomic, so a failed blob reference rolls the record back too
+                with transaction.atomic():
+                    records[0].save()
+            elif records:
+                with transaction.atomic():
+                    MediaRecord.objects.bulk_create(records)
+                    for record in records:
+                        blobs.acquire(record.file.name)
+                listing_cache.bump()
+        except blobs.MissingBlob as exc:
+            media_type = records[0].media_type
+            raise GenerationError(SERVICES[media_type].error, "结果文件在保存时被清理，请重试") from exc
+    for record, cache_key in rendered:
+        if cache_key is not None:
+            result_cache.store(cache_key, record.media_type, SERVICES[record.media_type].service_model,
+                               record.file.name)
+        # after commit, so the build thread can mark the new records
+        transaction.on_commit(partial(derivatives.schedule, record.file.name, record.media_type))
+    return records
+
+
+def generate(media_type: str, params: dict, on_progress=None, should_cancel=None) -> MediaRecord:
+    """
+    Run one generation against xinference and persist the result. With the
+    result cache enabled, an identical earlier request is answered by a new
+    record pointing at the stored file, unless ``cache_bypass`` is set.
+    ``on_progress`` receives queue and step updates while xinference works;
+    batched image calls do not report progress. Once ``should_cancel()``
+    returns true the xinference job is cancelled, anything already stored
+    is removed and ``GenerationCancelled`` is raised.
+    """
+    service = SERVICES[media_type]
+    with metrics.bind(media_type=media_type, model=service.service_model), metrics.timed("total"):
+        rendered = _render(media_type, service, params, on_progress, should_cancel)
+        return save_rendered([rendered])[0]
+
+
+def render(media_type: str, params: dict) -> tuple:
+    """
+    Like ``generate`` but return ``(unsaved record, cache_key)`` for the
+    caller to insert with ``save_rendered``, possibly together with others.
+    """
+    service = SERVICES[media_type]
+    with metrics.bind(media_type=media_type, model=service.service_model), metrics.timed("total"):
+        return _render(media_type, service, params)
+
+
+def iter_long_form(media_type: str, params: dict):
+    """
+    ``generate`` for long-form speech that first yields ``(index, total,
+    path)`` for every segment as soon as it and the ones before it are
+    synthesized, then the saved record. A segment file is removed once the
+    record is saved, so consumers read it before asking for the next item.
+    A cache hit yields only the record; closing the generator early cancels
+    the segments still being synthesized.
+    """
+    service = SERVICES[media_type]
+    cache_key, saved_path = _cached_file(media_type, service, params, service.inputs(params))
+    if saved_path is None:
+        try:
+            with scratch_dir("tts-") as directory:
+                segments = _iter_segments(media_type, service, params, directory)
+                paths = []
+                try:
+                    for index, total, path in segments:
+                        paths.append(path)
+                        yield index, total, path
+                finally:
+                    # a client that goes away stops the segments still running
+                    segments.close()
+                saved_path = _store_segments(media_type, paths, directory)
+        except GenerationError:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception("%s long-form generation failed", media_type)
+            raise GenerationError(service.error, service.error_detail(str(exc))) from exc
+    yield save_rendered([(_build_record(media_type, params, saved_path), cache_key)])[0]
+
+
+def _render(media_type: str, service: _Service, params: dict, on_progress=None,
+            should_cancel=None) -> tuple:
+    inputs = service.inputs(params)
+    cache_key, cached_path = _cached_file(media_type, service, params, inputs)
+    if cached_path is not None:
+        return _build_record(media_type, params, cached_path), None
+
+    info = None
+    try:
+        if tts.is_long_form(params):
+            with scratch_dir("tts-") as directory:
+                segments = _iter_segments(media_type, service, params, directory,
+                                          on_progress, should_cancel)
+                with closing(segments):
+                    paths = [path for _, _, path in segments]
+                with metrics.timed("store"):
+                    saved_path = _store_segments(media_type, paths, directory)
+        else:
+            # batched calls cannot be cancelled or report progress, so jobs
+            # that want either call xinference on their own
+            batchable = on_progress is None and should_cancel is None
+            if service.batch_input and batching.is_enabled() and batchable:
+                result = batching.get_batcher(
+                    media_type, lambda batch_inputs, n: _predict_batch(service, batch_inputs, n)
+                ).submit(inputs)
+            else:
+                result = _predict(service, inputs, on_progress, should_cancel)
+            source = _result_source(result)
+            suffix = _result_suffix(result, service.default_suffix)
+            filename = f"{media_type}_{uuid4().hex}{suffix}"
+            with metrics.timed("store"):
+                if media_type == "video" and mp4.handles(suffix):
+                    saved_path, info = _store_video(source, suffix, f"{media_type}/{filename}")
+                else:
+                    saved_path = store_result(source, f"{media_type}/{filename}")
+    except GenerationError:
+        raise
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("%s generation request failed", media_type)
+        raise GenerationError(service.error, service.error_detail(str(exc))) from exc
+
+    if should_cancel is not None and should_cancel():
+        blobs.discard(saved_path)
+        raise GenerationCancelled()
+    return _build_record(media_type, params, saved_path, info), cache_key
@@ -0,0 +1,149 @@
+import logging
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+
+from .storage import INCOMING_DIR
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+
+class ResultTooLarge(ValueError):
+    pass
+
+
+def _max_bytes() -> int:
+    return settings.GENERATION_MAX_RESULT_BYTES
+
+
+def check_size(size: int) -> None:
+    """Raise ``ResultTooLarge`` when ``size`` bytes exceed GENERATION_MAX_RESULT_BYTES."""
+    if size > _max_bytes():
+        raise ResultTooLarge(
+            f"生成结果超过大小限制（{size} > {_max_bytes()} 字节）"
+        )
+
+
+class _LimitedReader:
+    """File-like view over an iterator of byte chunks that enforces the size cap."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self.read_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self.read_bytes += len(chunk)
+            check_size(self.read_bytes)
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _save_stream(name: str, fileobj) -> str:
+    """Stream ``fileobj`` into storage, removing the partial file on failure."""
+    try:
+        return default_storage.save(name, File(fileobj, name=name))
+    except BaseException:
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        raise
+
+
+def _store_url(url: str, name: str) -> str:
+    import requests
+
+    with requests.get(url, timeout=60, stream=True) as resp:
+        resp.raise_for_status()
+        length = resp.headers.get("Content-Length")
+        if length and length.isdigit():
+            check_size(int(length))
+        return _save_stream(name, _LimitedReader(resp.iter_content(CHUNK_SIZE)))
+
+
+def _is_gradio_download(path: Path) -> bool:
+    # only reached with a gradio_client result, so the import is already paid for
+    from gradio_client.client import DEFAULT_TEMP_DIR
+
+    try:
+        return path.resolve().is_relative_to(Path(DEFAULT_TEMP_DIR).resolve())
+    except OSError:
+        return False
+
+
+def _store_local(path: Path, name: str, move=None) -> str:
+    check_size(path.stat().st_size)
+    save_local = getattr(default_storage, "save_local", None)
+    if save_local is not None:
+        # files gradio_client downloaded for us are moved, anything else is
+        # hardlinked so the producer keeps its copy
+        if move is None:
+            move = _is_gradio_download(path)
+        return save_local(name, path, move=move)
+    with path.open("rb") as f:
+        return _save_stream(name, f)
+
+
+def store_result(source, name: str, move=None) -> str:
+    """
+    Persist a generation result to ``default_storage`` under ``name`` and
+    return the saved name. ``source`` is raw bytes, a URL or a local path as
+    resolved from the gradio_client result; peak memory stays at one chunk.
+    ``move`` forces whether a local file may be consumed (default: only
+    files in gradio_client's download directory).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        check_size(len(source))
+        return default_storage.save(name, ContentFile(bytes(source)))
+    if isinstance(source, str) and source.startswith("http"):
+        return _store_url(source, name)
+    return _store_local(Path(source), name, move=move)
+
+
+def fetch_result(source, dest: Path) -> Path:
+    """
+    Like ``store_result`` but write ``source`` to the local file ``dest``,
+    for results that are post-processed before being stored.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        check_size(len(source))
+        dest.write_bytes(source)
+    elif isinstance(source, str) and source.startswith("http"):
+        import requests
+
+        with requests.get(source, timeout=60, stream=True) as resp, dest.open("wb") as out:
+            resp.raise_for_status()
+            reader = _LimitedReader(resp.iter_content(CHUNK_SIZE))
+            for chunk in iter(lambda: reader.read(CHUNK_SIZE), b""):
+                out.write(chunk)
+    else:
+        path = Path(source)
+        check_size(path.stat().st_size)
+        if _is_gradio_download(path):
+            shutil.move(path, dest)
+        else:
+            shutil.copyfile(path, dest)
+    return dest
+
+
+@contextmanager
+def scratch_dir(prefix: str):
+    """Temporary directory for post-processing, next to storage's own uploads."""
+    parent = Path(settings.MEDIA_ROOT) / INCOMING_DIR
+    parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=prefix, dir=parent) as path:
+        yield Path(path)
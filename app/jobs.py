@@ -0,0 +1,271 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import admission
+from .generation import MEDIA_TYPES, GenerationCancelled, GenerationError, generate
+from .models import GenerationJob, WorkerHeartbeat
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = {"image": 2, "audio": 4, "video": 1}
+# how often a running job looks for a cancel request
+CANCEL_CHECK_INTERVAL = 1.0
+# how often a worker pool records that it is alive; pools not seen for
+# HEARTBEAT_TIMEOUT are taken for dead
+HEARTBEAT_INTERVAL = 10.0
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+
+def get_concurrency() -> dict:
+    """Per-media-type worker counts, overridable via ``GENERATION_WORKER_CONCURRENCY``."""
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    concurrency.update(getattr(settings, "GENERATION_WORKER_CONCURRENCY", {}))
+    return concurrency
+
+
+def enqueue(media_type: str, params: dict, user=None) -> GenerationJob:
+    job = GenerationJob.objects.create(
+        media_type=media_type,
+        params=params,
+        user=user if user is not None and user.is_authenticated else None,
+    )
+    if getattr(settings, "GENERATION_INLINE_WORKERS", False):
+        transaction.on_commit(start_inline_workers)
+    return job
+
+
+def workers_available(media_type: str) -> bool:
+    """
+    Whether a job of ``media_type`` will be picked up: inline workers are
+    started on demand, otherwise a live pool must take that media type.
+    """
+    if getattr(settings, "GENERATION_INLINE_WORKERS", False):
+        return True
+    since = timezone.now() - timedelta(seconds=HEARTBEAT_TIMEOUT)
+    return any(
+        concurrency.get(media_type, 0) > 0
+        for concurrency in WorkerHeartbeat.objects.filter(seen_at__gte=since)
+        .values_list("concurrency", flat=True)
+    )
+
+
+def queue_position(job: GenerationJob) -> int | None:
+    """
+    How many queued jobs of the same media type are older than ``job``; with
+    fair scheduling between users this is an upper bound.
+    """
+    if job.status != GenerationJob.STATUS_QUEUED:
+        return None
+    return GenerationJob.objects.filter(
+        media_type=job.media_type, status=GenerationJob.STATUS_QUEUED, pk__lt=job.pk
+    ).count()
+
+
+def claim_next(media_type: str):
+    """
+    Atomically move the next queued job of ``media_type`` to running: the
+    oldest one, or with admission control the one ``admission`` picks
+    fairly between users.
+    """
+    if not admission.fair_candidates(media_type):
+        return None
+    with transaction.atomic():
+        # re-checked under the admission lock so concurrent workers cannot
+        # overshoot the global limit together
+        admission.lock(media_type)
+        for pk in admission.fair_candidates(media_type):
+            claimed = GenerationJob.objects.filter(
+                pk=pk, status=GenerationJob.STATUS_QUEUED
+            ).update(status=GenerationJob.STATUS_RUNNING, started_at=timezone.now())
+            if claimed:
+                return GenerationJob.objects.get(pk=pk)
+    return None
+
+
+def _progress_writer(job: GenerationJob):
+    def write(progress: dict) -> None:
+        job.progress = progress
+        GenerationJob.objects.filter(pk=job.pk).update(progress=progress)
+    return write
+
+
+def _cancel_checker(job: GenerationJob):
+    checked_at, requested = 0.0, False
+
+    def should_cancel() -> bool:
+        nonlocal checked_at, requested
+        now = time.monotonic()
+        if not requested and now - checked_at >= CANCEL_CHECK_INTERVAL:
+            checked_at = now
+            requested = GenerationJob.objects.filter(pk=job.pk, cancel_requested=True).exists()
+        return requested
+    return should_cancel
+
+
+def cancel(pk: int):
+    """
+    Cancel a job: a queued job is finished right away, a running one is
+    flagged for its worker, which stops the xinference job. Returns the
+    job, or None if it does not exist.
+    """
+    now = timezone.now()
+    GenerationJob.objects.filter(pk=pk, status=GenerationJob.STATUS_QUEUED).update(
+        status=GenerationJob.STATUS_CANCELLED, error="生成已取消", finished_at=now
+    )
+    GenerationJob.objects.filter(pk=pk, status=GenerationJob.STATUS_RUNNING).update(
+        cancel_requested=True
+    )
+    return GenerationJob.objects.select_related("record").filter(pk=pk).first()
+
+
+def _finish(job: GenerationJob) -> bool:
+    """
+    Store the outcome of ``job`` unless it stopped running meanwhile; a
+    success is not stored over a cancel request.
+    """
+    running = GenerationJob.objects.filter(pk=job.pk, status=GenerationJob.STATUS_RUNNING)
+    if job.status == GenerationJob.STATUS_SUCCEEDED:
+        running = running.filter(cancel_requested=False)
+    return bool(running.update(
+        status=job.status, record=job.record, error=job.error, detail=job.detail, finished_at=job.finished_at
+    ))
+
+
+def run_job(job: GenerationJob) -> GenerationJob:
+    try:
+        record = generate(
+            job.media_type,
+            job.params,
+            on_progress=_progress_writer(job),
+            should_cancel=_cancel_checker(job),
+        )
+    except GenerationCancelled as exc:
+        job.status = GenerationJob.STATUS_CANCELLED
+        job.error = exc.error
+        job.detail = exc.detail
+    except GenerationError as exc:
+        job.status = GenerationJob.STATUS_FAILED
+        job.error = exc.error
+        job.detail = exc.detail
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("generation job %s crashed", job.pk)
+        job.status = GenerationJob.STATUS_FAILED
+        job.error = "生成任务执行失败"
+        job.detail = str(exc)
+    else:
+        job.status = GenerationJob.STATUS_SUCCEEDED
+        job.record = record
+    job.finished_at = timezone.now()
+    if not _finish(job) and job.status == GenerationJob.STATUS_SUCCEEDED:
+        # cancelled after generate() returned: the cancel still wins
+        record.delete()
+        job.status, job.record = GenerationJob.STATUS_CANCELLED, None
+        job.error, job.detail = GenerationCancelled().error, ""
+        _finish(job)
+    job.refresh_from_db()
+    return job
+
+
+def requeue_running() -> int:
+    """Put jobs left running by a dead worker back in the queue, unless cancelled."""
+    running = GenerationJob.objects.filter(status=GenerationJob.STATUS_RUNNING)
+    running.filter(cancel_requested=True).update(
+        status=GenerationJob.STATUS_CANCELLED, error="生成已取消", finished_at=timezone.now()
+    )
+    return running.update(status=GenerationJob.STATUS_QUEUED, started_at=None)
+
+
+class WorkerPool:
+    """
+    A bounded set of worker threads with a separate lane per media type, so a
+    backlog of long video renders never occupies the threads serving TTS.
+    """
+
+    def __init__(self, concurrency: dict | None = None, poll_interval: float = 1.0):
+        self.concurrency = concurrency or get_concurrency()
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        self._beat()
+        heartbeat = threading.Thread(target=self._heartbeat, name="gen-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        for media_type in MEDIA_TYPES:
+            for index in range(self.concurrency.get(media_type, 0)):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(media_type,),
+                    name=f"gen-{media_type}-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        WorkerHeartbeat.objects.filter(name=self.name).delete()
+
+    def _beat(self) -> None:
+        now = timezone.now()
+        WorkerHeartbeat.objects.update_or_create(
+            name=self.name, defaults={"concurrency": self.concurrency, "seen_at": now}
+        )
+        # rows of pools that died without stopping
+        WorkerHeartbeat.objects.filter(seen_at__lt=now - timedelta(seconds=10 * HEARTBEAT_TIMEOUT)).delete()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self._beat()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning("could not record worker heartbeat", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def wait(self) -> None:
+        while not self._stop.is_set():
+            self._stop.wait(self.poll_interval)
+
+    def _work(self, media_type: str) -> None:
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                job = claim_next(media_type)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("failed to claim %s job", media_type)
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            logger.info("running generation job %s (%s)", job.pk, media_type)
+            run_job(job)
+        close_old_connections()
+
+
+_inline_pool = None
+_inline_lock = threading.Lock()
+
+
+def start_inline_workers() -> None:
+    """
+    Start a worker pool inside the web process the first time a job is
+    enqueued, so jobs run without a separate ``run_generation_workers``.
+    """
+    global _inline_pool  # pylint: disable=global-statement
+    with _inline_lock:
+        if _inline_pool is None:
+            _inline_pool = WorkerPool(poll_interval=0.5)
+            _inline_pool.start()
@@ -0,0 +1,133 @@
+"""
+Bulk operations on the records of the media library.
+
+Deleting goes through one ``QuerySet.delete()`` inside a transaction. The
+per-row signals still fire, but their blob releases and listing bumps are
+collected and applied once: reference counts are updated per file, and the
+files nobody references any more are removed by ``app.blobs``' cleanup pool
+after the commit, so the request does not wait on the filesystem. A crash
+before the pool gets to them leaves orphans for ``storage_lifecycle --delete``.
+"""
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import blobs, listing_cache
+from .generation import MEDIA_TYPES, InvalidParams
+from .models import MediaRecord
+
+
+def record_from_payload(payload: dict) -> MediaRecord:
+    """An unsaved record for a ``create_record`` payload."""
+    if not isinstance(payload, dict):
+        raise InvalidParams("Invalid record")
+    media_type = payload.get("media_type")
+    if media_type not in MEDIA_TYPES:
+        raise InvalidParams("Invalid media_type")
+    return MediaRecord(
+        media_type=media_type,
+        model=(payload.get("model") or "").strip() or "unknown",
+        prompt=payload.get("prompt", ""),
+        style=payload.get("style", ""),
+        voice=payload.get("voice", ""),
+        result_url=payload.get("url") or payload.get("result_url") or "",
+    )
+
+
+def create_records(payloads: list) -> list:
+    """Validate every payload, then insert them all with one ``bulk_create``."""
+    if not isinstance(payloads, list) or not payloads:
+        raise InvalidParams("records is required")
+    if len(payloads) > settings.RECORDS_BULK_MAX_ITEMS:
+        raise InvalidParams(f"at most {settings.RECORDS_BULK_MAX_ITEMS} records per request")
+    records = []
+    for index, payload in enumerate(payloads):
+        try:
+            records.append(record_from_payload(payload))
+        except InvalidParams as exc:
+            raise InvalidParams(f"record {index}: {exc}") from exc
+    with transaction.atomic():
+        records = MediaRecord.objects.bulk_create(records)
+    # bulk_create skips the signals; these records have no stored file
+    listing_cache.bump()
+    return records
+
+
+def _parse_moment(value, name: str):
+    if value in (None, ""):
+        return None
+    moment = parse_datetime(str(value))
+    if moment is None:
+        day = parse_date(str(value))
+        if day is None:
+            raise InvalidParams(f"invalid {name}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def select(payload: dict):
+    """
+    The records a bulk request addresses: ``ids`` and/or a filter of
+    ``media_type``, ``created_after`` (inclusive) and ``created_before``
+    (exclusive), given as ISO dates or datetimes. At least one is required
+    so an empty request cannot clear the library.
+    """
+    ids = payload.get("ids")
+    media_type = payload.get("media_type")
+    after = _parse_moment(payload.get("created_after"), "created_after")
+    before = _parse_moment(payload.get("created_before"), "created_before")
+    qs = MediaRecord.objects.all()
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise InvalidParams("ids must be a non-empty list")
+        try:
+            ids = [int(pk) for pk in ids]
+        except (TypeError, ValueError) as exc:
+            raise InvalidParams("ids must be integers") from exc
+        if len(ids) > settings.RECORDS_BULK_MAX_ITEMS:
+            raise InvalidParams(f"at most {settings.RECORDS_BULK_MAX_ITEMS} ids per request")
+        qs = qs.filter(pk__in=ids)
+    if media_type:
+        if media_type not in MEDIA_TYPES:
+            raise InvalidParams("Invalid media_type")
+        qs = qs.filter(media_type=media_type)
+    if after is not None:
+        qs = qs.filter(created_at__gte=after)
+    if before is not None:
+        qs = qs.filter(created_at__lt=before)
+    if ids is None and not (media_type or after or before):
+        raise InvalidParams("ids or a filter is required")
+    return qs, ids
+
+
+def delete_records(qs, ids=None) -> dict:
+    """
+    Delete every record in ``qs`` in one transaction and return a summary:
+    how many went per media type, how many stored files were scheduled for
+    removal and which of the requested ``ids`` did not exist.
+    """
+    # bump after the commit so no listing is cached from the old rows
+    with listing_cache.bump_once(), transaction.atomic():
+        by_media_type = {
+            row["media_type"]: row["n"]
+            for row in qs.order_by().values("media_type").annotate(n=Count("pk"))
+        }
+        found = set(qs.values_list("pk", flat=True)) if ids is not None else None
+        with blobs.deferred_releases() as released:
+            deleted = qs.delete()[1].get("app.MediaRecord", 0)
+        orphaned = blobs.release_many(released)
+    summary = {
+        "deleted": deleted,
+        "by_media_type": by_media_type,
+        "files_released": len(released),
+        "files_scheduled": len(orphaned),
+    }
+    if ids is not None:
+        summary["not_found"] = sorted(set(ids) - found)
+    return summary
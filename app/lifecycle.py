@@ -0,0 +1,338 @@
+"""
+Storage lifecycle: retention, per-media-type quotas, reconciliation between
+``default_storage`` and the database, and recompression of cold images.
+
+Everything here is driven by ``manage.py storage_lifecycle``. Records are
+deleted through the ORM, so their files go away through ``app.blobs`` once
+nothing references them any more. Reconciliation only reports files no row
+knows about and rows whose file is gone unless asked to delete them; even
+then it only touches what the storage itself laid out (content-addressed
+blobs, their derivatives and stale uploads under ``.incoming``), never other
+files that happen to live under MEDIA_ROOT. Files younger than
+``STORAGE_ORPHAN_GRACE`` are never treated as orphans, which keeps uploads
+that have not been committed yet safe.
+"""
+import io
+import logging
+import os
+import posixpath
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import blobs, derivatives, listing_cache
+from .models import GenerationCacheEntry, MediaBlob, MediaRecord
+from .storage import INCOMING_DIR, is_blob_name
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = ("image", "audio", "video")
+DELETE_BATCH_SIZE = 500
+# recompressed images are kept only when they save at least this fraction
+MIN_RECOMPRESS_SAVING = 0.1
+_TOUCH_KEY = "blob_touched:{}"
+_TOUCH_INTERVAL = 60 * 60
+
+
+def touch(name: str) -> None:
+    """Record a download of ``name`` for LRU eviction, writing at most hourly."""
+    if name and cache.add(_TOUCH_KEY.format(name), 1, timeout=_TOUCH_INTERVAL):
+        MediaBlob.objects.filter(name=name).update(last_used_at=timezone.now())
+
+
+def _setting(name: str, media_type: str):
+    return (getattr(settings, name, None) or {}).get(media_type)
+
+
+def _delete_records(qs, dry_run: bool) -> int:
+    """Delete ``qs`` in batches, releasing each batch's files together."""
+    if dry_run:
+        return qs.count()
+    deleted = 0
+    while True:
+        ids = list(qs.values_list("pk", flat=True)[:DELETE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        with listing_cache.bump_once(), transaction.atomic():
+            with blobs.deferred_releases() as released:
+                deleted += MediaRecord.objects.filter(pk__in=ids).delete()[1].get("app.MediaRecord", 0)
+            blobs.release_many(released)
+
+
+def apply_retention(dry_run: bool = False) -> dict:
+    """Delete records older than ``STORAGE_RETENTION[media_type]`` seconds."""
+    removed = {}
+    for media_type in MEDIA_TYPES:
+        max_age = _setting("STORAGE_RETENTION", media_type)
+        if not max_age:
+            continue
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        qs = MediaRecord.objects.filter(media_type=media_type, created_at__lt=cutoff)
+        removed[media_type] = _delete_records(qs, dry_run)
+    return removed
+
+
+def usage() -> dict:
+    """Bytes stored per media type, counting each shared blob once."""
+    result = {}
+    for media_type in MEDIA_TYPES:
+        total = MediaBlob.objects.filter(name__startswith=f"{media_type}/").aggregate(
+            total=Sum("size")
+        )["total"]
+        result[media_type] = total or 0
+    return result
+
+
+def apply_quotas(dry_run: bool = False) -> dict:
+    """
+    Evict least recently used blobs of a media type, with every record and
+    cache entry pointing at them, until its usage fits
+    ``STORAGE_QUOTAS[media_type]`` bytes.
+    """
+    current = usage()
+    evicted = {}
+    for media_type in MEDIA_TYPES:
+        quota = _setting("STORAGE_QUOTAS", media_type)
+        if quota is None or current[media_type] <= quota:
+            continue
+        total = current[media_type]
+        count = 0
+        candidates = (
+            MediaBlob.objects.filter(name__startswith=f"{media_type}/")
+            .annotate(used=Coalesce("last_used_at", "created_at"))
+            .order_by("used", "id")
+            .values_list("name", "size")
+        )
+        for name, size in candidates.iterator():
+            if total <= quota:
+                break
+            count += _delete_records(MediaRecord.objects.filter(file=name), dry_run)
+            if not dry_run:
+                for entry in GenerationCacheEntry.objects.filter(file_name=name):
+                    entry.delete()
+            total -= size
+        evicted[media_type] = count
+        logger.info("%s usage %d bytes over quota %d, evicted %d records",
+                    media_type, current[media_type], quota, count)
+    return evicted
+
+
+def _references() -> dict:
+    """Reference counts per stored name from records and cache entries."""
+    counts = {}
+    rows = (
+        MediaRecord.objects.exclude(file="").exclude(file__isnull=True)
+        .values("file").annotate(n=Count("pk")).values_list("file", "n")
+    )
+    for name, n in rows.iterator():
+        counts[name] = n
+    for name in GenerationCacheEntry.objects.values_list("file_name", flat=True).iterator():
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def _stored_files():
+    """
+    ``(relative name, mtime)`` of every file under MEDIA_ROOT that the
+    storage laid out: content-addressed blobs and derivatives, and uploads
+    left in ``.incoming``.
+    """
+    root = Path(settings.MEDIA_ROOT)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = Path(directory) / filename
+            name = path.relative_to(root).as_posix()
+            if not (is_blob_name(name) or name.split("/", 1)[0] == INCOMING_DIR):
+                continue
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            yield name, mtime
+
+
+def _fix_ref_count(name: str, delete: bool) -> int:
+    """
+    Recount the references to ``name`` under the blob row lock, creating
+    the row if needed; 1 if the blob changed. With ``delete``, a file left
+    without references goes through ``blobs.delete_if_unreferenced``.
+    """
+    with transaction.atomic():
+        blob, created = MediaBlob.objects.select_for_update().get_or_create(
+            name=name, defaults={"size": 0, "ref_count": 0}
+        )
+        refs = (
+            MediaRecord.objects.filter(file=name).count()
+            + GenerationCacheEntry.objects.filter(file_name=name).count()
+        )
+        if created and (not refs or not default_storage.exists(name)):
+            blob.delete()
+            return 0
+        if not created and blob.ref_count == refs:
+            return 0
+        fields = {"ref_count": refs}
+        if created:
+            fields["size"] = default_storage.size(name)
+        MediaBlob.objects.filter(pk=blob.pk).update(**fields)
+        if delete and not refs:
+            transaction.on_commit(lambda: blobs.delete_if_unreferenced(name))
+    return 1
+
+
+def reconcile(dry_run: bool = False, delete: bool = False) -> dict:
+    """
+    Bring storage and the database back in line:
+
+    * files nobody references (including stale uploads under ``.incoming``
+      and derivatives of deleted files) are removed;
+    * records and cache entries whose file is missing are deleted;
+    * ``MediaBlob`` reference counts are recomputed.
+
+    The first two are only reported unless ``delete`` is set; ``dry_run``
+    changes nothing at all.
+    """
+    remove = delete and not dry_run
+    references = _references()
+    cutoff = time.time() - settings.STORAGE_ORPHAN_GRACE
+    result = {"orphan_files": 0, "orphan_bytes": 0, "dangling_records": 0,
+              "dangling_cache_entries": 0, "fixed_ref_counts": 0}
+
+    missing = {name for name in references if not default_storage.exists(name)}
+    for name in missing:
+        logger.warning("stored file %s is missing", name)
+        result["dangling_records"] += _delete_records(MediaRecord.objects.filter(file=name), not remove)
+        entries = GenerationCacheEntry.objects.filter(file_name=name)
+        result["dangling_cache_entries"] += entries.count()
+        if remove:
+            for entry in entries:
+                entry.delete()
+            MediaBlob.objects.filter(name=name).delete()
+        references.pop(name)
+
+    expected_derivatives = {
+        relative for name in references for relative in derivatives.names_for(name)
+    }
+    for name, mtime in _stored_files():
+        if mtime > cutoff or name in references or name in expected_derivatives:
+            continue
+        top = name.split("/", 1)[0]
+        is_blob = top != INCOMING_DIR and top != derivatives.DERIVATIVE_DIR
+        if is_blob and (
+            MediaRecord.objects.filter(file=name).exists()
+            or GenerationCacheEntry.objects.filter(file_name=name).exists()
+        ):
+            # referenced after the scan started
+            continue
+        try:
+            size = default_storage.size(name)
+            if remove and is_blob:
+                # under the blob row lock, so a concurrent acquire keeps the file
+                if not blobs.delete_if_unreferenced(name):
+                    continue
+            elif remove:
+                default_storage.delete(name)
+        except OSError:
+            logger.warning("could not remove orphan %s", name, exc_info=True)
+            continue
+        result["orphan_files"] += 1
+        result["orphan_bytes"] += size
+
+    if not dry_run:
+        drifted = [
+            name for name, count in MediaBlob.objects.values_list("name", "ref_count").iterator()
+            if references.pop(name, 0) != count
+        ]
+        # names left in ``references`` have no MediaBlob row at all
+        for name in drifted + list(references):
+            result["fixed_ref_counts"] += _fix_ref_count(name, delete)
+    return result
+
+
+def _recompressed(name: str):
+    """WebP bytes for the image ``name``, or None when not worth keeping."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with default_storage.open(name) as src, Image.open(src) as img:
+            img.load()
+            out = io.BytesIO()
+            if img.mode not in {"RGB", "RGBA"}:
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            img.save(out, format="WEBP", quality=settings.STORAGE_RECOMPRESS_QUALITY, method=6)
+    except (OSError, UnidentifiedImageError):
+        logger.warning("could not recompress %s", name, exc_info=True)
+        return None
+    data = out.getvalue()
+    if len(data) > default_storage.size(name) * (1 - MIN_RECOMPRESS_SAVING):
+        return None
+    return data
+
+
+def recompress_cold_images(dry_run: bool = False, limit: int | None = None) -> dict:
+    """
+    Re-encode images not downloaded for ``STORAGE_RECOMPRESS_AFTER`` seconds
+    as WebP. The new file gets its own content address; every record and
+    cache entry is repointed and the old blob released.
+    """
+    result = {"images": 0, "saved_bytes": 0}
+    if not settings.STORAGE_RECOMPRESS_AFTER:
+        return result
+    cutoff = timezone.now() - timedelta(seconds=settings.STORAGE_RECOMPRESS_AFTER)
+    candidates = (
+        MediaBlob.objects.filter(name__startswith="image/")
+        .exclude(name__endswith=".webp")
+        .annotate(used=Coalesce("last_used_at", "created_at"))
+        .filter(used__lt=cutoff)
+        .order_by("used", "id")
+        .values_list("name", "size")
+    )
+    if limit:
+        candidates = candidates[:limit]
+    for name, size in candidates:
+        data = _recompressed(name)
+        if data is None:
+            continue
+        result["images"] += 1
+        result["saved_bytes"] += size - len(data)
+        if dry_run:
+            continue
+        new_name = default_storage.save(posixpath.join("image", "recompressed.webp"), ContentFile(data))
+        with transaction.atomic():
+            # the old blob's thumbnail goes with it; the new one is built after commit
+            refs = MediaRecord.objects.filter(file=name).update(
+                file=new_name,
+                result_url=default_storage.url(new_name),
+                derivative_state=MediaRecord.DERIVATIVES_MISSING,
+            )
+            refs += GenerationCacheEntry.objects.filter(file_name=name).update(
+                file_name=new_name, size=len(data)
+            )
+            for _ in range(refs):
+                blobs.acquire(new_name)
+                blobs.release(name)
+            transaction.on_commit(lambda new_name=new_name: derivatives.schedule(new_name, "image"))
+        # the updates above bypass the signals that invalidate listings
+        listing_cache.bump()
+    if result["images"]:
+        logger.info("recompressed %d cold images, saving %d bytes",
+                    result["images"], result["saved_bytes"])
+    return result
+
+
+def run(dry_run: bool = False, delete: bool = False) -> dict:
+    """One full lifecycle pass; see ``reconcile`` for ``delete``."""
+    return {
+        "retention": apply_retention(dry_run),
+        "quotas": apply_quotas(dry_run),
+        "reconcile": reconcile(dry_run, delete),
+        "recompress": recompress_cold_images(dry_run, limit=settings.STORAGE_RECOMPRESS_BATCH),
+    }
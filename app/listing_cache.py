@@ -0,0 +1,72 @@
+"""
+Conditional and cached ``/api/records/`` responses.
+
+Every change to the library bumps a version counter kept in the database
+(``app.counters``), so a bump made by ``run_generation_workers`` or a
+management command is seen by every web process whatever the cache backend.
+A listing's ETag is derived from that version, the user and the query
+string, so a polling client sending ``If-None-Match`` gets a 304 without the
+listing being queried or serialized at all.
+
+When ``RECORDS_LIST_CACHE_TIMEOUT`` is positive the bodies are additionally
+kept in the Django cache under the same key; a per-process cache such as the
+default ``LocMemCache`` is fine for that, since a stale version is never
+looked up again.
+"""
+import contextvars
+import hashlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import counters
+
+_VERSION = "records_list:version"
+_held = contextvars.ContextVar("records_list_bump_held", default=False)
+
+
+def is_enabled() -> bool:
+    """Whether listing bodies are cached; ETags are sent regardless."""
+    return settings.RECORDS_LIST_CACHE_TIMEOUT > 0
+
+
+def version() -> int:
+    return counters.get(_VERSION)
+
+
+def bump() -> None:
+    """Invalidate every listing ETag and cached body."""
+    if _held.get():
+        return
+    counters.increment(_VERSION)
+
+
+@contextmanager
+def bump_once():
+    """Collapse the bumps made inside the block, e.g. one per deleted row, into one."""
+    token = _held.set(True)
+    try:
+        yield
+    finally:
+        _held.reset(token)
+        bump()
+
+
+def make_key(user_id, query_string: str) -> str:
+    params = "&".join(sorted(query_string.split("&")))
+    digest = hashlib.sha256(params.encode("utf-8")).hexdigest()
+    return f"records_list:{version()}:{user_id}:{digest}"
+
+
+def etag(key: str) -> str:
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def get(key: str):
+    """The listing body cached under ``key``, or None."""
+    return cache.get(key)
+
+
+def store(key: str, body: bytes) -> None:
+    cache.set(key, body, timeout=settings.RECORDS_LIST_CACHE_TIMEOUT)
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from app import mp4
+from app.models import MediaRecord
+
+
+class Command(BaseCommand):
+    help = "Read duration and frame size of stored MP4 videos saved before they were recorded."
+
+    def handle(self, *args, **options):
+        qs = (
+            MediaRecord.objects.filter(media_type="video", duration__isnull=True, width__isnull=True)
+            .exclude(file="").exclude(file__isnull=True)
+        )
+        updated = failed = 0
+        for name in qs.values_list("file", flat=True).distinct().iterator():
+            if not mp4.handles(Path(name).suffix):
+                continue
+            try:
+                info = mp4.probe(Path(default_storage.path(name)))
+            except (OSError, mp4.InvalidMp4) as exc:
+                failed += 1
+                self.stderr.write(f"{name}: {exc}")
+                continue
+            updated += qs.filter(file=name).update(
+                duration=info.duration, width=info.width, height=info.height
+            )
+        self.stdout.write(f"updated {updated} records, {failed} files failed")
@@ -0,0 +1,150 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from app import backends, clients
+from app.benchmark import SCENARIOS, Runner, regressions, seed_records, startup_report
+from app.fake_xinference import FakeXinference
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the generate, list and download endpoints against a throwaway "
+        "database and a local fake xinference server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--records", type=int, default=1_000_000,
+                            help="MediaRecord rows to seed before the list/download scenarios.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per scenario.")
+        parser.add_argument("--generate-requests", type=int, default=50,
+                            help="Requests per generate scenario.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=0.05,
+                            help="Seconds the fake xinference takes per prediction.")
+        parser.add_argument("--payload-size", type=int, default=256 * 1024,
+                            help="Bytes of each generated file.")
+        parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                            help="Run only these scenarios (repeatable).")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--baseline", help="Earlier --output file to compare against.")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Allowed relative p95/throughput regression against --baseline.")
+        parser.add_argument("--startup", action="store_true",
+                            help="Only report worker cold-start time (python -X importtime).")
+        parser.add_argument("--startup-runs", type=int, default=5,
+                            help="Fresh interpreters to time for --startup.")
+
+    def handle(self, *args, **options):
+        if options["startup"]:
+            self._startup(options)
+            return
+        scenarios = options["scenario"] or list(SCENARIOS)
+        workdir = Path(tempfile.mkdtemp(prefix="absaigen-bench-"))
+        fake = FakeXinference(latency=options["latency"], payload_size=options["payload_size"]).start()
+        self.stdout.write(f"fake xinference at {fake.url}, scratch files in {workdir}")
+
+        settings.DATABASES["default"].setdefault("TEST", {})["NAME"] = str(workdir / "bench.sqlite3")
+        if connection.vendor == "sqlite":
+            # concurrent requests write from several threads: take the write
+            # lock up front and wait for it instead of failing with "locked"
+            settings.DATABASES["default"].setdefault("OPTIONS", {}).update(
+                timeout=30,
+                transaction_mode="IMMEDIATE",
+                init_command="PRAGMA journal_mode=WAL;",
+            )
+        overrides = override_settings(
+            MEDIA_ROOT=str(workdir / "media"),
+            XINFERENCE_BACKENDS=[{"url": fake.url}],
+            GRADIO_SCHEMA_CACHE_DIR=workdir / "gradio_schema",
+            # the fake payloads are not decodable media
+            DERIVATIVES_ENABLED=False,
+            # one benchmark user drives every request
+            ADMISSION_ENABLED=False,
+        )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with overrides:
+                backends.reset_router()
+                results = self._run(scenarios, options)
+        finally:
+            clients.clear_pools()
+            backends.reset_router()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            fake.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self._report(results)
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(results, indent=2))
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text())
+            found = regressions(results, baseline, options["tolerance"])
+            if found:
+                raise CommandError("performance regressions:\n" + "\n".join(found))
+            self.stdout.write(self.style.SUCCESS("no regressions against baseline"))
+
+    def _startup(self, options) -> None:
+        report = startup_report(runs=options["startup_runs"])
+        self.stdout.write(
+            f"worker startup: {report['wall_ms']} ms wall, {report['import_ms']} ms importing "
+            f"(median of {report['runs']})"
+        )
+        heavy = ", ".join(report["eager_heavy_modules"]) or "none"
+        self.stdout.write(f"heavy dependencies imported at startup: {heavy}")
+        width = max(len(row["module"]) for row in report["slowest_imports"])
+        self.stdout.write(f"{'module'.ljust(width)}  cumulative_ms  self_ms")
+        for row in report["slowest_imports"]:
+            self.stdout.write(
+                f"{row['module'].ljust(width)}  {str(row['cumulative_ms']).ljust(13)}  {row['self_ms']}"
+            )
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+
+    def _run(self, scenarios, options) -> list:
+        user = get_user_model().objects.create_user("benchmark")
+        use_async = settings.USE_ASYNC_VIEWS
+        mode = "async views" if use_async else "sync views"
+        self.stdout.write(f"driving {mode} with concurrency {options['concurrency']}")
+
+        results = []
+        seeded = False
+        for scenario in scenarios:
+            generating = scenario.startswith("generate_")
+            if not generating and not seeded and options["records"]:
+                self.stdout.write(f"seeding {options['records']} records...")
+                seed_records(options["records"], progress=self._progress)
+                self.stdout.write("")
+                seeded = True
+            runner = Runner(
+                user,
+                requests=options["generate_requests" if generating else "requests"],
+                concurrency=options["concurrency"],
+                use_async=use_async,
+            )
+            runner.prepare()
+            results.append(runner.run(scenario))
+            self.stdout.write(f"  {scenario}: done")
+        return results
+
+    def _progress(self, created: int) -> None:
+        if created % 100_000 == 0:
+            self.stdout.write(f"  {created}", ending="\r")
+            self.stdout.flush()
+
+    def _report(self, results: list) -> None:
+        columns = ("scenario", "requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms",
+                   "peak_rss_mb")
+        widths = [max(len(c), *(len(str(row[c])) for row in results)) for c in columns]
+        self.stdout.write("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+        for row in results:
+            self.stdout.write("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
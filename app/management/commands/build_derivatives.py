@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from app import derivatives
+from app.models import MediaRecord
+
+
+class Command(BaseCommand):
+    help = "Build missing thumbnails, video posters and audio waveforms for existing records."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--media-type", choices=["image", "audio", "video"])
+        parser.add_argument(
+            "--retry-failed", action="store_true", help="also retry files whose build failed before"
+        )
+
+    def handle(self, *args, **options):
+        states = [MediaRecord.DERIVATIVES_MISSING]
+        if options["retry_failed"]:
+            states.append(MediaRecord.DERIVATIVES_FAILED)
+        qs = (
+            MediaRecord.objects.filter(derivative_state__in=states)
+            .exclude(file="").exclude(file__isnull=True)
+        )
+        if options["media_type"]:
+            qs = qs.filter(media_type=options["media_type"])
+        built = failed = 0
+        seen = set()
+        for name, media_type in qs.values_list("file", "media_type").iterator():
+            if name in seen:
+                continue
+            seen.add(name)
+            try:
+                derivatives.build(name, media_type)
+                built += 1
+            except Exception as exc:  # pylint: disable=broad-except
+                failed += 1
+                derivatives.mark(name, MediaRecord.DERIVATIVES_FAILED)
+                self.stderr.write(f"{name}: {exc}")
+        self.stdout.write(f"processed {built} files, {failed} failed")
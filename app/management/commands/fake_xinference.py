@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from app.fake_xinference import FakeXinference
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a fake xinference for local load tests; point XINFERENCE_BASE_URL "
+        "at the printed URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=9997)
+        parser.add_argument("--latency", type=float, default=0.5,
+                            help="Seconds each prediction takes.")
+        parser.add_argument("--payload-size", type=int, default=256 * 1024,
+                            help="Bytes of each generated file.")
+
+    def handle(self, *args, **options):
+        server = FakeXinference(
+            options["host"],
+            options["port"],
+            latency=options["latency"],
+            payload_size=options["payload_size"],
+        )
+        self.stdout.write(f"fake xinference listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
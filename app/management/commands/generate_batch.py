@@ -0,0 +1,64 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import bulk
+from app.generation import MEDIA_TYPES
+from app.models import GenerationBatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate every prompt of a CSV or JSONL file, or resume an interrupted batch. "
+        "Rows need a prompt column and may set media_type, model, voice, style, ..."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="CSV or JSONL file of prompts")
+        parser.add_argument("--media-type", choices=MEDIA_TYPES,
+                            help="media type of rows without a media_type column")
+        parser.add_argument("--format", choices=bulk.FORMATS,
+                            help="input format (default from the file extension)")
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="generations in flight (default from settings)")
+        parser.add_argument("--resume", type=int, metavar="BATCH_ID",
+                            help="continue the pending items of an earlier batch")
+
+    def handle(self, *args, **options):
+        try:
+            concurrency = bulk.get_concurrency(options["concurrency"])
+            if options["resume"]:
+                batch = GenerationBatch.objects.filter(pk=options["resume"]).first()
+                if batch is None:
+                    raise CommandError(f"batch {options['resume']} not found")
+            elif options["path"]:
+                path = Path(options["path"])
+                fmt = options["format"] or bulk.detect_format(path.name)
+                rows = bulk.read_rows(path.read_bytes(), fmt)
+                batch = bulk.create_batch(rows, media_type=options["media_type"],
+                                          source_name=path.name)
+            else:
+                raise CommandError("give a file to ingest or --resume BATCH_ID")
+        except (bulk.InvalidBatch, OSError) as exc:
+            raise CommandError(str(exc)) from exc
+
+        totals = bulk.summary(batch)
+        self.stdout.write(
+            f"batch {batch.pk}: {totals['pending']} pending of {totals['total']}, "
+            f"concurrency {concurrency}"
+        )
+        try:
+            for item in bulk.run_batch(batch, concurrency):
+                line = f"  #{item.index} {item.status}"
+                if item.record_id:
+                    line += f" -> record {item.record_id}"
+                if item.error:
+                    line += f": {item.error} {item.detail}".rstrip()
+                self.stdout.write(line)
+        except KeyboardInterrupt:
+            self.stdout.write(f"interrupted; resume with --resume {batch.pk}")
+        totals = bulk.summary(batch)
+        self.stdout.write(
+            f"batch {batch.pk}: {totals['succeeded']} succeeded, {totals['failed']} failed, "
+            f"{totals['pending']} pending"
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from app import result_cache
+from app.models import GenerationCacheEntry
+
+
+class Command(BaseCommand):
+    help = "Evict expired or excess generation cache entries and print hit/miss counters."
+
+    def handle(self, *args, **options):
+        evicted = result_cache.prune()
+        self.stdout.write(
+            f"evicted {evicted} entries, {GenerationCacheEntry.objects.count()} remaining"
+        )
+        for media_type, counters in result_cache.stats().items():
+            self.stdout.write(
+                f"{media_type}: {counters['hit']} hits, {counters['miss']} misses"
+            )
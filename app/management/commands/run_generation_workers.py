@@ -0,0 +1,54 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from app.generation import MEDIA_TYPES
+from app.jobs import WorkerPool, get_concurrency, requeue_running
+
+
+class Command(BaseCommand):
+    help = "Run background workers that execute queued generation jobs."
+
+    def add_arguments(self, parser):
+        for media_type in MEDIA_TYPES:
+            parser.add_argument(
+                f"--{media_type}",
+                type=int,
+                default=None,
+                help=f"number of concurrent {media_type} jobs (default from settings)",
+            )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--requeue-running",
+            action="store_true",
+            help="requeue jobs left running by a previous worker (single worker deployments only)",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = get_concurrency()
+        for media_type in MEDIA_TYPES:
+            if options[media_type] is not None:
+                concurrency[media_type] = max(options[media_type], 0)
+
+        if options["requeue_running"]:
+            count = requeue_running()
+            self.stdout.write(f"requeued {count} running job(s)")
+
+        pool = WorkerPool(concurrency, poll_interval=options["poll_interval"])
+        signal.signal(signal.SIGTERM, lambda *_: pool.stop(timeout=0))
+        pool.start()
+        self.stdout.write(
+            "generation workers started: "
+            + ", ".join(f"{k}={v}" for k, v in concurrency.items())
+        )
+        try:
+            pool.wait()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("stopping workers, waiting for running jobs...")
+        pool.stop()
@@ -0,0 +1,40 @@
+import json
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app import lifecycle
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply storage retention and quotas, reconcile MEDIA_ROOT with the database "
+        "and recompress cold images."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+                            help="report what would be removed without changing anything")
+        parser.add_argument("--delete", action="store_true",
+                            help="remove unreferenced stored files and records whose file is missing "
+                                 "instead of only reporting them")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="keep running, one pass every this many seconds")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.stdout.write("usage: " + json.dumps(lifecycle.usage()))
+        while True:
+            close_old_connections()
+            result = lifecycle.run(dry_run=options["dry_run"], delete=options["delete"])
+            self.stdout.write(json.dumps(result))
+            if not options["interval"]:
+                break
+            try:
+                if stop.wait(options["interval"]):
+                    break
+            except KeyboardInterrupt:
+                break
@@ -0,0 +1,149 @@
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from . import metrics
+
+CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _etag(name: str, stat) -> str:
+    stem = Path(name).stem
+    if _DIGEST_RE.match(stem):
+        # content-addressed blob: the name is the content hash
+        return f'"{stem}"'
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def _parse_range(header: str, size: int):
+    """
+    Return ``(start, end)`` for a single ``bytes=`` range, ``None`` to serve
+    the whole file (absent, invalid such as ``bytes=5-2``, or multi-range),
+    or ``False`` when a valid range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # invalid rather than unsatisfiable: the header is ignored
+        return None
+    if start >= size:
+        return False
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _if_range_matches(request, etag: str, mtime: float) -> bool:
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _iter_range(path: Path, start: int, length: int):
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _offload(response: HttpResponse, name: str, path: Path) -> bool:
+    mode = settings.MEDIA_SENDFILE_MODE
+    if mode == "nginx":
+        response["X-Accel-Redirect"] = settings.MEDIA_SENDFILE_PREFIX.rstrip("/") + "/" + name
+    elif mode == "apache":
+        response["X-Sendfile"] = str(path)
+    else:
+        return False
+    return True
+
+
+def serve_file(
+    request, name: str, *, as_attachment: bool, filename=None, media_type="", wrap=None
+):
+    """
+    Serve the stored file ``name`` with ETag/Last-Modified validators,
+    single ``Range`` requests (206/416) and ``If-Range``. With
+    ``MEDIA_SENDFILE_MODE`` set, only headers are produced and the front-end
+    server (nginx ``X-Accel-Redirect`` or ``X-Sendfile``) sends the bytes.
+    ``wrap`` adapts the body iterator, e.g. to an async iterator under ASGI.
+    Bodies sent by Python are timed as the ``download``/``stream`` stage.
+    """
+    path = Path(default_storage.path(name))
+    stat = path.stat()
+    size = stat.st_size
+    etag = _etag(name, stat)
+    last_modified = int(stat.st_mtime)
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return conditional
+
+    content_type, encoding = mimetypes.guess_type(path.name)
+    content_type = content_type or "application/octet-stream"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Content-Disposition": content_disposition_header(
+            as_attachment, filename or path.name
+        ),
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    response = HttpResponse(content_type=content_type, headers=headers)
+    if _offload(response, name, path):
+        return response
+
+    byte_range = None
+    if request.method in {"GET", "HEAD"} and _if_range_matches(request, etag, stat.st_mtime):
+        byte_range = _parse_range(request.headers.get("Range", ""), size)
+    if byte_range is False:
+        response = HttpResponse(status=416, headers=headers)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = max(end - start + 1, 0)
+    content = metrics.timed_iter(
+        "download" if as_attachment else "stream",
+        _iter_range(path, start, length),
+        media_type=media_type,
+    )
+    response = StreamingHttpResponse(
+        wrap(content) if wrap else content,
+        content_type=content_type,
+        status=206 if byte_range else 200,
+        headers=headers,
+    )
+    response["Content-Length"] = str(length)
+    if byte_range:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
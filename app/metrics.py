@@ -0,0 +1,195 @@
+"""
+In-process latency histograms and counters, rendered in the Prometheus text
+format by the ``/metrics`` view.
+
+Stages are timed with ``timed(stage)``; the media type and model come from
+the labels bound for the current request with ``bind(...)``, which are kept
+in a context variable and therefore follow the call into ``sync_to_async``
+threads. Every observation is also logged as one JSON line on the
+``app.metrics`` logger when it is enabled for INFO.
+
+Values are per process: scrape each worker, or aggregate in Prometheus.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from . import backends
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_labels = contextvars.ContextVar("metrics_labels", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}"
+                )
+            formatted = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{formatted} {series[-1]}")
+            lines.append(f"{self.name}_count{formatted} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "absaigen_stage_seconds",
+    "Time spent per request stage.",
+    ("stage", "media_type", "model", "outcome"),
+)
+BYTES_SENT = Counter(
+    "absaigen_bytes_sent_total",
+    "Bytes of media streamed to clients by Python.",
+    ("stage", "media_type"),
+)
+
+
+@contextmanager
+def bind(**labels):
+    """Attach ``media_type``/``model`` labels to the stages timed inside."""
+    current = _labels.get() or {}
+    token = _labels.set({**current, **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def _current(stage: str, outcome: str) -> tuple:
+    labels = _labels.get() or {}
+    return (stage, labels.get("media_type", ""), labels.get("model", ""), outcome)
+
+
+def observe(stage: str, seconds: float, outcome: str = "success") -> None:
+    labels = _current(stage, outcome)
+    STAGE_SECONDS.observe(labels, seconds)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            "event": "stage",
+            "stage": stage,
+            "media_type": labels[1],
+            "model": labels[2],
+            "outcome": outcome,
+            "seconds": round(seconds, 6),
+        }, ensure_ascii=False))
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the block as ``stage``; an exception marks it as a failure."""
+    start = time.perf_counter()
+    outcome = "failure"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        observe(stage, time.perf_counter() - start, outcome)
+
+
+def timed_iter(stage: str, iterator, media_type: str = ""):
+    """
+    Pass a response body through while timing it from first to last chunk
+    and counting the bytes sent. A client that disconnects early shows up as
+    a failure.
+    """
+    start = time.perf_counter()
+    sent = 0
+    outcome = "failure"
+    try:
+        for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+        outcome = "success"
+    finally:
+        with bind(media_type=media_type):
+            observe(stage, time.perf_counter() - start, outcome)
+        BYTES_SENT.inc((stage, media_type), sent)
+
+
+def _backend_lines() -> list:
+    snapshot = backends.get_router().snapshot()
+    lines = [
+        "# HELP absaigen_backend_up Whether the xinference backend's circuit breaker is closed.",
+        "# TYPE absaigen_backend_up gauge",
+    ]
+    lines += [
+        f'absaigen_backend_up{{url="{_escape(b["url"])}"}} {int(b["state"] == "closed")}'
+        for b in snapshot
+    ]
+    lines += [
+        "# HELP absaigen_backend_inflight Requests currently routed to the xinference backend.",
+        "# TYPE absaigen_backend_inflight gauge",
+    ]
+    lines += [
+        f'absaigen_backend_inflight{{url="{_escape(b["url"])}"}} {b["inflight"]}'
+        for b in snapshot
+    ]
+    return lines
+
+
+def render() -> str:
+    lines = STAGE_SECONDS.render() + BYTES_SENT.render() + _backend_lines()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediarecord',
+            index=models.Index(fields=['media_type', 'created_at', 'id'], name='app_mediare_media_t_af06bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediarecord',
+            index=models.Index(fields=['created_at', 'id'], name='app_mediare_created_d3481c_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+def backfill_blobs(apps, schema_editor):
+    MediaRecord = apps.get_model('app', 'MediaRecord')
+    GenerationCacheEntry = apps.get_model('app', 'GenerationCacheEntry')
+    MediaBlob = apps.get_model('app', 'MediaBlob')
+    counts = {}
+    names = MediaRecord.objects.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True)
+    for name in names.iterator():
+        counts[name] = counts.get(name, 0) + 1
+    for name in GenerationCacheEntry.objects.values_list('file_name', flat=True).iterator():
+        counts[name] = counts.get(name, 0) + 1
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, ref_count=count) for name, count in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_generationcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# The search index as it was created at this point; app.search may change
+# later and must not change what this migration does.
+FTS_TABLE = "app_mediarecord_fts"
+
+SQLITE_INSTALL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        prompt, model, style, voice, media_type UNINDEXED,
+        content='app_mediarecord', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON app_mediarecord BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, prompt, model, style, voice, media_type)
+        VALUES (new.id, new.prompt, new.model, new.style, new.voice, new.media_type);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON app_mediarecord BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, prompt, model, style, voice, media_type)
+        VALUES ('delete', old.id, old.prompt, old.model, old.style, old.voice, old.media_type);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON app_mediarecord BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, prompt, model, style, voice, media_type)
+        VALUES ('delete', old.id, old.prompt, old.model, old.style, old.voice, old.media_type);
+        INSERT INTO {FTS_TABLE}(rowid, prompt, model, style, voice, media_type)
+        VALUES (new.id, new.prompt, new.model, new.style, new.voice, new.media_type);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+PG_INSTALL = [
+    "CREATE INDEX IF NOT EXISTS app_mediarecord_search_idx ON app_mediarecord USING GIN ("
+    "to_tsvector('simple', coalesce(prompt, '') || ' ' || coalesce(model, '') || ' ' "
+    "|| coalesce(style, '') || ' ' || coalesce(voice, '')))",
+]
+
+PG_UNINSTALL = [
+    "DROP INDEX IF EXISTS app_mediarecord_search_idx",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_mediablob'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_INSTALL, 'postgresql': PG_INSTALL}),
+            _run({'sqlite': SQLITE_UNINSTALL, 'postgresql': PG_UNINSTALL}),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_mediarecord_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='progress',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
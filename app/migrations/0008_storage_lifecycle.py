@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-17 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_generationjob_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mediarecord',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, null=True, upload_to='outputs/'),
+        ),
+    ]
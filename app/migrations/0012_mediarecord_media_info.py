@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-17 20:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_admission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediarecord',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediarecord',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediarecord',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-17 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_mediarecord_media_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationbatchitem',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='generationbatchitem',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+    ]
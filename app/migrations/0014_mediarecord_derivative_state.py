@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-17 21:02
+
+from pathlib import Path, PurePosixPath
+
+from django.conf import settings
+from django.db import migrations, models
+
+# thumbnail locations as app.derivatives lays them out at this point
+THUMBNAILS = {"image": ("thumb", ".webp"), "video": ("poster", ".jpg"), "audio": ("waveform", ".png")}
+
+
+def mark_existing(apps, schema_editor):
+    """Records whose thumbnail was built before the state was stored."""
+    MediaRecord = apps.get_model('app', 'MediaRecord')
+    files = (
+        MediaRecord.objects.exclude(file='').exclude(file__isnull=True)
+        .values_list('file', 'media_type').distinct()
+    )
+    for name, media_type in files.iterator():
+        if media_type not in THUMBNAILS:
+            continue
+        kind, suffix = THUMBNAILS[media_type]
+        stem = PurePosixPath(name).stem
+        if (Path(settings.MEDIA_ROOT) / 'derivatives' / kind / stem[:2] / f'{stem}{suffix}').exists():
+            MediaRecord.objects.filter(file=name).update(derivative_state='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_generationbatchitem_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediarecord',
+            name='derivative_state',
+            field=models.CharField(blank=True, choices=[('', 'Missing'), ('ready', 'Ready'), ('failed', 'Failed')], default='', max_length=10),
+        ),
+        migrations.RunPython(mark_existing, migrations.RunPython.noop),
+    ]
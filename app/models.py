@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class MediaRecord(models.Model):
@@ -7,18 +9,41 @@ class MediaRecord(models.Model):
         ("audio", "Audio"),
         ("video", "Video"),
     ]
+    DERIVATIVES_MISSING = ""
+    DERIVATIVES_READY = "ready"
+    DERIVATIVES_FAILED = "failed"
+    DERIVATIVE_STATE_CHOICES = [
+        (DERIVATIVES_MISSING, "Missing"),
+        (DERIVATIVES_READY, "Ready"),
+        (DERIVATIVES_FAILED, "Failed"),
+    ]
     id = models.AutoField(primary_key=True)
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES)
     model = models.CharField(max_length=100)
     prompt = models.TextField(blank=True)
     style = models.CharField(max_length=100, blank=True)
     voice = models.CharField(max_length=100, blank=True)
-    file = models.FileField(upload_to="outputs/", blank=True, null=True)
+    # indexed for blob reference lookups (app.blobs, app.lifecycle)
+    file = models.FileField(upload_to="outputs/", blank=True, null=True, db_index=True)
     result_url = models.URLField(blank=True)
+    # read from the container when the file is saved (MP4 videos), so
+    # listings need not probe it; null when unknown
+    duration = models.FloatField(blank=True, null=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    # set by app.derivatives once the thumbnail exists (or cannot be built),
+    # so listings need not look for it on disk
+    derivative_state = models.CharField(
+        max_length=10, blank=True, default=DERIVATIVES_MISSING, choices=DERIVATIVE_STATE_CHOICES
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-created_at", "-id"]
+        indexes = [
+            models.Index(fields=["media_type", "created_at", "id"]),
+            models.Index(fields=["created_at", "id"]),
+        ]
 
     def __str__(self) -> str:
         return f"{self.media_type} - {self.model} @ {self.created_at:%Y-%m-%d %H:%M:%S}"
@@ -28,3 +53,223 @@ class MediaRecord(models.Model):
         if self.file:
             return self.file.url
         return self.result_url
+
+
+class GenerationJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CANCELLED = "cancelled"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_CANCELLED, "Cancelled"),
+    ]
+    FINISHED_STATUSES = {STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED}
+    id = models.AutoField(primary_key=True)
+    media_type = models.CharField(max_length=10, choices=MediaRecord.MEDIA_TYPE_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # set by the cancel API while running; the worker stops the xinference job
+    cancel_requested = models.BooleanField(default=False)
+    params = models.JSONField(default=dict)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="generation_jobs",
+    )
+    record = models.ForeignKey(
+        MediaRecord,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="jobs",
+    )
+    error = models.CharField(max_length=200, blank=True)
+    detail = models.TextField(blank=True)
+    # latest status reported by xinference: stage, queue position, step progress
+    progress = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+        indexes = [
+            models.Index(fields=["status", "media_type", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"job {self.id} {self.media_type} [{self.status}]"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in self.FINISHED_STATUSES
+
+
+class WorkerHeartbeat(models.Model):
+    """A running ``WorkerPool`` and how many jobs of each media type it takes."""
+
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=200, unique=True)
+    concurrency = models.JSONField(default=dict)
+    seen_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self) -> str:
+        return f"workers {self.name} @ {self.seen_at:%Y-%m-%d %H:%M:%S}"
+
+
+class GenerationCacheEntry(models.Model):
+    """A finished generation that identical later requests can reuse."""
+
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=64, unique=True)
+    media_type = models.CharField(max_length=10, choices=MediaRecord.MEDIA_TYPE_CHOICES)
+    service_model = models.CharField(max_length=100)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ["-last_used_at"]
+
+    def __str__(self) -> str:
+        return f"cache {self.key[:12]} -> {self.file_name}"
+
+
+class MediaBlob(models.Model):
+    """A stored file and the number of records and cache entries pointing at it."""
+
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # last download or stream, at most hourly resolution (see app.lifecycle.touch)
+    last_used_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class GenerationBatch(models.Model):
+    """A set of prompts generated together; its items are the resume checkpoint."""
+
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="generation_batches",
+    )
+    source_name = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+
+    def __str__(self) -> str:
+        return f"batch {self.id} ({self.source_name or 'upload'})"
+
+
+class GenerationBatchItem(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+    ]
+    FINISHED_STATUSES = {STATUS_SUCCEEDED, STATUS_FAILED}
+    id = models.AutoField(primary_key=True)
+    batch = models.ForeignKey(GenerationBatch, on_delete=models.CASCADE, related_name="items")
+    index = models.PositiveIntegerField()
+    media_type = models.CharField(max_length=10, choices=MediaRecord.MEDIA_TYPE_CHOICES, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    params = models.JSONField(default=dict)
+    record = models.ForeignKey(
+        MediaRecord,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="batch_items",
+    )
+    error = models.CharField(max_length=200, blank=True)
+    detail = models.TextField(blank=True)
+    # when a runner took the item; running items claimed longer than
+    # BULK_GENERATION_CLAIM_TIMEOUT ago are taken over on resume
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["batch", "index"]
+        constraints = [
+            models.UniqueConstraint(fields=["batch", "index"], name="unique_batch_item_index"),
+        ]
+        indexes = [
+            models.Index(fields=["batch", "status"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"batch {self.batch_id} item {self.index} [{self.status}]"
+
+
+class AdmissionBucket(models.Model):
+    """
+    Token bucket of one user for one media type (``<media_type>:user:<id>``);
+    ``<media_type>:global`` rows only serialize admission decisions.
+    """
+
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=64, unique=True)
+    tokens = models.FloatField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"bucket {self.key} ({self.tokens:.2f})"
+
+
+class AdmissionLease(models.Model):
+    """A synchronous generation in flight; expired leases were left by a dead process."""
+
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="admission_leases",
+    )
+    media_type = models.CharField(max_length=10, choices=MediaRecord.MEDIA_TYPE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["media_type", "expires_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"lease {self.id} {self.media_type} until {self.expires_at:%H:%M:%S}"
+
+
+class Counter(models.Model):
+    """A named integer shared by every process, e.g. the listing version."""
+
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.name} = {self.value}"
@@ -0,0 +1,274 @@
+"""
+MP4 post-processing for generated videos, in pure Python.
+
+Encoders such as the one behind Wan2.1 write the ``moov`` box (the index
+of every sample) after the media data, so a browser has to fetch the whole
+file before it can start playing. ``faststart`` moves ``moov`` in front of
+the first ``mdat`` and shifts the chunk offsets in its ``stco``/``co64``
+tables by the same amount; the media data is copied byte for byte, nothing
+is re-encoded. ``probe`` walks the box structure, rejecting truncated or
+malformed files, and reads duration and frame size from ``mvhd``/``tkhd``.
+"""
+import struct
+from pathlib import Path
+from typing import NamedTuple
+
+SUFFIXES = {".mp4", ".m4v", ".mov"}
+# boxes on the way from moov to the chunk offset tables
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+# a moov this large is not something a generated clip produces
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+_UINT32_MAX = 0xFFFFFFFF
+_COPY_CHUNK = 1024 * 1024
+
+
+class InvalidMp4(ValueError):
+    pass
+
+
+class Mp4Info(NamedTuple):
+    duration: float | None
+    width: int | None
+    height: int | None
+    faststart: bool
+
+
+class _Box(NamedTuple):
+    type: bytes
+    start: int
+    header: int
+    end: int
+
+
+def handles(suffix: str) -> bool:
+    return suffix.lower() in SUFFIXES
+
+
+def _read_header(data: bytes, offset: int, limit: int):
+    """``(type, header size, box size)`` at ``offset``; size 0 runs to ``limit``."""
+    if limit - offset < 8:
+        raise InvalidMp4(f"truncated box header at {offset}")
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header = 8
+    if size == 1:
+        if limit - offset < 16:
+            raise InvalidMp4(f"truncated box header at {offset}")
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header = 16
+    elif size == 0:
+        size = limit - offset
+    if size < header or offset + size > limit:
+        raise InvalidMp4(f"box {box_type!r} at {offset} overruns its parent")
+    return box_type, header, size
+
+
+def _children(data: bytes, start: int = 0, end: int | None = None):
+    end = len(data) if end is None else end
+    offset = start
+    while offset < end:
+        box_type, header, size = _read_header(data, offset, end)
+        yield _Box(box_type, offset, header, offset + size)
+        offset += size
+
+
+def _top_level(f, file_size: int) -> list:
+    """Top-level boxes of the open file ``f``, which must tile it exactly."""
+    boxes, offset = [], 0
+    while offset < file_size:
+        f.seek(offset)
+        try:
+            box_type, header, size = _read_header(f.read(16), 0, file_size - offset)
+        except InvalidMp4 as exc:
+            raise InvalidMp4(f"truncated box at {offset}") from exc
+        boxes.append(_Box(box_type, offset, header, offset + size))
+        offset += size
+    return boxes
+
+
+def _top_level_of(path: Path):
+    size = path.stat().st_size
+    with path.open("rb") as f:
+        boxes = _top_level(f, size)
+        types = [box.type for box in boxes]
+        if b"moov" not in types:
+            raise InvalidMp4("no moov box")
+        if b"mdat" not in types and b"moof" not in types:
+            raise InvalidMp4("no mdat box")
+        moov = boxes[types.index(b"moov")]
+        if moov.end - moov.start > MAX_MOOV_BYTES:
+            raise InvalidMp4("moov box is too large")
+        f.seek(moov.start)
+        return boxes, f.read(moov.end - moov.start)
+
+
+def _first(data: bytes, box_type: bytes, start: int, end: int):
+    return next((box for box in _children(data, start, end) if box.type == box_type), None)
+
+
+def _movie_duration(moov: bytes, body: int, end: int):
+    mvhd = _first(moov, b"mvhd", body, end)
+    if mvhd is None:
+        raise InvalidMp4("no mvhd box")
+    at = mvhd.start + mvhd.header
+    if moov[at] == 1:
+        timescale, duration = struct.unpack_from(">IQ", moov, at + 20)
+        unknown = duration == 0xFFFFFFFFFFFFFFFF
+    else:
+        timescale, duration = struct.unpack_from(">II", moov, at + 12)
+        unknown = duration == _UINT32_MAX
+    if not timescale or not duration or unknown:
+        return None
+    return duration / timescale
+
+
+def _track_size(moov: bytes, trak: _Box):
+    """``(handler type, width, height)`` of one ``trak``."""
+    body = trak.start + trak.header
+    tkhd = _first(moov, b"tkhd", body, trak.end)
+    if tkhd is None:
+        raise InvalidMp4("trak without tkhd box")
+    at = tkhd.start + tkhd.header
+    # width and height are 16.16 fixed point, after the version-sized times
+    at += 76 if moov[at] == 0 else 88
+    width, height = struct.unpack_from(">II", moov, at)
+    handler = b""
+    mdia = _first(moov, b"mdia", body, trak.end)
+    if mdia is not None:
+        hdlr = _first(moov, b"hdlr", mdia.start + mdia.header, mdia.end)
+        if hdlr is not None:
+            handler = moov[hdlr.start + hdlr.header + 8:hdlr.start + hdlr.header + 12]
+    return handler, width >> 16, height >> 16
+
+
+def _describe(moov: bytes, faststart: bool) -> Mp4Info:
+    body = _read_header(moov, 0, len(moov))[1]
+    try:
+        duration = _movie_duration(moov, body, len(moov))
+        sizes = [
+            _track_size(moov, trak) for trak in _children(moov, body, len(moov)) if trak.type == b"trak"
+        ]
+        # the video track, or whichever track has a frame size
+        _, width, height = next(
+            (size for size in sizes if size[0] == b"vide"),
+            next((size for size in sizes if size[1]), (b"", None, None)),
+        )
+    except (struct.error, IndexError) as exc:
+        raise InvalidMp4(f"malformed moov box: {exc}") from exc
+    return Mp4Info(duration, width or None, height or None, faststart)
+
+
+def _is_faststart(boxes: list) -> bool:
+    types = [box.type for box in boxes]
+    media = [index for index, box_type in enumerate(types) if box_type in (b"mdat", b"moof")]
+    return types.index(b"moov") < media[0]
+
+
+def probe(path: Path) -> Mp4Info:
+    """Validate the MP4 at ``path`` and read its duration and frame size."""
+    boxes, moov = _top_level_of(path)
+    return _describe(moov, _is_faststart(boxes))
+
+
+def _box(box_type: bytes, body: bytes) -> bytes:
+    if len(body) + 8 > _UINT32_MAX:
+        return struct.pack(">I4sQ", 1, box_type, len(body) + 16) + body
+    return struct.pack(">I4s", len(body) + 8, box_type) + body
+
+
+class _NeedsCo64(Exception):
+    pass
+
+
+def _chunk_offsets(body: bytes, width: int) -> list:
+    count = struct.unpack_from(">I", body, 4)[0]
+    if len(body) < 8 + count * width:
+        raise InvalidMp4("truncated chunk offset table")
+    return list(struct.unpack_from(f">{count}{'I' if width == 4 else 'Q'}", body, 8))
+
+
+def _relocated(moov: bytes, start: int, end: int, relocate, upgrade: bool) -> bytes:
+    """
+    The boxes of ``moov[start:end]`` with every chunk offset passed through
+    ``relocate``; with ``upgrade`` 32-bit ``stco`` tables become ``co64``.
+    """
+    out = []
+    for box in _children(moov, start, end):
+        body = moov[box.start + box.header:box.end]
+        box_type = box.type
+        if box_type in _CONTAINERS:
+            body = _relocated(moov, box.start + box.header, box.end, relocate, upgrade)
+        elif box_type in (b"stco", b"co64"):
+            offsets = [relocate(offset) for offset in _chunk_offsets(body, 4 if box_type == b"stco" else 8)]
+            if box_type == b"stco" and upgrade:
+                box_type = b"co64"
+            if box_type == b"stco":
+                if offsets and max(offsets) > _UINT32_MAX:
+                    raise _NeedsCo64()
+                body = body[:8] + struct.pack(f">{len(offsets)}I", *offsets)
+            else:
+                body = body[:8] + struct.pack(f">{len(offsets)}Q", *offsets)
+        out.append(_box(box_type, body))
+    return b"".join(out)
+
+
+def _copy_range(src, dst, start: int, end: int) -> None:
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(_COPY_CHUNK, remaining))
+        if not chunk:
+            raise InvalidMp4("file shrank while being rewritten")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def faststart(path: Path, dest: Path) -> tuple:
+    """
+    Write ``path`` with its ``moov`` box moved in front of the media data to
+    ``dest``. Returns ``(rewritten, info)``; nothing is written when the file
+    is already fast-start, fragmented or has a compressed ``moov``.
+    """
+    boxes, moov = _top_level_of(path)
+    types = [box.type for box in boxes]
+    body = _read_header(moov, 0, len(moov))[1]
+    if _is_faststart(boxes) or b"moof" in types or _first(moov, b"cmov", body, len(moov)):
+        return False, _describe(moov, _is_faststart(boxes))
+
+    old = boxes[types.index(b"moov")]
+    insert_at = boxes[types.index(b"mdat")].start
+    upgrade = False
+    while True:
+        try:
+            # a first pass with offsets unchanged gives the new moov's size
+            new_size = len(_relocated(moov, 0, len(moov), lambda offset: offset, upgrade))
+            grown = new_size - (old.end - old.start)
+
+            def relocate(offset):
+                if offset < insert_at:
+                    return offset
+                return offset + new_size if offset < old.start else offset + grown
+
+            new_moov = _relocated(moov, 0, len(moov), relocate, upgrade)
+            break
+        except _NeedsCo64:
+            upgrade = True
+        except (struct.error, IndexError) as exc:
+            raise InvalidMp4(f"malformed moov box: {exc}") from exc
+
+    with path.open("rb") as src, dest.open("wb") as out:
+        _copy_range(src, out, 0, insert_at)
+        out.write(new_moov)
+        _copy_range(src, out, insert_at, old.start)
+        _copy_range(src, out, old.end, path.stat().st_size)
+    return True, _describe(new_moov, True)
+
+
+def prepare(path: Path):
+    """
+    Validate a generated MP4 and make it fast-start. Returns ``(path,
+    info)``, ``path`` being the rewritten file next to the original when a
+    rewrite was needed; raises ``InvalidMp4`` for a broken container.
+    """
+    dest = path.with_name(f"{path.stem}.faststart{path.suffix}")
+    rewritten, info = faststart(path, dest)
+    return (dest if rewritten else path), info
@@ -0,0 +1,101 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import Q
+
+# Upper bound for approximate totals; counting stops once this many rows match.
+APPROX_COUNT_LIMIT = 10000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(record) -> str:
+    raw = json.dumps([record.created_at.isoformat(), record.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor("invalid cursor") from exc
+
+
+def encode_offset_cursor(offset: int) -> str:
+    raw = json.dumps({"offset": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    """Offset of a cursor from ``encode_offset_cursor``; an empty cursor is 0."""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(padded))["offset"])
+    except (ValueError, TypeError, KeyError) as exc:
+        raise InvalidCursor("invalid cursor") from exc
+    if offset < 0:
+        raise InvalidCursor("invalid cursor")
+    return offset
+
+
+def keyset_page(qs, cursor: str, page_size: int):
+    """
+    Return ``(records, next_cursor)`` for the page after ``cursor`` in
+    ``-created_at, -id`` order. An empty cursor starts at the newest record.
+    Each page is a single index range scan regardless of depth: the bound on
+    ``created_at`` alone is what lets the planner seek, a bare OR of the two
+    cases makes SQLite scan the index from the start.
+    """
+    qs = qs.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk)
+        )
+    records = list(qs[: page_size + 1])
+    next_cursor = None
+    if len(records) > page_size:
+        records = records[:page_size]
+        next_cursor = encode_cursor(records[-1])
+    return records, next_cursor
+
+
+def _table_estimate(model):
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row and row[0] >= 0:
+        return int(row[0])
+    return None
+
+
+def count_total(qs, mode: str, filtered: bool):
+    """
+    Count ``qs`` according to ``mode``: ``exact`` runs COUNT(*), ``approx``
+    uses planner statistics for the whole table on PostgreSQL or a count
+    capped at ``APPROX_COUNT_LIMIT``, ``none`` skips counting. Returns
+    ``(total, estimated)``.
+    """
+    if mode == "none":
+        return None, False
+    if mode == "approx":
+        if not filtered:
+            estimate = _table_estimate(qs.model)
+            if estimate is not None:
+                return estimate, True
+        capped = qs.order_by()[:APPROX_COUNT_LIMIT].count()
+        return capped, capped >= APPROX_COUNT_LIMIT
+    return qs.count(), False
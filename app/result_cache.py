@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import blobs, counters
+from .models import GenerationCacheEntry, MediaRecord
+
+logger = logging.getLogger(__name__)
+
+_COUNTER_KEY = "generation_cache:{}:{}"
+
+
+def is_enabled() -> bool:
+    return settings.GENERATION_CACHE_ENABLED
+
+
+def make_key(service_model: str, api_name: str, inputs: dict) -> str:
+    """Hash the service and every input sent to it into a stable cache key."""
+    canonical = json.dumps(
+        {"service": service_model, "api": api_name, "inputs": inputs},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _count(outcome: str, media_type: str) -> None:
+    counters.increment(_COUNTER_KEY.format(outcome, media_type))
+
+
+def stats() -> dict:
+    """
+    Hit/miss counters per media type. They are kept in the database, so the
+    ``prune_generation_cache`` command sees the counts of every process.
+    """
+    names = {
+        (media_type, outcome): _COUNTER_KEY.format(outcome, media_type)
+        for media_type, _ in MediaRecord.MEDIA_TYPE_CHOICES
+        for outcome in ("hit", "miss")
+    }
+    values = counters.get_many(list(names.values()))
+    result = {}
+    for (media_type, outcome), name in names.items():
+        result.setdefault(media_type, {})[outcome] = values[name]
+    return result
+
+
+def lookup(key: str, media_type: str):
+    """Return the live cache entry for ``key`` or ``None``, counting the outcome."""
+    entry = GenerationCacheEntry.objects.filter(key=key).first()
+    if entry is not None and not default_storage.exists(entry.file_name):
+        entry.delete()
+        entry = None
+    if entry is None:
+        _count("miss", media_type)
+        return None
+    GenerationCacheEntry.objects.filter(pk=entry.pk).update(
+        hits=F("hits") + 1, last_used_at=timezone.now()
+    )
+    _count("hit", media_type)
+    return entry
+
+
+def store(key: str, media_type: str, service_model: str, file_name: str) -> None:
+    try:
+        size = default_storage.size(file_name)
+    except (OSError, NotImplementedError):
+        size = 0
+    try:
+        with transaction.atomic():
+            GenerationCacheEntry.objects.create(
+                key=key,
+                media_type=media_type,
+                service_model=service_model,
+                file_name=file_name,
+                size=size,
+            )
+    except IntegrityError:
+        # an identical concurrent request stored its result first
+        return
+    except blobs.MissingBlob:
+        # the file was cleaned up meanwhile; nothing to cache
+        return
+    prune()
+
+
+def prune() -> int:
+    """
+    Drop entries older than ``GENERATION_CACHE_MAX_AGE`` and then the least
+    recently used ones until the total stays within
+    ``GENERATION_CACHE_MAX_BYTES``. The file itself goes away only when no
+    record references it any more (see ``app.blobs``).
+    """
+    evicted = 0
+    cutoff = timezone.now() - timedelta(seconds=settings.GENERATION_CACHE_MAX_AGE)
+    for entry in GenerationCacheEntry.objects.filter(created_at__lt=cutoff):
+        entry.delete()
+        evicted += 1
+
+    total = GenerationCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+    if total > settings.GENERATION_CACHE_MAX_BYTES:
+        for entry in GenerationCacheEntry.objects.order_by("last_used_at").iterator():
+            if total <= settings.GENERATION_CACHE_MAX_BYTES:
+                break
+            entry.delete()
+            total -= entry.size
+            evicted += 1
+    if evicted:
+        logger.info("evicted %d generation cache entries", evicted)
+    return evicted
@@ -0,0 +1,247 @@
+"""
+Full-text search over the prompt, model, style and voice of media records.
+
+On SQLite the records are indexed in an FTS5 table using the trigram
+tokenizer, so Chinese prompts (which have no word separators) match on any
+substring of three or more characters. A query made only of shorter terms
+(common for Chinese) cannot use the index and is matched with ``LIKE`` over
+the whole table, walked newest first so that a page stops scanning as soon as
+it is full; ``total=approx`` keeps its count bounded. Triggers on
+``app_mediarecord`` keep the index in sync with every insert, update and
+delete, including bulk ones.
+On PostgreSQL a GIN expression index over ``to_tsvector('simple', ...)`` is
+used and ranked with ``ts_rank``. The ``simple`` configuration splits on
+whitespace and punctuation only, so a Chinese prompt is a single token there
+and only whole-prompt (or whole-phrase) queries match it. Other databases
+fall back to ``icontains``.
+
+Results are ordered by relevance, then newest first.
+"""
+from django.db import connection
+from django.db.models import Q
+
+from .models import MediaRecord
+from .pagination import APPROX_COUNT_LIMIT
+
+FTS_TABLE = "app_mediarecord_fts"
+FIELDS = ("prompt", "model", "style", "voice")
+# the trigram tokenizer cannot match shorter terms through the index
+MIN_TERM_LENGTH = 3
+
+_SQLITE_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        prompt, model, style, voice, media_type UNINDEXED,
+        content='app_mediarecord', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON app_mediarecord BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, prompt, model, style, voice, media_type)
+        VALUES (new.id, new.prompt, new.model, new.style, new.voice, new.media_type);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON app_mediarecord BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, prompt, model, style, voice, media_type)
+        VALUES ('delete', old.id, old.prompt, old.model, old.style, old.voice, old.media_type);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON app_mediarecord BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, prompt, model, style, voice, media_type)
+        VALUES ('delete', old.id, old.prompt, old.model, old.style, old.voice, old.media_type);
+        INSERT INTO {FTS_TABLE}(rowid, prompt, model, style, voice, media_type)
+        VALUES (new.id, new.prompt, new.model, new.style, new.voice, new.media_type);
+    END
+    """,
+]
+
+_PG_VECTOR = (
+    "to_tsvector('simple', coalesce(prompt, '') || ' ' || coalesce(model, '') || ' ' "
+    "|| coalesce(style, '') || ' ' || coalesce(voice, ''))"
+)
+
+
+def install(schema_editor) -> None:
+    """Create the search index for the current database (idempotent)."""
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for statement in _SQLITE_SCHEMA:
+            schema_editor.execute(statement)
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS app_mediarecord_search_idx "
+            f"ON app_mediarecord USING GIN ({_PG_VECTOR})"
+        )
+
+
+def rebuild(schema_editor) -> None:
+    """Re-index every existing record."""
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall(schema_editor) -> None:
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS app_mediarecord_search_idx")
+
+
+def ensure_installed(**kwargs) -> None:
+    """
+    post_migrate hook: SQLite drops triggers when a migration rebuilds
+    ``app_mediarecord``, so recreate anything that is missing. Row ids survive
+    the rebuild, so the index itself stays valid.
+    """
+    if connection.vendor != "sqlite":
+        return
+    if "app_mediarecord" not in connection.introspection.table_names():
+        return
+    with connection.schema_editor() as schema_editor:
+        install(schema_editor)
+
+
+def terms(query: str) -> list:
+    return [term for term in query.split() if term]
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", r"\%").replace("_", r"\_")
+
+
+def _sqlite_where(words: list, media_type):
+    """
+    ``(source, where, params, ranked)``: the FTS table filtered with MATCH
+    when a term is long enough for the index, otherwise ``app_mediarecord``
+    itself, whose rowid order lets a newest-first scan stop early.
+    """
+    long_terms = [w for w in words if len(w) >= MIN_TERM_LENGTH]
+    short_terms = [w for w in words if len(w) < MIN_TERM_LENGTH]
+    clauses, params = [], []
+    if long_terms:
+        source = FTS_TABLE
+        clauses.append(f"{FTS_TABLE} MATCH %s")
+        params.append(" AND ".join(_quote(w) for w in long_terms))
+    else:
+        source = "app_mediarecord"
+    for term in short_terms:
+        pattern = f"%{_escape_like(term)}%"
+        clauses.append(
+            "(" + " OR ".join(f"{field} LIKE %s ESCAPE '\\'" for field in FIELDS) + ")"
+        )
+        params.extend([pattern] * len(FIELDS))
+    if media_type:
+        clauses.append("media_type = %s")
+        params.append(media_type)
+    return source, " AND ".join(clauses), params, bool(long_terms)
+
+
+def _sqlite_ids(words: list, media_type, offset: int, limit: int) -> list:
+    source, where, params, ranked = _sqlite_where(words, media_type)
+    order = f"bm25({FTS_TABLE}), rowid DESC" if ranked else "rowid DESC"
+    sql = f"SELECT rowid FROM {source} WHERE {where} ORDER BY {order} LIMIT %s OFFSET %s"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_count(words: list, media_type, limit) -> int:
+    source, where, params, _ = _sqlite_where(words, media_type)
+    sql = f"SELECT rowid FROM {source} WHERE {where}"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params = params + [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM ({sql})", params)
+        return cursor.fetchone()[0]
+
+
+def _pg_where(query: str, media_type):
+    where = f"{_PG_VECTOR} @@ websearch_to_tsquery('simple', %s)"
+    params = [query]
+    if media_type:
+        where += " AND media_type = %s"
+        params.append(media_type)
+    return where, params
+
+
+def _pg_ids(query: str, media_type, offset: int, limit: int) -> list:
+    where, params = _pg_where(query, media_type)
+    sql = (
+        f"SELECT id FROM app_mediarecord WHERE {where} "
+        f"ORDER BY ts_rank({_PG_VECTOR}, websearch_to_tsquery('simple', %s)) DESC, "
+        "created_at DESC, id DESC LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [query, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _pg_count(query: str, media_type, limit) -> int:
+    where, params = _pg_where(query, media_type)
+    sql = f"SELECT 1 FROM app_mediarecord WHERE {where}"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params = params + [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM ({sql}) AS matches", params)
+        return cursor.fetchone()[0]
+
+
+def _fallback_queryset(words: list, media_type):
+    qs = MediaRecord.objects.all()
+    if media_type:
+        qs = qs.filter(media_type=media_type)
+    for word in words:
+        match = Q()
+        for field in FIELDS:
+            match |= Q(**{f"{field}__icontains": word})
+        qs = qs.filter(match)
+    return qs.order_by("-created_at", "-id")
+
+
+def ranked_ids(query: str, media_type=None, offset: int = 0, limit: int = 20) -> list:
+    """Ids of the records matching ``query``, best match first."""
+    words = terms(query)
+    if not words:
+        return []
+    if connection.vendor == "sqlite":
+        return _sqlite_ids(words, media_type, offset, limit)
+    if connection.vendor == "postgresql":
+        return _pg_ids(query, media_type, offset, limit)
+    qs = _fallback_queryset(words, media_type)
+    return list(qs.values_list("id", flat=True)[offset:offset + limit])
+
+
+def count(query: str, media_type=None, limit=None) -> int:
+    """Number of matches, counting at most ``limit`` when given."""
+    words = terms(query)
+    if not words:
+        return 0
+    if connection.vendor == "sqlite":
+        return _sqlite_count(words, media_type, limit)
+    if connection.vendor == "postgresql":
+        return _pg_count(query, media_type, limit)
+    qs = _fallback_queryset(words, media_type)
+    if limit is not None:
+        qs = qs[:limit]
+    return qs.count()
+
+
+def count_total(query: str, media_type, mode: str):
+    """``pagination.count_total`` for search results: ``(total, estimated)``."""
+    if mode == "none":
+        return None, False
+    if mode == "approx":
+        capped = count(query, media_type, limit=APPROX_COUNT_LIMIT)
+        return capped, capped >= APPROX_COUNT_LIMIT
+    return count(query, media_type), False
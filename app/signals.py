@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import blobs, listing_cache, search
+from .models import GenerationCacheEntry, MediaRecord
+
+
+@receiver(post_save, sender=MediaRecord)
+def _acquire_record_file(sender, instance, created, **kwargs):
+    if created and instance.file:
+        blobs.acquire(instance.file.name)
+
+
+@receiver(post_delete, sender=MediaRecord)
+def _release_record_file(sender, instance, **kwargs):
+    if instance.file:
+        blobs.release(instance.file.name)
+
+
+@receiver(post_save, sender=MediaRecord)
+@receiver(post_delete, sender=MediaRecord)
+def _invalidate_listing(sender, **kwargs):
+    listing_cache.bump()
+
+
+@receiver(post_save, sender=GenerationCacheEntry)
+def _acquire_cache_file(sender, instance, created, **kwargs):
+    if created:
+        blobs.acquire(instance.file_name)
+
+
+@receiver(post_delete, sender=GenerationCacheEntry)
+def _release_cache_file(sender, instance, **kwargs):
+    blobs.release(instance.file_name)
+
+
+@receiver(post_migrate)
+def _ensure_search_index(sender, **kwargs):
+    if sender.name == "app":
+        search.ensure_installed()
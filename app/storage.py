@@ -0,0 +1,113 @@
+import errno
+import hashlib
+import os
+import posixpath
+import re
+from pathlib import Path
+from uuid import uuid4
+
+from django.core.files.storage import FileSystemStorage
+
+CHUNK_SIZE = 256 * 1024
+INCOMING_DIR = ".incoming"
+
+
+# ``<dir>/<aa>/<sha256><ext>``, as laid out by ``_blob_name``
+_BLOB_NAME = re.compile(r"(?:.+/)?([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.[0-9a-z]+)?")
+
+
+def is_blob_name(name: str) -> bool:
+    """Whether ``name`` (relative to the storage root) is laid out like a stored blob."""
+    return _BLOB_NAME.fullmatch(name) is not None
+
+
+def _blob_name(name: str, digest: str) -> str:
+    directory = posixpath.dirname(name)
+    suffix = posixpath.splitext(name)[1].lower()
+    return posixpath.join(directory, digest[:2], f"{digest}{suffix}")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Filesystem storage that names every file by the SHA-256 of its content.
+
+    The digest is computed while the upload streams to a temporary file; the
+    temporary file is then renamed into ``<dir>/<aa>/<sha256><ext>``, or
+    dropped if that blob already exists. Saving identical bytes twice
+    therefore returns the same name and uses the disk once. Deleting a blob
+    is left to ``app.blobs`` which tracks how many records reference it.
+    """
+
+    def _incoming_path(self) -> Path:
+        directory = Path(self.path(INCOMING_DIR))
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / uuid4().hex
+
+    def _commit(self, tmp_path: Path, name: str, digest: str) -> str:
+        blob = _blob_name(name, digest)
+        target = Path(self.path(blob))
+        if target.exists():
+            tmp_path.unlink(missing_ok=True)
+            return blob
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(tmp_path, self.file_permissions_mode)
+        os.replace(tmp_path, target)
+        return blob
+
+    def _save(self, name, content):
+        if hasattr(content, "temporary_file_path"):
+            return self.save_local(name, Path(content.temporary_file_path()), move=True)
+        tmp_path = self._incoming_path()
+        digest = hashlib.sha256()
+        try:
+            with tmp_path.open("wb") as dest:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    digest.update(chunk)
+                    dest.write(chunk)
+            return self._commit(tmp_path, name, digest.hexdigest())
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def get_available_name(self, name, max_length=None):
+        # blob names are derived from content, never from the requested name
+        return name
+
+    def save_local(self, name: str, path: Path, move: bool = False) -> str:
+        """
+        Store the local file ``path`` without copying when possible: it is
+        hashed in place and then moved (``move=True``) or hardlinked into the
+        blob directory. Files on another filesystem are copied once.
+        """
+        digest = hashlib.sha256()
+        with path.open("rb") as src:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        blob = _blob_name(name, digest)
+        target = Path(self.path(blob))
+        if target.exists():
+            if move:
+                path.unlink(missing_ok=True)
+            return blob
+
+        tmp_path = self._incoming_path()
+        try:
+            try:
+                if move:
+                    os.rename(path, tmp_path)
+                else:
+                    os.link(path, tmp_path)
+            except OSError as exc:
+                if exc.errno not in {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP}:
+                    raise
+                with path.open("rb") as src, tmp_path.open("wb") as dest:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                        dest.write(chunk)
+                if move:
+                    path.unlink(missing_ok=True)
+            return self._commit(tmp_path, name, digest)
+        finally:
+            tmp_path.unlink(missing_ok=True)
@@ -1,3 +1,1308 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import wave
+import zipfile
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    admission,
+    archive,
+    backends,
+    blobs,
+    bulk,
+    derivatives,
+    generation,
+    ingest,
+    jobs,
+    lifecycle,
+    listing_cache,
+    media_response,
+    mp4,
+    result_cache,
+    search,
+    tts,
+    views,
+)
+from .fake_xinference import VIDEO_SECONDS, VIDEO_SIZE, fake_mp4
+from .pagination import InvalidCursor, count_total, decode_cursor, encode_cursor, keyset_page
+from .models import (
+    AdmissionLease,
+    GenerationBatchItem,
+    GenerationCacheEntry,
+    GenerationJob,
+    MediaBlob,
+    MediaRecord,
+    WorkerHeartbeat,
+)
+
+
+class MediaRootMixin:
+    """Run each test against an empty MEDIA_ROOT of its own."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, DERIVATIVES_ENABLED=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+def _streamed(response) -> bytes:
+    """The body of a streaming response, also when the async views serve it."""
+    if response.is_async:
+        async def collect():
+            return b"".join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(collect)()
+    return b"".join(response.streaming_content)
+
+
+class BlobRefCountTests(MediaRootMixin, TestCase):
+    def _store(self, data=b"same bytes"):
+        return default_storage.save("image/result.png", ContentFile(data))
+
+    def _record(self, name):
+        return MediaRecord.objects.create(media_type="image", model="m", file=name)
+
+    def test_identical_content_shares_one_blob(self):
+        first, second = self._store(), self._store()
+        self.assertEqual(first, second)
+        self._record(first)
+        self._record(second)
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 2)
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        name = self._store()
+        a, b = self._record(name), self._record(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            a.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            b.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_acquire_between_release_and_cleanup_keeps_the_file(self):
+        name = self._store()
+        old = self._record(name)
+        with self.captureOnCommitCallbacks() as callbacks:
+            old.delete()
+            # a new result deduplicated onto the same blob before cleanup ran
+            new = self._record(self._store())
+        for callback in callbacks:
+            callback()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        self.assertEqual(new.file.name, name)
+
+    def test_acquire_after_cleanup_refuses_a_missing_file(self):
+        name = self._store()
+        # storage deduplicates before the last reference goes away ...
+        deduplicated = self._store()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._record(name).delete()
+        self.assertFalse(default_storage.exists(name))
+        # ... so the new record must not point at the deleted file
+        with self.assertRaises(blobs.MissingBlob), transaction.atomic():
+            self._record(deduplicated)
+        self.assertFalse(MediaRecord.objects.filter(file=name).exists())
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_release_many_deletes_only_orphans(self):
+        shared, single = self._store(b"shared"), self._store(b"single")
+        self._record(shared)
+        dropped = self._record(shared)
+        only = self._record(single)
+        with blobs.deferred_releases() as released:
+            MediaRecord.objects.filter(pk__in=[dropped.pk, only.pk]).delete()
+        self.assertEqual(released, {shared: 1, single: 1})
+        with self.captureOnCommitCallbacks() as callbacks:
+            orphaned = blobs.release_many(released)
+        self.assertEqual(orphaned, [single])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(MediaBlob.objects.get(name=shared).ref_count, 1)
+        self.assertTrue(blobs.delete_if_unreferenced(single))
+        self.assertFalse(default_storage.exists(single))
+        self.assertTrue(default_storage.exists(shared))
+
+
+@override_settings(STORAGE_ORPHAN_GRACE=0)
+class ReconcileTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.kept = default_storage.save("image/a.png", ContentFile(b"kept"))
+        self.orphan = default_storage.save("image/b.png", ContentFile(b"orphan"))
+        MediaRecord.objects.create(media_type="image", model="m", file=self.kept)
+        self.foreign = os.path.join(self.media_root, "static", "logo.png")
+        os.makedirs(os.path.dirname(self.foreign))
+        with open(self.foreign, "wb") as f:
+            f.write(b"not ours")
+
+    def test_orphans_are_only_reported_by_default(self):
+        result = lifecycle.reconcile()
+        self.assertEqual(result["orphan_files"], 1)
+        self.assertTrue(default_storage.exists(self.orphan))
+
+    def test_delete_removes_only_storage_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = lifecycle.reconcile(delete=True)
+        self.assertEqual(result["orphan_files"], 1)
+        self.assertFalse(default_storage.exists(self.orphan))
+        self.assertTrue(default_storage.exists(self.kept))
+        self.assertTrue(os.path.exists(self.foreign))
+
+    def test_drifted_ref_count_is_recounted(self):
+        MediaBlob.objects.filter(name=self.kept).update(ref_count=5)
+        self.assertEqual(lifecycle.reconcile()["fixed_ref_counts"], 1)
+        self.assertEqual(MediaBlob.objects.get(name=self.kept).ref_count, 1)
+
+
+@override_settings(STORAGE_RECOMPRESS_AFTER=60)
+class RecompressTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from PIL import Image
+
+        png = io.BytesIO()
+        # noise: large as PNG, much smaller as lossy WebP
+        Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3)).save(png, "PNG")
+        self.name = default_storage.save("image/cold.png", ContentFile(png.getvalue()))
+        self.record = MediaRecord.objects.create(media_type="image", model="m", file=self.name)
+        derivatives.build(self.name, "image")
+        MediaBlob.objects.filter(name=self.name).update(created_at=timezone.now() - timedelta(hours=1))
+
+    def test_recompressed_record_gets_a_new_thumbnail(self):
+        old_thumb = derivatives.thumbnail_name(self.name, "image")
+        self.assertTrue(default_storage.exists(old_thumb))
+        with mock.patch.object(derivatives, "schedule") as schedule, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(lifecycle.recompress_cold_images()["images"], 1)
+        self.record.refresh_from_db()
+        new_name = self.record.file.name
+        self.assertTrue(new_name.endswith(".webp"))
+        self.assertEqual(self.record.derivative_state, MediaRecord.DERIVATIVES_MISSING)
+        self.assertIsNone(views._serialize_record(self.record)["thumbnail_url"])
+        self.assertFalse(default_storage.exists(old_thumb))
+        schedule.assert_called_once_with(new_name, "image")
+
+        derivatives.build(new_name, "image")
+        self.record.refresh_from_db()
+        url = views._serialize_record(self.record)["thumbnail_url"]
+        self.assertTrue(url.endswith(derivatives.thumbnail_name(new_name, "image")))
+        self.assertTrue(default_storage.exists(derivatives.thumbnail_name(new_name, "image")))
+
+
+class BulkParsingTests(TestCase):
+    def test_csv_rows_are_strings(self):
+        rows = bulk.read_rows("prompt,style,seed\n一只猫,水墨,7\n,,\n".encode(), "csv")
+        self.assertEqual(rows[0], {"prompt": "一只猫", "style": "水墨", "seed": "7"})
+        self.assertEqual(rows[1]["prompt"], "")
+
+    def test_jsonl_values_are_coerced_to_strings(self):
+        rows = bulk.read_rows(b'{"prompt": 123, "seed": 7}\n\n{"prompt": "a", "style": null}\n', "jsonl")
+        self.assertEqual(rows, [{"prompt": "123", "seed": "7"}, {"prompt": "a", "style": None}])
+
+    def test_non_string_prompt_does_not_crash_the_upload(self):
+        rows = bulk.read_rows(b'{"prompt": 123}\n{"prompt": null}\n', "jsonl")
+        batch = bulk.create_batch(rows, "image")
+        first, second = batch.items.order_by("index")
+        self.assertEqual(first.status, GenerationBatchItem.STATUS_PENDING)
+        self.assertEqual(first.params["prompt"], "123")
+        self.assertEqual(second.status, GenerationBatchItem.STATUS_FAILED)
+
+    def test_rows_with_bad_media_type_fail_individually(self):
+        batch = bulk.create_batch([{"prompt": "a"}, {"prompt": "b", "media_type": "gif"}], "image")
+        self.assertEqual(bulk.summary(batch)["pending"], 1)
+        self.assertEqual(bulk.summary(batch)["failed"], 1)
+
+    def test_invalid_files_are_rejected(self):
+        for data, fmt in [
+            (b"style\nx\n", "csv"),
+            (b'{"style": "x"}\n', "jsonl"),
+            (b'{"prompt": \n', "jsonl"),
+            (b'["prompt"]\n', "jsonl"),
+            (b"prompt\n", "xml"),
+        ]:
+            with self.subTest(data=data, fmt=fmt), self.assertRaises(bulk.InvalidBatch):
+                bulk.read_rows(data, fmt)
+
+    def test_items_are_claimed_once(self):
+        batch = bulk.create_batch([{"prompt": "a"}], "image")
+        item = batch.items.get()
+        self.assertTrue(bulk._claim(item))
+        self.assertFalse(bulk._claim(batch.items.get()))
+        self.assertEqual(batch.items.get().status, GenerationBatchItem.STATUS_RUNNING)
+
+
+@override_settings(
+    XINFERENCE_BACKENDS=[{"url": "http://a"}, {"url": "http://b"}],
+    XINFERENCE_BREAKER_FAILURES=2,
+    XINFERENCE_BREAKER_COOLDOWN=60,
+    XINFERENCE_HEALTH_INTERVAL=0,
+    XINFERENCE_RETRY_ATTEMPTS=1,
+)
+class BackendRoutingTests(SimpleTestCase):
+    def setUp(self):
+        backends.reset_router()
+        self.addCleanup(backends.reset_router)
+
+    def _call(self, down=(), error=ConnectionRefusedError):
+        tried = []
+
+        def fn(base_url):
+            tried.append(base_url)
+            if base_url in down:
+                raise error(base_url)
+            return base_url
+
+        return backends.call("sd3", fn), tried
+
+    def test_refused_call_fails_over_to_another_backend(self):
+        for _ in range(4):
+            served, tried = self._call(down={"http://a"})
+            self.assertEqual(served, "http://b")
+            self.assertLessEqual(len(tried), 2)
+
+    def test_error_after_the_work_started_is_not_retried(self):
+        with self.assertRaises(RuntimeError):
+            self._call(down={"http://a", "http://b"}, error=RuntimeError)
+        with self.assertRaises(ConnectionRefusedError):
+            self._call(down={"http://a", "http://b"})
+
+    def test_failing_backend_is_ejected_until_its_trial_succeeds(self):
+        router = backends.Router([{"url": "http://a"}, {"url": "http://b"}], failure_threshold=2, cooldown=0)
+        a = next(backend for backend in router.backends if backend.url == "http://a")
+        for _ in range(2):
+            router.acquire("sd3", exclude={"http://b"})
+            router.release(a, failed=True)
+        self.assertIsNotNone(a.open_until)
+        # the cooldown has passed: one trial request, then nothing until it finishes
+        self.assertIs(router.acquire("sd3", exclude={"http://b"}), a)
+        self.assertIsNone(router.acquire("sd3", exclude={"http://b"}))
+        router.release(a, failed=False)
+        self.assertIsNone(a.open_until)
+        self.assertEqual(router.snapshot()[0]["state"], "closed")
+
+    def test_failed_trial_reopens_the_breaker(self):
+        router = backends.Router([{"url": "http://a"}], failure_threshold=1, cooldown=60)
+        backend = router.acquire("sd3")
+        router.release(backend, failed=True)
+        self.assertIsNone(router.acquire("sd3"))
+        self.assertEqual(router.snapshot()[0]["state"], "open")
+
+    def test_no_backend_for_the_model(self):
+        with override_settings(XINFERENCE_BACKENDS=[{"url": "http://a", "models": ["wan"]}]):
+            backends.reset_router()
+            with self.assertRaises(backends.NoBackendAvailable):
+                self._call()
+
+
+class Mp4FaststartTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.payload = bytes(range(256)) * 16
+        self.source = Path(directory) / "clip.mp4"
+        self.source.write_bytes(fake_mp4(self.payload))
+        self.dest = Path(directory) / "clip.faststart.mp4"
+
+    def test_moov_is_moved_in_front_of_mdat(self):
+        rewritten, info = mp4.faststart(self.source, self.dest)
+        self.assertTrue(rewritten)
+        self.assertEqual(info, mp4.Mp4Info(VIDEO_SECONDS, *VIDEO_SIZE, True))
+        data = self.dest.read_bytes()
+        self.assertEqual(len(data), self.source.stat().st_size)
+        self.assertLess(data.index(b"moov"), data.index(b"mdat"))
+        # the chunk offset still points at the (moved) media data
+        at = data.index(b"stco") + 12
+        offset = struct.unpack_from(">I", data, at)[0]
+        self.assertEqual(data[offset:offset + len(self.payload)], self.payload)
+        self.assertEqual(mp4.probe(self.dest), info)
+
+    def test_fast_start_file_is_left_alone(self):
+        mp4.faststart(self.source, self.dest)
+        again = self.dest.with_name("again.mp4")
+        rewritten, info = mp4.faststart(self.dest, again)
+        self.assertFalse(rewritten)
+        self.assertTrue(info.faststart)
+        self.assertFalse(again.exists())
+
+    def test_prepare_returns_the_rewritten_file(self):
+        path, info = mp4.prepare(self.source)
+        self.assertEqual(path, self.dest)
+        self.assertEqual((info.width, info.height), VIDEO_SIZE)
+
+    def test_truncated_file_is_rejected(self):
+        self.source.write_bytes(self.source.read_bytes()[:-10])
+        with self.assertRaises(mp4.InvalidMp4):
+            mp4.probe(self.source)
+        with self.assertRaises(mp4.InvalidMp4):
+            mp4.faststart(self.source, self.dest)
+
+    def test_file_without_moov_is_rejected(self):
+        data = self.source.read_bytes()
+        self.source.write_bytes(data[:data.index(b"moov") - 4])
+        with self.assertRaises(mp4.InvalidMp4):
+            mp4.probe(self.source)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        records = [
+            MediaRecord.objects.create(media_type="image" if i % 2 else "audio", model="m", prompt=str(i))
+            for i in range(7)
+        ]
+        # pairs of records share a timestamp, so ties are broken by id
+        for i, record in enumerate(records):
+            MediaRecord.objects.filter(pk=record.pk).update(created_at=now - timedelta(minutes=i // 2))
+        cls.newest_first = list(MediaRecord.objects.order_by("-created_at", "-id"))
+
+    def _walk(self, qs, page_size):
+        seen, cursor = [], ""
+        while True:
+            records, cursor = keyset_page(qs, cursor, page_size)
+            seen.extend(records)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_record_once_in_order(self):
+        for page_size in (1, 2, 3, 7, 10):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self._walk(MediaRecord.objects.all(), page_size), self.newest_first)
+
+    def test_filtered_pages(self):
+        images = [record for record in self.newest_first if record.media_type == "image"]
+        self.assertEqual(self._walk(MediaRecord.objects.filter(media_type="image"), 2), images)
+
+    def test_cursor_round_trip(self):
+        record = self.newest_first[3]
+        self.assertEqual(decode_cursor(encode_cursor(record)), (record.created_at, record.id))
+        for cursor in ("not base64!", "e30", encode_cursor(record)[:-3]):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_count_modes(self):
+        qs = MediaRecord.objects.all()
+        self.assertEqual(count_total(qs, "exact", False), (7, False))
+        self.assertEqual(count_total(qs, "approx", False), (7, False))
+        self.assertEqual(count_total(qs, "none", False), (None, False))
+
+    def test_cursor_listing_endpoint(self):
+        user = get_user_model().objects.create_user("pager", password="x")
+        self.client.force_login(user)
+        first = self.client.get("/api/records/", {"cursor": "", "page_size": 4}).json()
+        self.assertEqual([r["id"] for r in first["records"]], [r.id for r in self.newest_first[:4]])
+        self.assertIsNone(first["total"])
+        second = self.client.get("/api/records/", {"cursor": first["next_cursor"], "page_size": 4}).json()
+        self.assertEqual([r["id"] for r in second["records"]], [r.id for r in self.newest_first[4:]])
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual(self.client.get("/api/records/", {"cursor": "bogus"}).status_code, 400)
+
+
+class WorkerAvailabilityTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("worker-check", password="x"))
+
+    def _submit(self, media_type="image"):
+        return self.client.post(
+            "/api/jobs/", {"media_type": media_type, "prompt": "一只猫"}, content_type="application/json"
+        )
+
+    def test_no_workers_is_reported_instead_of_queueing(self):
+        response = self._submit()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["code"], "no_workers")
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_live_pool_takes_jobs_of_its_media_types(self):
+        pool = jobs.WorkerPool({"image": 1, "audio": 0, "video": 0})
+        pool._beat()
+        self.assertTrue(jobs.workers_available("image"))
+        self.assertFalse(jobs.workers_available("audio"))
+        self.assertEqual(self._submit().status_code, 202)
+        WorkerHeartbeat.objects.update(seen_at=timezone.now() - timedelta(seconds=jobs.HEARTBEAT_TIMEOUT + 1))
+        self.assertFalse(jobs.workers_available("image"))
+
+    @override_settings(GENERATION_INLINE_WORKERS=True)
+    def test_inline_workers_are_always_available(self):
+        self.assertTrue(jobs.workers_available("video"))
+
+
+@override_settings(
+    ADMISSION_ENABLED=True,
+    ADMISSION_LIMITS={"image": {"user": 1, "global": 4, "rate": 600, "burst": 100, "retry_after": 0.05}},
+)
+class BulkAdmissionTests(MediaRootMixin, TestCase):
+    def test_batch_respects_the_user_concurrency_cap(self):
+        user = get_user_model().objects.create_user("bulk-cap", password="x")
+        batch = bulk.create_batch([{"prompt": str(i)} for i in range(4)], "image", user=user)
+        active, peak = [], []
+        guard = threading.Lock()
+
+        def render(item):
+            with guard:
+                active.append(item.pk)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with guard:
+                active.remove(item.pk)
+            return MediaRecord(media_type="image", model="m", prompt=item.params["prompt"]), None
+
+        with mock.patch.object(bulk, "_render_item", render):
+            done = list(bulk.run_batch(batch, concurrency=4))
+        self.assertEqual(len(done), 4)
+        self.assertEqual(max(peak), 1)
+        self.assertEqual(bulk.summary(batch)["succeeded"], 4)
+        self.assertFalse(AdmissionLease.objects.exists())
+
+
+class ListingETagTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_login(get_user_model().objects.create_user("poller", password="x"))
+        self.record = self._record(b"a")
+
+    def _record(self, data):
+        name = default_storage.save("image/a.png", ContentFile(data))
+        return MediaRecord.objects.create(media_type="image", model="m", file=name)
+
+    def _get(self, tag=None):
+        headers = {"If-None-Match": tag} if tag else {}
+        return self.client.get("/api/records/", {"page_size": 5}, headers=headers)
+
+    def _assert_revalidates(self):
+        first = self._get()
+        self.assertEqual(first.status_code, 200)
+        tag = first["ETag"]
+        self.assertEqual(self._get(tag).status_code, 304)
+        return tag
+
+    def test_unchanged_listing_is_not_modified(self):
+        self._assert_revalidates()
+
+    @override_settings(RECORDS_LIST_CACHE_TIMEOUT=0)
+    def test_etag_does_not_need_the_body_cache(self):
+        tag = self._assert_revalidates()
+        with mock.patch.object(listing_cache, "store") as store:
+            self._get()
+        store.assert_not_called()
+        self.assertEqual(self._get()["ETag"], tag)
+
+    def test_library_change_invalidates_the_etag(self):
+        tag = self._assert_revalidates()
+        self._record(b"b")
+        response = self._get(tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["records"]), 2)
+
+    def test_derivative_state_invalidates_the_etag(self):
+        tag = self._assert_revalidates()
+        derivatives.mark(self.record.file.name, MediaRecord.DERIVATIVES_FAILED)
+        self.assertEqual(self._get(tag).status_code, 200)
+
+
+@override_settings(GENERATION_CACHE_ENABLED=True)
+class ResultCacheTests(MediaRootMixin, TestCase):
+    def _store(self, prompt, data=None):
+        key = result_cache.make_key("sd", "text_to_image", {"prompt": prompt})
+        name = default_storage.save("image/result.png", ContentFile(data or prompt.encode()))
+        result_cache.store(key, "image", "sd", name)
+        return key, name
+
+    def test_miss_then_hit(self):
+        key = result_cache.make_key("sd", "text_to_image", {"prompt": "cat"})
+        self.assertIsNone(result_cache.lookup(key, "image"))
+        _, name = self._store("cat")
+        entry = result_cache.lookup(key, "image")
+        self.assertEqual(entry.file_name, name)
+        self.assertEqual(GenerationCacheEntry.objects.get(key=key).hits, 1)
+        self.assertEqual(result_cache.stats()["image"], {"hit": 1, "miss": 1})
+
+    def test_key_covers_service_and_inputs(self):
+        base = result_cache.make_key("sd", "text_to_image", {"prompt": "cat", "n": 1})
+        self.assertEqual(base, result_cache.make_key("sd", "text_to_image", {"n": 1, "prompt": "cat"}))
+        self.assertNotEqual(base, result_cache.make_key("sdxl", "text_to_image", {"prompt": "cat", "n": 1}))
+        self.assertNotEqual(base, result_cache.make_key("sd", "text_to_image", {"prompt": "cat", "n": 2}))
+
+    def test_deleted_file_invalidates_the_entry(self):
+        key, name = self._store("cat")
+        default_storage.delete(name)
+        self.assertIsNone(result_cache.lookup(key, "image"))
+        self.assertFalse(GenerationCacheEntry.objects.filter(key=key).exists())
+        self.assertEqual(result_cache.stats()["image"]["miss"], 1)
+
+    def test_prune_drops_expired_then_least_recently_used(self):
+        expired, _ = self._store("old")
+        stale, _ = self._store("stale", b"x" * 100)
+        fresh, _ = self._store("fresh", b"y" * 100)
+        GenerationCacheEntry.objects.filter(key=expired).update(
+            created_at=timezone.now() - timedelta(days=30)
+        )
+        GenerationCacheEntry.objects.filter(key=stale).update(
+            last_used_at=timezone.now() - timedelta(hours=1)
+        )
+        with override_settings(GENERATION_CACHE_MAX_BYTES=150):
+            self.assertEqual(result_cache.prune(), 2)
+        self.assertEqual(list(GenerationCacheEntry.objects.values_list("key", flat=True)), [fresh])
+
+
+class JobSubmitTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("submitter", password="x"))
+        jobs.WorkerPool({"image": 1, "audio": 1, "video": 1})._beat()
+
+    def _post(self, body):
+        return self.client.post("/api/jobs/", body, content_type="application/json")
+
+    def test_bad_body_is_rejected(self):
+        for body in ("not json", "[]", '"prompt"'):
+            with self.subTest(body=body):
+                self.assertEqual(self._post(body).status_code, 400)
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_unknown_media_type_is_rejected(self):
+        response = self._post({"media_type": "hologram", "prompt": "一只猫"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_valid_job_is_queued(self):
+        response = self._post({"media_type": "image", "prompt": "一只猫"})
+        self.assertEqual(response.status_code, 202)
+        job = GenerationJob.objects.get()
+        self.assertEqual(response.json()["job"]["id"], job.pk)
+        self.assertEqual(job.status, GenerationJob.STATUS_QUEUED)
+        self.assertEqual(job.params["prompt"], "一只猫")
+        status = self.client.get(f"/api/jobs/{job.pk}/").json()["job"]
+        self.assertEqual(status["status"], GenerationJob.STATUS_QUEUED)
+
+    def test_worker_claims_and_runs_the_oldest_job(self):
+        first, second = (jobs.enqueue("audio", {"prompt": p}) for p in ("一", "二"))
+        self.assertEqual(jobs.queue_position(second), 1)
+        record = MediaRecord.objects.create(media_type="audio", model="m")
+        with mock.patch.object(jobs, "generate", return_value=record) as generate:
+            claimed = jobs.claim_next("audio")
+            self.assertEqual(claimed.pk, first.pk)
+            finished = jobs.run_job(claimed)
+        generate.assert_called_once()
+        self.assertEqual(finished.status, GenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(finished.record, record)
+        self.assertIsNotNone(finished.finished_at)
+        self.assertEqual(jobs.queue_position(GenerationJob.objects.get(pk=second.pk)), 0)
+
+
+class RangeRequestTests(MediaRootMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.name = default_storage.save("audio/clip.wav", ContentFile(b"0123456789"))
+
+    def _get(self, **headers):
+        request = RequestFactory().get("/", headers=headers)
+        response = media_response.serve_file(request, self.name, as_attachment=False)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_single_range_is_partial(self):
+        for header, expected, content_range in (
+            ("bytes=2-5", b"2345", "bytes 2-5/10"),
+            ("bytes=7-", b"789", "bytes 7-9/10"),
+            ("bytes=-3", b"789", "bytes 7-9/10"),
+            ("bytes=8-100", b"89", "bytes 8-9/10"),
+        ):
+            with self.subTest(header=header):
+                response, body = self._get(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(body, expected)
+                self.assertEqual(response["Content-Range"], content_range)
+
+    def test_unsatisfiable_range(self):
+        for header in ("bytes=10-", "bytes=-0"):
+            with self.subTest(header=header):
+                response, _ = self._get(Range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_invalid_range_serves_the_whole_file(self):
+        for header in ("bytes=5-2", "bytes=abc", "items=0-1", "bytes=0-1,4-5"):
+            with self.subTest(header=header):
+                response, body = self._get(Range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, b"0123456789")
+
+    def test_if_range_mismatch_serves_the_whole_file(self):
+        etag = self._get()[0]["ETag"]
+        response, body = self._get(Range="bytes=0-1", If_Range='"stale"')
+        self.assertEqual((response.status_code, body), (200, b"0123456789"))
+        response, body = self._get(Range="bytes=0-1", If_Range=etag)
+        self.assertEqual((response.status_code, body), (206, b"01"))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create skips the blob signals; the search triggers still fire
+        MediaRecord.objects.bulk_create(
+            [MediaRecord(media_type="image", model="m", prompt="一只橘猫在睡觉", file="image/cat.png")]
+            + [MediaRecord(media_type="audio", model="m", prompt=f"雨声 {i}", file="audio/rain.wav")
+               for i in range(6000)]
+            + [MediaRecord(media_type="image", model="m", prompt="100% 猫", file="image/pct.png")]
+        )
+
+    def test_long_terms_use_the_trigram_index(self):
+        ids = search.ranked_ids("橘猫在")
+        self.assertEqual(MediaRecord.objects.get(pk=ids[0]).prompt, "一只橘猫在睡觉")
+        self.assertEqual(search.count("橘猫在"), 1)
+
+    def test_short_terms_reach_old_records(self):
+        ids = search.ranked_ids("猫", offset=0, limit=5)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(search.count_total("猫", None, "exact"), (2, False))
+        self.assertEqual(search.count("雨", "audio"), 6000)
+        self.assertEqual(search.count("猫", "audio"), 0)
+
+    def test_like_wildcards_are_literal(self):
+        self.assertEqual(search.count("0%"), 1)
+        self.assertEqual(search.count("_"), 0)
+
+
+class _StreamedResponse:
+    """Stand-in for a streamed ``requests`` response."""
+
+    def __init__(self, chunks, length=None):
+        self.chunks = chunks
+        self.headers = {"Content-Length": str(length)} if length is not None else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield from self.chunks
+
+
+class IngestTests(MediaRootMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.source_dir, ignore_errors=True)
+
+    def _source(self, data=b"result bytes"):
+        path = self.source_dir / "out.png"
+        path.write_bytes(data)
+        return path
+
+    def _read(self, name):
+        with default_storage.open(name) as f:
+            return f.read()
+
+    def test_bytes_are_stored(self):
+        name = ingest.store_result(b"raw", "image/result.png")
+        self.assertEqual(self._read(name), b"raw")
+
+    def test_local_file_is_linked_and_kept(self):
+        source = self._source()
+        name = ingest.store_result(str(source), "image/result.png")
+        self.assertEqual(self._read(name), b"result bytes")
+        self.assertTrue(source.exists())
+        # same filesystem: no copy was made
+        self.assertTrue(os.path.samefile(source, default_storage.path(name)))
+
+    def test_local_file_can_be_moved(self):
+        source = self._source()
+        name = ingest.store_result(str(source), "image/result.png", move=True)
+        self.assertEqual(self._read(name), b"result bytes")
+        self.assertFalse(source.exists())
+
+    def test_url_is_streamed_in_chunks(self):
+        response = _StreamedResponse([b"ab", b"cd", b"ef"])
+        with mock.patch("requests.get", return_value=response):
+            name = ingest.store_result("http://xinference/file=out.wav", "audio/result.wav")
+        self.assertEqual(self._read(name), b"abcdef")
+
+    @override_settings(GENERATION_MAX_RESULT_BYTES=4)
+    def test_oversized_results_are_refused_without_leftovers(self):
+        with self.assertRaises(ingest.ResultTooLarge):
+            ingest.store_result(b"12345", "image/result.png")
+        with self.assertRaises(ingest.ResultTooLarge):
+            ingest.store_result(str(self._source(b"12345")), "image/result.png")
+        # no Content-Length: the cap is hit mid-stream
+        response = _StreamedResponse([b"123", b"45"])
+        with mock.patch("requests.get", return_value=response), self.assertRaises(ingest.ResultTooLarge):
+            ingest.store_result("http://xinference/file=out.wav", "audio/result.wav")
+        response = _StreamedResponse([], length=5)
+        with mock.patch("requests.get", return_value=response), self.assertRaises(ingest.ResultTooLarge):
+            ingest.store_result("http://xinference/file=out.wav", "audio/result.wav")
+        stored = [p for p in Path(self.media_root).rglob("*") if p.is_file()]
+        self.assertEqual(stored, [])
+
+
+class ZipExportTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user_model().objects.create_user("zipper", password="x"))
+        self.image = default_storage.save("image/a.png", ContentFile(b"png bytes"))
+        self.audio = default_storage.save("audio/a.wav", ContentFile(b"wav bytes" * 100))
+        self.records = [
+            MediaRecord.objects.create(media_type="image", model="m", file=self.image),
+            MediaRecord.objects.create(media_type="audio", model="m", file=self.audio),
+        ]
+
+    def _post(self, body):
+        return self.client.post("/api/records/download/", body, content_type="application/json")
+
+    def test_archive_is_streamed_in_chunks(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        paths = []
+        for sub in ("one", "two"):
+            (directory / sub).mkdir()
+            path = directory / sub / "clip.wav"
+            path.write_bytes(os.urandom(4096))
+            paths.append(path)
+        chunks = list(archive.iter_zip(archive.unique_arcnames(paths), chunk_size=1024))
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+            self.assertEqual(zip_file.namelist(), ["clip.wav", "clip (1).wav"])
+            self.assertEqual(zip_file.read("clip (1).wav"), paths[1].read_bytes())
+
+    def test_download_contains_every_record(self):
+        response = self._post({"ids": [r.pk for r in self.records]})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = _streamed(response)
+        with zipfile.ZipFile(io.BytesIO(body)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            entries = {info.filename: info for info in zip_file.infolist()}
+            image = entries[Path(self.image).name]
+            audio = entries[Path(self.audio).name]
+            # already-compressed formats are stored, the rest deflated
+            self.assertEqual(image.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(audio.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zip_file.read(audio), b"wav bytes" * 100)
+
+    def test_bad_requests(self):
+        self.assertEqual(self._post("[]").status_code, 400)
+        self.assertEqual(self._post({"ids": []}).status_code, 400)
+        self.assertEqual(self._post({"ids": ["x"]}).status_code, 400)
+        self.assertEqual(self._post({"ids": [0]}).status_code, 404)
+
+
+class _PendingPrediction:
+    """A gradio_client job that never finishes on its own."""
+
+    def __init__(self):
+        self.cancelled = False
+
+    def result(self, timeout=None):
+        raise FutureTimeout()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def status(self):
+        raise AssertionError("no progress callback was given")
+
+
+class CancellationTests(MediaRootMixin, TestCase):
+    def _job(self, status=GenerationJob.STATUS_RUNNING, **fields):
+        return GenerationJob.objects.create(media_type="image", params={"prompt": "猫"}, status=status, **fields)
+
+    def test_wait_stops_the_upstream_job_on_cancel(self):
+        prediction = _PendingPrediction()
+        with self.assertRaises(generation.GenerationCancelled):
+            generation._wait(prediction, None, should_cancel=lambda: True)
+        self.assertTrue(prediction.cancelled)
+
+    def test_wait_stops_the_upstream_job_at_its_deadline(self):
+        prediction = _PendingPrediction()
+        with self.assertRaises(generation.GenerationTimeout) as caught:
+            generation._wait(prediction, 0.01)
+        self.assertTrue(prediction.cancelled)
+        self.assertEqual(caught.exception.status, 504)
+
+    @override_settings(GENERATION_DEADLINES={"sd": 30}, GENERATION_DEFAULT_DEADLINE=600)
+    def test_deadline_per_model(self):
+        self.assertEqual(generation.deadline_for("sd"), 30)
+        self.assertEqual(generation.deadline_for("other"), 600)
+
+    def test_cancel_finishes_queued_and_flags_running_jobs(self):
+        queued, running = self._job(GenerationJob.STATUS_QUEUED), self._job()
+        self.assertEqual(jobs.cancel(queued.pk).status, GenerationJob.STATUS_CANCELLED)
+        running = jobs.cancel(running.pk)
+        self.assertEqual(running.status, GenerationJob.STATUS_RUNNING)
+        self.assertTrue(running.cancel_requested)
+        self.assertIsNone(jobs.cancel(0))
+
+    def test_worker_reports_a_cancelled_generation(self):
+        job = self._job(cancel_requested=True)
+
+        def generate(media_type, params, on_progress=None, should_cancel=None):
+            self.assertTrue(should_cancel())
+            raise generation.GenerationCancelled()
+
+        with mock.patch.object(jobs, "generate", generate):
+            job = jobs.run_job(job)
+        self.assertEqual(job.status, GenerationJob.STATUS_CANCELLED)
+
+    def test_cancel_after_generation_discards_the_result(self):
+        job = self._job()
+        name = default_storage.save("image/late.png", ContentFile(b"late"))
+
+        def generate(media_type, params, on_progress=None, should_cancel=None):
+            # the cancel arrives after the last check inside generate()
+            jobs.cancel(job.pk)
+            return MediaRecord.objects.create(media_type="image", model="m", file=name)
+
+        with mock.patch.object(jobs, "generate", generate):
+            job = jobs.run_job(job)
+        self.assertEqual(job.status, GenerationJob.STATUS_CANCELLED)
+        self.assertIsNone(job.record)
+        self.assertFalse(MediaRecord.objects.exists())
+
+    def test_requeue_keeps_cancel_requests(self):
+        cancelled, interrupted = self._job(cancel_requested=True), self._job()
+        self.assertEqual(jobs.requeue_running(), 1)
+        cancelled.refresh_from_db()
+        interrupted.refresh_from_db()
+        self.assertEqual(cancelled.status, GenerationJob.STATUS_CANCELLED)
+        self.assertEqual(interrupted.status, GenerationJob.STATUS_QUEUED)
+
+    def test_cancel_endpoint(self):
+        self.client.force_login(get_user_model().objects.create_user("canceller", password="x"))
+        running = self._job()
+        response = self.client.post(f"/api/jobs/{running.pk}/cancel/")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.post("/api/jobs/0/cancel/").status_code, 404)
+
+
+def _write_wav(path, frames: int, value: int = 0) -> Path:
+    with wave.open(str(path), "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(16000)
+        out.writeframes(struct.pack("<h", value) * frames)
+    return Path(path)
+
+
+class LongFormSpeechTests(MediaRootMixin, TestCase):
+    TEXT = "第一句话。第二句话！" + "这是一个很长的句子，" * 6 + "结束。"
+
+    def setUp(self):
+        super().setUp()
+        self.scratch = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.scratch, ignore_errors=True)
+
+    def test_split_keeps_every_character_within_the_limit(self):
+        segments = tts.split_text(self.TEXT, max_chars=20)
+        self.assertGreater(len(segments), 2)
+        self.assertTrue(all(len(segment) <= 20 for segment in segments))
+        self.assertEqual("".join(segments), self.TEXT)
+        # short sentences are merged, long ones cut at a comma, never mid-clause
+        self.assertTrue(segments[0].startswith("第一句话。第二句话！"))
+        self.assertTrue(all(segment[-1] in "。！，" for segment in segments))
+
+    @override_settings(TTS_LONG_FORM_MIN_CHARS=10)
+    def test_long_form_threshold_and_override(self):
+        self.assertTrue(tts.wants_long_form(self.TEXT))
+        self.assertFalse(tts.wants_long_form("短句"))
+        self.assertFalse(tts.wants_long_form(self.TEXT, "false"))
+        self.assertTrue(tts.wants_long_form("短句", True))
+
+    def test_segments_are_yielded_in_text_order(self):
+        def synthesize_one(text, dest_stem):
+            # later segments finish first
+            time.sleep(0.05 if text == "a" else 0)
+            return text
+
+        results = list(tts.synthesize(["a", "b", "c"], synthesize_one, self.scratch, concurrency=3))
+        self.assertEqual(results, [(0, "a"), (1, "b"), (2, "c")])
+
+    def test_a_failed_segment_is_raised(self):
+        def synthesize_one(text, dest_stem):
+            if text == "b":
+                raise RuntimeError("xinference down")
+            return text
+
+        segments = tts.synthesize(["a", "b", "c"], synthesize_one, self.scratch, concurrency=1)
+        self.assertEqual(next(segments), (0, "a"))
+        with self.assertRaises(RuntimeError):
+            next(segments)
+
+    def test_wav_segments_are_joined_without_reencoding(self):
+        paths = [_write_wav(self.scratch / f"{i}.wav", 100 * (i + 1), value=i) for i in range(3)]
+        joined = tts.stitch(paths, self.scratch / "joined.wav")
+        with wave.open(str(joined), "rb") as result:
+            self.assertEqual(result.getnframes(), 600)
+            self.assertEqual(result.readframes(600)[-2:], struct.pack("<h", 2))
+
+    def test_mp3_join_drops_tags_and_vbr_headers(self):
+        # MPEG-1 layer III, 128 kbit/s, 44.1 kHz: 417-byte frames
+        header = b"\xff\xfb\x90\x00"
+        audio = header + b"\x01" * 413
+        xing = (header + b"\x00" * 32 + b"Xing").ljust(417, b"\x00")
+        first = self.scratch / "0.mp3"
+        first.write_bytes(b"ID3\x04\x00\x00\x00\x00\x00\x00" + xing + audio)
+        second = self.scratch / "1.mp3"
+        second.write_bytes(audio)
+        joined = tts.stitch([first, second], self.scratch / "joined.mp3")
+        self.assertEqual(joined.read_bytes(), audio * 2)
+
+    def test_long_prompt_is_saved_as_one_record(self):
+        calls = []
+
+        def predict(service, inputs, on_progress=None, should_cancel=None):
+            calls.append(inputs["input_text"])
+            return str(_write_wav(self.scratch / f"seg{len(calls)}.wav", 160))
+
+        params = generation.parse_params("audio", {"prompt": self.TEXT, "long_form": True})
+        with override_settings(TTS_SEGMENT_MAX_CHARS=20), \
+                mock.patch.object(generation, "_predict", predict):
+            items = list(generation.iter_long_form("audio", params))
+        *segments, record = items
+        self.assertEqual([total for _, total, _ in segments], [len(calls)] * len(calls))
+        self.assertGreater(len(calls), 2)
+        self.assertEqual(record.prompt, self.TEXT)
+        with wave.open(default_storage.path(record.file.name), "rb") as result:
+            self.assertEqual(result.getnframes(), 160 * len(calls))
+
+
+def _delete_files_now(names):
+    """``blobs.delete_files_later`` without the pool, inside the test transaction."""
+    for name in names:
+        blobs.delete_if_unreferenced(name)
+
+
+class BulkRecordTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user_model().objects.create_user("librarian", password="x"))
+
+    def _post(self, path, body):
+        return self.client.post(path, body, content_type="application/json")
+
+    def _record(self, name, media_type="image"):
+        return MediaRecord.objects.create(media_type=media_type, model="m", file=name)
+
+    def test_bulk_create_inserts_every_record(self):
+        version = listing_cache.version()
+        response = self._post("/api/records/create/", {"records": [
+            {"media_type": "image", "prompt": "猫", "url": "http://example.com/a.png"},
+            {"media_type": "audio", "prompt": "雨"},
+        ]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["created"], 2)
+        self.assertEqual(MediaRecord.objects.count(), 2)
+        self.assertGreater(listing_cache.version(), version)
+
+    def test_bulk_create_is_all_or_nothing(self):
+        response = self._post("/api/records/create/", {"records": [
+            {"media_type": "image"}, {"media_type": "hologram"},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("record 1", response.content.decode())
+        self.assertFalse(MediaRecord.objects.exists())
+        for body in ("5", '"records"', "[]", '{"records": []}'):
+            with self.subTest(body=body):
+                self.assertEqual(self._post("/api/records/create/", body).status_code, 400)
+
+    def test_delete_by_ids_removes_only_unreferenced_files(self):
+        shared = default_storage.save("image/shared.png", ContentFile(b"shared"))
+        single = default_storage.save("image/single.png", ContentFile(b"single"))
+        dropped, only, kept = self._record(shared), self._record(single), self._record(shared)
+        with mock.patch.object(blobs, "delete_files_later", _delete_files_now), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self._post("/api/records/delete/", {"ids": [dropped.pk, only.pk, 0]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "deleted": 2,
+            "by_media_type": {"image": 2},
+            "files_released": 2,
+            "files_scheduled": 1,
+            "not_found": [0],
+        })
+        self.assertEqual(list(MediaRecord.objects.values_list("pk", flat=True)), [kept.pk])
+        self.assertTrue(default_storage.exists(shared))
+        self.assertFalse(default_storage.exists(single))
+        self.assertEqual(MediaBlob.objects.get(name=shared).ref_count, 1)
+
+    def test_delete_by_filter(self):
+        image = self._record(default_storage.save("image/a.png", ContentFile(b"a")))
+        audio = self._record(default_storage.save("audio/a.wav", ContentFile(b"b")), "audio")
+        MediaRecord.objects.filter(pk=audio.pk).update(created_at=timezone.now() - timedelta(days=10))
+        before = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self._post("/api/records/delete/", {"created_before": before})
+        self.assertEqual(response.json()["by_media_type"], {"audio": 1})
+        self.assertEqual(list(MediaRecord.objects.values_list("pk", flat=True)), [image.pk])
+
+    def test_delete_needs_a_selection(self):
+        for body in ({}, {"ids": []}, {"ids": ["x"]}, {"created_after": "soon"}, "[]"):
+            with self.subTest(body=body):
+                self.assertEqual(self._post("/api/records/delete/", body).status_code, 400)
+
+
+@override_settings(ADMISSION_LIMITS={
+    "image": {"user": 1, "global": 2, "rate": 60, "burst": 10, "queued": 1, "retry_after": 7},
+})
+class AdmissionTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice, self.bob, self.carol = (User.objects.create_user(name) for name in ("alice", "bob", "carol"))
+
+    def _queue(self, user, count=1, status=GenerationJob.STATUS_QUEUED):
+        return [GenerationJob.objects.create(user=user, media_type="image", params={}, status=status)
+                for _ in range(count)]
+
+    def test_user_limit_and_release(self):
+        lease = admission.acquire(self.alice, "image")
+        with self.assertRaises(admission.Rejected) as caught:
+            admission.acquire(self.alice, "image")
+        self.assertEqual((caught.exception.status, caught.exception.retry_after), (429, 7))
+        admission.release(lease)
+        admission.release(admission.acquire(self.alice, "image"))
+
+    def test_global_limit_counts_running_jobs(self):
+        self._queue(self.alice, status=GenerationJob.STATUS_RUNNING)
+        admission.acquire(self.bob, "image")
+        with self.assertRaises(admission.Rejected) as caught:
+            admission.acquire(self.carol, "image")
+        self.assertEqual(caught.exception.error, "生成服务繁忙")
+
+    def test_expired_leases_are_dropped(self):
+        admission.acquire(self.alice, "image")
+        AdmissionLease.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        admission.acquire(self.alice, "image")
+        self.assertEqual(AdmissionLease.objects.count(), 1)
+
+    @override_settings(ADMISSION_LIMITS={"image": {"user": 5, "global": 5, "rate": 1, "burst": 2}})
+    def test_rate_limit_tells_when_to_retry(self):
+        admission.acquire(self.alice, "image")
+        admission.acquire(self.alice, "image")
+        with self.assertRaises(admission.Rejected) as caught:
+            admission.acquire(self.alice, "image")
+        self.assertEqual(caught.exception.error, "请求过于频繁")
+        self.assertGreater(caught.exception.retry_after, 50)
+        # buckets are per user
+        admission.acquire(self.bob, "image")
+
+    def test_queued_jobs_per_user(self):
+        admission.admit_job(self.alice, "image")
+        self._queue(self.alice)
+        with self.assertRaises(admission.Rejected):
+            admission.admit_job(self.alice, "image")
+        admission.admit_job(self.bob, "image")
+
+    def test_least_served_user_goes_first(self):
+        busy = self._queue(self.alice, 3)
+        for user in (self.alice, self.alice, self.bob):
+            GenerationJob.objects.create(user=user, media_type="image", params={},
+                                         status=GenerationJob.STATUS_SUCCEEDED, started_at=timezone.now())
+        waiting = self._queue(self.bob)
+        self.assertEqual(admission.fair_candidates("image"), [waiting[0].pk, busy[0].pk])
+        with override_settings(ADMISSION_USER_WEIGHTS={"alice": 10}):
+            self.assertEqual(admission.fair_candidates("image"), [busy[0].pk, waiting[0].pk])
+        # a user at their own limit is skipped, at the global limit nobody runs
+        self._queue(self.bob, status=GenerationJob.STATUS_RUNNING)
+        self.assertEqual(admission.fair_candidates("image"), [busy[0].pk])
+        self._queue(self.carol, status=GenerationJob.STATUS_RUNNING)
+        self.assertEqual(admission.fair_candidates("image"), [])
+
+    def test_rejection_is_a_429_with_retry_after(self):
+        self.client.force_login(self.alice)
+        admission.acquire(self.alice, "image")
+        response = self.client.post("/api/image/", {"prompt": "猫"}, content_type="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+
+
+class DerivativeTests(MediaRootMixin, TestCase):
+    def _record(self, media_type, name, data):
+        name = default_storage.save(name, ContentFile(data))
+        return MediaRecord.objects.create(media_type=media_type, model="m", file=name)
+
+    def _image(self):
+        from PIL import Image
+
+        png = io.BytesIO()
+        Image.new("RGB", (800, 400), (200, 40, 40)).save(png, "PNG")
+        return self._record("image", "image/big.png", png.getvalue())
+
+    def _audio(self):
+        wav = io.BytesIO()
+        with wave.open(wav, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(8000)
+            out.writeframes(b"".join(struct.pack("<h", i * 10) for i in range(3000)))
+        return self._record("audio", "audio/tone.wav", wav.getvalue())
+
+    def _serialize(self, record):
+        record.refresh_from_db()
+        return views._serialize_record(record)
+
+    def test_urls_appear_once_built(self):
+        from PIL import Image
+
+        record = self._image()
+        self.assertIsNone(self._serialize(record)["thumbnail_url"])
+        derivatives.build(record.file.name, "image")
+        thumb = derivatives.thumbnail_name(record.file.name, "image")
+        self.assertTrue(self._serialize(record)["thumbnail_url"].endswith(thumb))
+        with Image.open(default_storage.path(thumb)) as img:
+            self.assertEqual((img.format, img.size), ("WEBP", (320, 160)))
+
+    def test_audio_gets_a_waveform_and_peaks(self):
+        record = self._audio()
+        with mock.patch.object(derivatives, "_ffmpeg", return_value=None):
+            derivatives.build(record.file.name, "audio")
+        data = self._serialize(record)
+        self.assertIsNotNone(data["thumbnail_url"])
+        with default_storage.open(derivatives.peaks_name(record.file.name)) as f:
+            peaks = json.load(f)
+        self.assertEqual(len(peaks), derivatives.WAVEFORM_BUCKETS)
+        self.assertEqual(max(peaks), 1.0)
+        # the samples rise, and so do the peaks
+        self.assertLess(peaks[0], peaks[-1])
+
+    def test_failed_build_is_recorded_and_retried(self):
+        record = self._record("video", "video/clip.mp4", fake_mp4(b"frames"))
+        with mock.patch.object(derivatives, "_ffmpeg", return_value=None), \
+                self.assertLogs("app.derivatives", "WARNING"):
+            derivatives._build_quietly(record.file.name, "video")
+        record.refresh_from_db()
+        self.assertEqual(record.derivative_state, MediaRecord.DERIVATIVES_FAILED)
+        self.assertIsNone(views._serialize_record(record)["thumbnail_url"])
+        out = io.StringIO()
+        with mock.patch.object(derivatives, "_video_poster", return_value=b"jpeg"):
+            call_command("build_derivatives", "--retry-failed", stdout=out)
+        self.assertIn("processed 1 files, 0 failed", out.getvalue())
+        self.assertIsNotNone(self._serialize(record)["thumbnail_url"])
+
+    def test_derivatives_go_with_the_last_reference(self):
+        record = self._image()
+        derivatives.build(record.file.name, "image")
+        thumb = derivatives.thumbnail_name(record.file.name, "image")
+        with self.captureOnCommitCallbacks(execute=True):
+            record.delete()
+        self.assertFalse(default_storage.exists(thumb))
+
+    def test_schedule_is_off_when_disabled(self):
+        with mock.patch.object(derivatives, "_build_quietly") as build:
+            derivatives.schedule("image/a.png", "image")
+        build.assert_not_called()
+
+
+class LifecycleTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def _record(self, media_type, data, age=0):
+        name = default_storage.save(f"{media_type}/file.bin", ContentFile(data))
+        record = MediaRecord.objects.create(media_type=media_type, model="m", file=name)
+        if age:
+            MediaRecord.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(seconds=age))
+        return record
+
+    @override_settings(STORAGE_RETENTION={"audio": 3600})
+    def test_retention_per_media_type(self):
+        old_audio = self._record("audio", b"old", age=7200)
+        new_audio = self._record("audio", b"new")
+        old_image = self._record("image", b"img", age=7200)
+        self.assertEqual(lifecycle.apply_retention(dry_run=True), {"audio": 1})
+        self.assertTrue(MediaRecord.objects.filter(pk=old_audio.pk).exists())
+        with mock.patch.object(blobs, "delete_files_later", _delete_files_now), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(lifecycle.apply_retention(), {"audio": 1})
+        remaining = set(MediaRecord.objects.values_list("pk", flat=True))
+        self.assertEqual(remaining, {new_audio.pk, old_image.pk})
+        self.assertFalse(default_storage.exists(old_audio.file.name))
+
+    @override_settings(STORAGE_QUOTAS={"image": 15})
+    def test_quota_evicts_least_recently_used_files(self):
+        now = timezone.now()
+        coldest = self._record("image", b"a" * 10)
+        self._record("image", b"a" * 10)  # same file, evicted together
+        warm = self._record("image", b"b" * 10)
+        hot = self._record("image", b"c" * 10)
+        for record, hours in ((coldest, 3), (warm, 2), (hot, 1)):
+            MediaBlob.objects.filter(name=record.file.name).update(last_used_at=now - timedelta(hours=hours))
+        GenerationCacheEntry.objects.create(key="k", media_type="image", service_model="sd",
+                                            file_name=coldest.file.name, size=10)
+        self.assertEqual(lifecycle.usage()["image"], 30)
+        self.assertEqual(lifecycle.apply_quotas(), {"image": 3})
+        self.assertEqual(list(MediaRecord.objects.values_list("pk", flat=True)), [hot.pk])
+        self.assertFalse(GenerationCacheEntry.objects.exists())
+
+    def test_touch_writes_at_most_hourly(self):
+        record = self._record("image", b"x")
+        lifecycle.touch(record.file.name)
+        self.assertIsNotNone(MediaBlob.objects.get(name=record.file.name).last_used_at)
+        MediaBlob.objects.update(last_used_at=None)
+        lifecycle.touch(record.file.name)
+        self.assertIsNone(MediaBlob.objects.get(name=record.file.name).last_used_at)
+
+
+@override_settings(JOB_EVENTS_POLL_INTERVAL=0.01)
+class JobEventsTests(TestCase):
+    def _job(self, status=GenerationJob.STATUS_RUNNING):
+        return GenerationJob.objects.create(media_type="image", params={"prompt": "猫"}, status=status)
+
+    def _event(self, message: bytes):
+        event, data = message.decode().strip().split("\n")
+        return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    def test_progress_then_done(self):
+        job = self._job()
+        stream = views._iter_job_events(job.pk, max_duration=5)
+        self.assertEqual(next(stream), b"retry: 10\n\n")
+        event, data = self._event(next(stream))
+        self.assertEqual((event, data["job"]["status"]), ("progress", GenerationJob.STATUS_RUNNING))
+        GenerationJob.objects.filter(pk=job.pk).update(progress={"step": 3, "total_steps": 10})
+        event, data = self._event(next(stream))
+        self.assertEqual(data["job"]["progress"]["step"], 3)
+        GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.STATUS_SUCCEEDED)
+        event, data = self._event(next(stream))
+        self.assertEqual((event, data["job"]["status"]), ("done", GenerationJob.STATUS_SUCCEEDED))
+        self.assertEqual(list(stream), [])
+
+    def test_unchanged_job_sends_nothing_until_the_stream_ends(self):
+        job = self._job(GenerationJob.STATUS_QUEUED)
+        messages = list(views._iter_job_events(job.pk, max_duration=0.05))
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(self._event(messages[1])[0], "progress")
+
+    def test_endpoint(self):
+        self.client.force_login(get_user_model().objects.create_user("listener"))
+        self.assertEqual(self.client.get("/api/jobs/0/events/").status_code, 404)
+        job = self._job(GenerationJob.STATUS_FAILED)
+        response = self.client.get(f"/api/jobs/{job.pk}/events/")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertIn(b"event: done", _streamed(response))
@@ -0,0 +1,205 @@
+"""
+Long-form text to speech.
+
+FishSpeech synthesizes a whole prompt in one call, so a long script produces
+no audio until all of it is done and easily runs into the model's deadline.
+Long texts are therefore split at sentence boundaries (Chinese and Western
+punctuation), the segments are synthesized concurrently — each call goes
+through the backend router, so they spread over every configured xinference
+— and the finished segments are joined into one file of the model's own
+format. Segments become available in text order as soon as they and the
+ones before them are done, which lets callers play the start early.
+"""
+import logging
+import re
+import shutil
+import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# a sentence ends at CJK or Western terminal punctuation (with any closing
+# quotes or brackets that follow), at a Western full stop followed by
+# whitespace, or at a line break
+_SENTENCE = re.compile(
+    r".+?(?:[。！？!?；;…]+[”’」』）)\]\"']*|\.(?=\s)|\n+|$)", re.S
+)
+# long sentences are cut again at clause punctuation
+_CLAUSE = re.compile(r".+?(?:[，、,：:]+|$)", re.S)
+
+_MPEG_BITRATES = {
+    # (MPEG-1, MPEG-2/2.5) layer III bitrates in kbit/s by header index
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def is_long_form(params: dict) -> bool:
+    return bool(params.get("long_form"))
+
+
+def wants_long_form(text: str, requested=None) -> bool:
+    """
+    Whether ``text`` should be synthesized in segments: as ``requested`` when
+    given, otherwise once it is longer than ``TTS_LONG_FORM_MIN_CHARS``.
+    """
+    if requested is None or requested == "":
+        return len(text) > settings.TTS_LONG_FORM_MIN_CHARS
+    if isinstance(requested, str):
+        return requested.strip().lower() not in {"0", "false", "no", "off"}
+    return bool(requested)
+
+
+def _pieces(text: str, max_chars: int):
+    for sentence in _SENTENCE.findall(text):
+        if len(sentence.strip()) <= max_chars:
+            yield sentence
+            continue
+        for clause in _CLAUSE.findall(sentence):
+            for start in range(0, len(clause), max_chars):
+                yield clause[start:start + max_chars]
+
+
+def split_text(text: str, max_chars: int | None = None) -> list:
+    """
+    Split ``text`` into segments of at most ``max_chars`` characters, cutting
+    at sentence ends where possible and at clause punctuation otherwise.
+    Consecutive short sentences are merged so each call does useful work.
+    """
+    max_chars = max_chars or settings.TTS_SEGMENT_MAX_CHARS
+    segments, current = [], ""
+    for piece in _pieces(text, max_chars):
+        if current.strip() and len(current.strip()) + len(piece.strip()) > max_chars:
+            segments.append(current.strip())
+            current = ""
+        current += piece
+    if current.strip():
+        segments.append(current.strip())
+    return segments
+
+
+def synthesize(texts: list, synthesize_one, directory: Path, concurrency: int | None = None):
+    """
+    Run ``synthesize_one(text, dest_stem)`` for every segment on a thread
+    pool and yield ``(index, path)`` in text order, each as soon as it and
+    all segments before it are finished. The first failure is raised once
+    its turn comes; segments not started yet are then dropped.
+    """
+    concurrency = max(1, min(concurrency or settings.TTS_SEGMENT_CONCURRENCY, len(texts)))
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="tts")
+    futures = [
+        executor.submit(synthesize_one, text, directory / f"segment_{index:04d}")
+        for index, text in enumerate(texts)
+    ]
+    try:
+        for index, future in enumerate(futures):
+            yield index, future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _mpeg_frame_length(header: bytes):
+    """Length of the MPEG audio layer III frame starting with ``header``, or None."""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MPEG_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x01
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def _mp3_frames(data: bytes) -> bytes:
+    """
+    The audio frames of an MP3 file: ID3 tags are dropped, and so is a
+    leading Xing/Info/VBRI frame, whose frame count would make players
+    report only the first segment's duration for the joined file.
+    """
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = _syncsafe(data[6:10]) + 10
+        if data[5] & 0x10:
+            size += 10
+        data = data[size:]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    length = _mpeg_frame_length(data[:4])
+    if length and any(tag in data[:length] for tag in (b"Xing", b"Info", b"VBRI")):
+        data = data[length:]
+    return data
+
+
+def _join_mp3(paths: list, dest: Path) -> None:
+    with dest.open("wb") as out:
+        for path in paths:
+            out.write(_mp3_frames(path.read_bytes()))
+
+
+def _join_wav(paths: list, dest: Path) -> bool:
+    """Concatenate PCM WAV files; False when their formats differ."""
+    with wave.open(str(paths[0]), "rb") as first:
+        params = first.getparams()
+    with wave.open(str(dest), "wb") as out:
+        out.setnchannels(params.nchannels)
+        out.setsampwidth(params.sampwidth)
+        out.setframerate(params.framerate)
+        for path in paths:
+            with wave.open(str(path), "rb") as src:
+                if src.getparams()[:3] != params[:3]:
+                    return False
+                out.writeframes(src.readframes(src.getnframes()))
+    return True
+
+
+def _join_ffmpeg(ffmpeg: str, paths: list, dest: Path) -> None:
+    listing = dest.with_name(f"{dest.stem}.txt")
+    listing.write_text(
+        "".join(f"file '{path.resolve().as_posix()}'\n" for path in paths), encoding="utf-8"
+    )
+    subprocess.run(
+        [ffmpeg, "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", str(listing),
+         "-vn", str(dest)],
+        capture_output=True,
+        timeout=600,
+        check=True,
+    )
+
+
+def stitch(paths: list, dest: Path) -> Path:
+    """
+    Join the segment files ``paths`` into ``dest`` (whose suffix picks the
+    format) and return the joined file. WAV is joined sample by sample and
+    MP3 frame by frame, so neither is re-encoded; anything else, or segments
+    in mixed formats, goes through ffmpeg.
+    """
+    if len(paths) == 1:
+        return paths[0]
+    suffixes = {path.suffix.lower() for path in paths} | {dest.suffix.lower()}
+    try:
+        if suffixes == {".wav"} and _join_wav(paths, dest):
+            return dest
+    except (wave.Error, EOFError):
+        logger.warning("could not join WAV segments directly", exc_info=True)
+    if suffixes == {".mp3"}:
+        _join_mp3(paths, dest)
+        return dest
+    ffmpeg = shutil.which(settings.FFMPEG_BINARY)
+    if not ffmpeg:
+        raise RuntimeError(f"无法拼接 {', '.join(sorted(suffixes))} 音频分段：未找到 ffmpeg")
+    _join_ffmpeg(ffmpeg, paths, dest)
+    return dest
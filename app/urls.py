@@ -1,16 +1,32 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.USE_ASYNC_VIEWS:
+    from . import async_views as io_views
+else:
+    io_views = views
+
 urlpatterns = [
     path("", views.index, name="index"),
     path("logout/", views.logout_view, name="logout"),
-    path("api/records/", views.list_records, name="list_records"),
+    path("api/records/", io_views.list_records, name="list_records"),
     path("api/records/create/", views.create_record, name="create_record"),
     path("api/records/<int:pk>/delete/", views.delete_record, name="delete_record"),
-    path("api/records/<int:pk>/download/", views.download_record, name="download_record"),
-    path("api/records/download/", views.download_records_zip, name="download_records_zip"),
-    path("api/image/", views.generate_image, name="generate_image"),
-    path("api/audio/", views.generate_audio, name="generate_audio"),
-    path("api/video/", views.generate_video, name="generate_video"),
+    path("api/records/delete/", views.delete_records, name="delete_records"),
+    path("api/records/<int:pk>/download/", io_views.download_record, name="download_record"),
+    path("api/records/<int:pk>/stream/", io_views.stream_record, name="stream_record"),
+    path("api/records/download/", io_views.download_records_zip, name="download_records_zip"),
+    path("api/image/", io_views.generate_image, name="generate_image"),
+    path("api/audio/", io_views.generate_audio, name="generate_audio"),
+    path("api/video/", io_views.generate_video, name="generate_video"),
+    path("api/jobs/", views.submit_job, name="submit_job"),
+    path("api/jobs/<int:pk>/", views.job_status, name="job_status"),
+    path("api/jobs/<int:pk>/cancel/", views.cancel_job, name="cancel_job"),
+    path("api/jobs/<int:pk>/events/", io_views.job_events, name="job_events"),
+    path("api/batches/", io_views.submit_batch, name="submit_batch"),
+    path("api/batches/<int:pk>/", views.batch_status, name="batch_status"),
+    path("api/batches/<int:pk>/resume/", io_views.resume_batch, name="resume_batch"),
+    path("metrics", views.metrics_endpoint, name="metrics"),
 ]
@@ -1,24 +1,37 @@
+import base64
 import json
 import logging
-import os
+import mimetypes
+import time
 from pathlib import Path
-from uuid import uuid4
 
-import requests
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.http import HttpResponseBadRequest, JsonResponse
-from django.http.response import FileResponse, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseNotFound, HttpResponseNotModified
 from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.http import content_disposition_header, parse_etags
 from django.views.decorators.http import require_GET, require_POST
-from gradio_client import Client
 
-from .models import MediaRecord
+from . import admission, bulk, derivatives, library, lifecycle, listing_cache, metrics, search, tts
+from .archive import iter_zip, unique_arcnames
+from .generation import GenerationError, InvalidParams, generate, iter_long_form, parse_params
+from .jobs import cancel, enqueue, queue_position, workers_available
+from .media_response import serve_file
+from .models import GenerationBatch, GenerationBatchItem, GenerationJob, MediaRecord
+from .pagination import (
+    InvalidCursor,
+    count_total,
+    decode_offset_cursor,
+    encode_offset_cursor,
+    keyset_page,
+)
 
 logger = logging.getLogger(__name__)
-BASE_DIR = Path(__file__).resolve().parent.parent
 
 
 def index(request):
@@ -45,80 +58,8 @@ def logout_view(request):
     return redirect("index")
 
 
-def _load_env_file(path: Path) -> dict:
-    env = {}
-    if not path.exists():
-        return env
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" not in line:
-            continue
-        key, value = line.split("=", 1)
-        env[key.strip()] = value.strip()
-    return env
-
-
-def _load_xinference_base_url() -> str:
-    # priority: env var > env.local > .env > default
-    env_val = os.environ.get("XINFERENCE_BASE_URL")
-    if env_val:
-        return env_val.rstrip("/")
-
-    for fname in ("env.local", ".env"):
-        env_map = _load_env_file(BASE_DIR / fname)
-        if "XINFERENCE_BASE_URL" in env_map:
-            return env_map["XINFERENCE_BASE_URL"].rstrip("/")
-
-    return "http://127.0.0.1:9997"
-
-
-XINFERENCE_BASE_URL = _load_xinference_base_url()
-
-
-def _read_result_bytes(result) -> bytes:
-    """
-    Attempt to load binary bytes from a gradio_client result which may be:
-    - a local file path (str)
-    - a URL (str)
-    - a list containing the above or dicts with name/path/url
-    - a dict with name/path/url
-    """
-    if isinstance(result, (bytes, bytearray)):
-        return bytes(result)
-
-    path = None
-    candidate = result
-    if isinstance(candidate, (list, tuple)) and candidate:
-        candidate = candidate[0]
-    if isinstance(candidate, dict):
-        path = (
-            candidate.get("name")
-            or candidate.get("path")
-            or candidate.get("url")
-            or candidate.get("video")
-            or candidate.get("file")
-            or candidate.get("filepath")
-            or candidate.get("image")
-        )
-    elif isinstance(candidate, str):
-        path = candidate
-
-    if not path:
-        raise ValueError(f"未找到结果文件路径，返回内容: {result!r}")
-
-    if isinstance(path, str) and path.startswith("http"):
-        resp = requests.get(path, timeout=60)
-        resp.raise_for_status()
-        return resp.content
-
-    with open(path, "rb") as f:
-        return f.read()
-
-
 def _serialize_record(record: MediaRecord) -> dict:
-    return {
+    data = {
         "id": record.id,
         "media_type": record.media_type,
         "model": record.model,
@@ -126,22 +67,157 @@ def _serialize_record(record: MediaRecord) -> dict:
         "style": record.style,
         "voice": record.voice,
         "url": record.url or "",
+        "stream_url": reverse("stream_record", args=[record.id]) if record.file else record.url or "",
+        "duration": record.duration,
+        "width": record.width,
+        "height": record.height,
         "created_at": record.created_at.isoformat(),
     }
+    data.update(derivatives.urls_for(
+        record.file.name if record.file else "",
+        record.media_type,
+        record.derivative_state == MediaRecord.DERIVATIVES_READY,
+    ))
+    return data
 
 
-@login_required
-@require_GET
-def list_records(request):
+def _serialize_job(job: GenerationJob) -> dict:
+    return {
+        "id": job.id,
+        "media_type": job.media_type,
+        "status": job.status,
+        "error": job.error,
+        "detail": job.detail,
+        "record_id": job.record_id,
+        "record": _serialize_record(job.record) if job.record_id else None,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "progress": job.progress,
+        "cancel_requested": job.cancel_requested,
+        "queue_position": queue_position(job),
+    }
+
+
+def _serialize_batch_item(item: GenerationBatchItem) -> dict:
+    return {
+        "index": item.index,
+        "media_type": item.media_type,
+        "status": item.status,
+        "prompt": item.params.get("prompt", ""),
+        "error": item.error,
+        "detail": item.detail,
+        "record": _serialize_record(item.record) if item.record_id else None,
+    }
+
+
+def _serialize_batch(batch: GenerationBatch) -> dict:
+    return {
+        "id": batch.id,
+        "source_name": batch.source_name,
+        "created_at": batch.created_at.isoformat(),
+        "finished_at": batch.finished_at.isoformat() if batch.finished_at else None,
+        **bulk.summary(batch),
+    }
+
+
+def _job_snapshot(pk: int):
+    """The serialized job, or None when it does not exist."""
+    job = GenerationJob.objects.select_related("record").filter(pk=pk).first()
+    return _serialize_job(job) if job else None
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+def _job_event(snapshot: dict, last: dict | None):
+    """The SSE message for ``snapshot``, or None when nothing changed since ``last``."""
+    if snapshot["status"] in GenerationJob.FINISHED_STATUSES:
+        return _sse("done", {"job": snapshot})
+    if last is not None and all(
+        snapshot[key] == last[key] for key in ("status", "progress", "queue_position")
+    ):
+        return None
+    return _sse("progress", {"job": snapshot})
+
+
+def _job_events_response(stream) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # keep nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _iter_job_events(pk: int, max_duration: float):
+    poll_interval = settings.JOB_EVENTS_POLL_INTERVAL
+    retry_ms = int(poll_interval * 1000)
+    yield f"retry: {retry_ms}\n\n".encode()
+    deadline = time.monotonic() + max_duration
+    heartbeat_at = time.monotonic() + settings.JOB_EVENTS_HEARTBEAT
+    last = None
+    while True:
+        snapshot = _job_snapshot(pk)
+        if snapshot is None:
+            yield _sse("done", {"error": "job not found"})
+            return
+        message = _job_event(snapshot, last)
+        last = snapshot
+        if message:
+            yield message
+            if snapshot["status"] in GenerationJob.FINISHED_STATUSES:
+                return
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now >= heartbeat_at:
+            heartbeat_at = now + settings.JOB_EVENTS_HEARTBEAT
+            yield b": keep-alive\n\n"
+        time.sleep(poll_interval)
+
+
+def _list_records_response(request):
     media_type = request.GET.get("media_type")
     page = max(int(request.GET.get("page", 1)), 1)
     page_size = max(min(int(request.GET.get("page_size", 10)), 50), 1)
+    cursor = request.GET.get("cursor")
 
     qs = MediaRecord.objects.all()
-    if media_type in {"image", "audio", "video"}:
+    filtered = media_type in {"image", "audio", "video"}
+    if filtered:
         qs = qs.filter(media_type=media_type)
 
-    total = qs.count()
+    if cursor is None:
+        total_mode = request.GET.get("total", "exact")
+    else:
+        total_mode = request.GET.get("total", "none")
+    if total_mode not in {"exact", "approx", "none"}:
+        return HttpResponseBadRequest("Invalid total mode")
+
+    query = (request.GET.get("q") or "").strip()
+    if query:
+        return _search_records_response(
+            query, media_type if filtered else None, page, page_size, cursor, total_mode
+        )
+
+    total, estimated = count_total(qs, total_mode, filtered)
+
+    if cursor is not None:
+        try:
+            records, next_cursor = keyset_page(qs, cursor, page_size)
+        except InvalidCursor as exc:
+            return HttpResponseBadRequest(str(exc))
+        return JsonResponse(
+            {
+                "records": [_serialize_record(r) for r in records],
+                "page_size": page_size,
+                "next_cursor": next_cursor,
+                "total": total,
+                "total_estimated": estimated,
+            }
+        )
+
     start = (page - 1) * page_size
     end = start + page_size
     records = qs[start:end]
@@ -151,10 +227,77 @@ def list_records(request):
             "page": page,
             "page_size": page_size,
             "total": total,
+            "total_estimated": estimated,
         }
     )
 
 
+def _cached_list_records_response(request):
+    """
+    ``_list_records_response`` tagged with the listing version, answering a
+    matching ``If-None-Match`` with 304 and serving the body from
+    ``listing_cache`` while the library is unchanged.
+    """
+    key = listing_cache.make_key(request.user.pk, request.META.get("QUERY_STRING", ""))
+    tag = listing_cache.etag(key)
+    if tag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        body = listing_cache.get(key) if listing_cache.is_enabled() else None
+        if body is None:
+            response = _list_records_response(request)
+            if response.status_code != 200:
+                return response
+            if listing_cache.is_enabled():
+                listing_cache.store(key, response.content)
+        else:
+            response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = tag
+    # let the browser keep the body but revalidate it on every poll
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _search_records_response(query, media_type, page, page_size, cursor, total_mode):
+    """
+    Ranked full-text matches for ``q``. Relevance order has no stable key to
+    seek on, so search cursors carry an offset into the ranked results.
+    """
+    if cursor is not None:
+        try:
+            offset = decode_offset_cursor(cursor)
+        except InvalidCursor as exc:
+            return HttpResponseBadRequest(str(exc))
+    else:
+        offset = (page - 1) * page_size
+
+    ids = search.ranked_ids(query, media_type, offset, page_size + 1)
+    has_more = len(ids) > page_size
+    ids = ids[:page_size]
+    by_id = MediaRecord.objects.in_bulk(ids)
+    records = [by_id[pk] for pk in ids if pk in by_id]
+    total, estimated = search.count_total(query, media_type, total_mode)
+
+    data = {
+        "records": [_serialize_record(r) for r in records],
+        "page_size": page_size,
+        "q": query,
+        "total": total,
+        "total_estimated": estimated,
+    }
+    if cursor is not None:
+        data["next_cursor"] = encode_offset_cursor(offset + page_size) if has_more else None
+    else:
+        data["page"] = page
+    return JsonResponse(data)
+
+
+@login_required
+@require_GET
+def list_records(request):
+    return _cached_list_records_response(request)
+
+
 @login_required
 @require_POST
 def create_record(request):
@@ -162,25 +305,20 @@ def create_record(request):
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid JSON body")
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest("Invalid JSON body")
 
-    media_type = payload.get("media_type")
-    if media_type not in {"image", "audio", "video"}:
-        return HttpResponseBadRequest("Invalid media_type")
-
-    model_name = payload.get("model", "").strip() or "unknown"
-    prompt = payload.get("prompt", "")
-    style = payload.get("style", "")
-    voice = payload.get("voice", "")
-    result_url = payload.get("url") or payload.get("result_url") or ""
-
-    record = MediaRecord.objects.create(
-        media_type=media_type,
-        model=model_name,
-        prompt=prompt,
-        style=style,
-        voice=voice,
-        result_url=result_url,
-    )
+    try:
+        if "records" in payload:
+            created = library.create_records(payload["records"])
+            return JsonResponse(
+                {"records": [_serialize_record(r) for r in created], "created": len(created)},
+                status=201,
+            )
+        record = library.record_from_payload(payload)
+    except InvalidParams as exc:
+        return HttpResponseBadRequest(str(exc))
+    record.save()
     return JsonResponse({"record": _serialize_record(record)}, status=201)
 
 
@@ -192,211 +330,313 @@ def delete_record(request, pk: int):
     except MediaRecord.DoesNotExist:
         return HttpResponseNotFound("record not found")
 
-    if record.file and default_storage.exists(record.file.name):
-        default_storage.delete(record.file.name)
-
+    # the stored file is released (and removed once unreferenced) by app.signals
     record.delete()
     return JsonResponse({"ok": True})
 
 
 @login_required
 @require_POST
-def generate_audio(request):
+def delete_records(request):
+    """Delete the records given by ``ids`` and/or a media_type/date filter at once."""
     try:
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid JSON body")
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest("Invalid JSON body")
 
-    prompt = payload.get("prompt", "").strip()
-    model_name = payload.get("model", "").strip() or "广科院"
-    voice = payload.get("voice", "").strip()
-
-    if not prompt:
-        return HttpResponseBadRequest("prompt is required")
-
-    if model_name in {"广科院", "FishSpeech-1.5"}:
-        try:
-            client = Client(f"{XINFERENCE_BASE_URL}/FishSpeech-1.5/")
-            result = client.predict(
-                input_text=prompt,
-                voice=voice or "",
-                speed=1,
-                prompt_speech_file=None,
-                prompt_text=prompt,
-                api_name="/tts_generate",
-            )
-            audio_bytes = _read_result_bytes(result)
-        except Exception as exc:  # pylint: disable=broad-except
-            logger.exception("audio generation request failed")
-            return JsonResponse(
-                {"error": "请求生成服务失败", "detail": str(exc)}, status=502
-            )
-    else:
-        return JsonResponse({"error": "暂未实现该模型的音频生成"}, status=400)
-
-    suffix = ".mp3"
-    if isinstance(result, str):
-        suffix = Path(result).suffix or suffix
-    filename = f"audio_{uuid4().hex}{suffix}"
-    saved_path = default_storage.save(f"audio/{filename}", ContentFile(audio_bytes))
-    record = MediaRecord.objects.create(
-        media_type="audio",
-        model=model_name,
-        prompt=prompt,
-        voice=voice,
-        file=saved_path,
-        result_url=default_storage.url(saved_path),
-    )
-
-    return JsonResponse({"record": _serialize_record(record)}, status=201)
+    try:
+        qs, ids = library.select(payload)
+    except InvalidParams as exc:
+        return HttpResponseBadRequest(str(exc))
+    return JsonResponse(library.delete_records(qs, ids))
 
 
-@login_required
-@require_POST
-def generate_image(request):
+def _generate_response(request, media_type: str):
     try:
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid JSON body")
 
-    prompt = payload.get("prompt", "").strip()
-    model_name = payload.get("model", "").strip() or "广科院"
-    style = payload.get("style", "")
+    try:
+        params = parse_params(media_type, payload)
+        if payload.get("stream") and tts.is_long_form(params):
+            lease = admission.acquire(request.user, media_type)
+            return _long_form_stream_response(media_type, params, lease)
+        with admission.admit(request.user, media_type):
+            record = generate(media_type, params)
+    except InvalidParams as exc:
+        return HttpResponseBadRequest(str(exc))
+    except GenerationError as exc:
+        return _generation_error_response(exc)
+
+    return JsonResponse({"record": _serialize_record(record)}, status=201)
+
 
-    if not prompt:
-        return HttpResponseBadRequest("prompt is required")
+def _generation_error_response(exc: GenerationError) -> JsonResponse:
+    response = JsonResponse(exc.as_dict(), status=exc.status)
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after:
+        response["Retry-After"] = str(retry_after)
+    return response
 
-    if model_name != "广科院":
-        return JsonResponse({"error": "暂未实现该模型的图像生成"}, status=400)
 
-    service_model = "sd3.5-medium"
+def _iter_long_form_results(media_type: str, params: dict, lease=None):
+    """
+    NDJSON lines: each synthesized segment in text order with its audio
+    inlined as base64, so playback can start before the rest is done, then
+    the record of the joined file or the error that stopped it. The
+    admission ``lease`` is released once the stream ends.
+    """
     try:
-        client = Client(f"{XINFERENCE_BASE_URL}/{service_model}/")
-        result = client.predict(
-            prompt=prompt,
-            n=1,
-            size_width=1024,
-            size_height=1024,
-            guidance_scale=-1,
-            num_inference_steps=-1,
-            negative_prompt=None,
-            sampler_name="default",
-            api_name="/text_generate_image",
-        )
-        image_bytes = _read_result_bytes(result)
-    except Exception as exc:  # pylint: disable=broad-except
-        logger.exception("image generation request failed")
-        return JsonResponse({"error": "图像生成失败", "detail": str(exc)}, status=502)
-
-    suffix = ".png"
-    if isinstance(result, str):
-        suffix = Path(result).suffix or suffix
-    elif isinstance(result, (list, tuple)) and result:
-        path = None
-        first = result[0]
-        if isinstance(first, dict):
-            path = first.get("image") or first.get("path") or first.get("name")
-        elif isinstance(first, str):
-            path = first
-        if path:
-            suffix = Path(path).suffix or suffix
-    filename = f"image_{uuid4().hex}{suffix}"
-    saved_path = default_storage.save(f"image/{filename}", ContentFile(image_bytes))
-    record = MediaRecord.objects.create(
-        media_type="image",
-        model=model_name,
-        prompt=prompt,
-        style=style,
-        file=saved_path,
-        result_url=default_storage.url(saved_path),
+        for item in iter_long_form(media_type, params):
+            if isinstance(item, MediaRecord):
+                line = {"record": _serialize_record(item)}
+            else:
+                index, total, path = item
+                line = {"segment": {
+                    "index": index,
+                    "total": total,
+                    "content_type": mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+                    "data": base64.b64encode(path.read_bytes()).decode("ascii"),
+                }}
+            yield json.dumps(line, ensure_ascii=False).encode() + b"\n"
+    except GenerationError as exc:
+        yield json.dumps(exc.as_dict(), ensure_ascii=False).encode() + b"\n"
+    finally:
+        admission.release(lease)
+
+
+class _LeasedStreamingResponse(StreamingHttpResponse):
+    """
+    Releases an admission lease when the server closes the response, which
+    also covers streams closed before their generator ever started.
+    """
+
+    def __init__(self, *args, lease=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lease = lease
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            admission.release(self.lease)
+
+
+def _long_form_stream_response(media_type: str, params: dict, lease=None, wrap=None):
+    stream = _iter_long_form_results(media_type, params, lease)
+    response = _LeasedStreamingResponse(
+        wrap(stream) if wrap else stream, content_type="application/x-ndjson", status=201,
+        lease=lease,
     )
+    response["X-Accel-Buffering"] = "no"
+    return response
 
-    return JsonResponse({"record": _serialize_record(record)}, status=201)
+
+@login_required
+@require_POST
+def generate_audio(request):
+    return _generate_response(request, "audio")
+
+
+@login_required
+@require_POST
+def generate_image(request):
+    return _generate_response(request, "image")
 
 
 @login_required
 @require_POST
 def generate_video(request):
+    return _generate_response(request, "video")
+
+
+@login_required
+@require_POST
+def submit_job(request):
     try:
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid JSON body")
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest("Invalid JSON body")
 
-    prompt = payload.get("prompt", "").strip()
-    model_name = payload.get("model", "").strip() or "广科院"
-    negative_prompt = payload.get("negative_prompt", "") or ""
-    num_frames = int(payload.get("num_frames", 16) or 16)
-    fps = int(payload.get("fps", 8) or 8)
-    num_inference_steps = int(payload.get("num_inference_steps", 25) or 25)
-    guidance_scale = float(payload.get("guidance_scale", 7.5) or 7.5)
-    width = int(payload.get("width", 512) or 512)
-    height = int(payload.get("height", 512) or 512)
+    media_type = payload.get("media_type")
+    try:
+        params = parse_params(media_type, payload)
+    except InvalidParams as exc:
+        return HttpResponseBadRequest(str(exc))
+    if not workers_available(media_type):
+        # the job would stay queued forever; clients fall back to /api/<media_type>/
+        return JsonResponse(
+            {"error": "没有运行中的生成任务进程", "code": "no_workers"}, status=503
+        )
+    try:
+        admission.admit_job(request.user, media_type)
+    except GenerationError as exc:
+        return _generation_error_response(exc)
 
-    if not prompt:
-        return HttpResponseBadRequest("prompt is required")
+    job = enqueue(media_type, params, user=request.user)
+    return JsonResponse({"job": _serialize_job(job)}, status=202)
 
-    if model_name != "广科院":
-        return JsonResponse({"error": "暂未实现该模型的视频生成"}, status=400)
 
-    service_model = "Wan2.1-1.3B"
+@login_required
+@require_GET
+def job_status(request, pk: int):
     try:
-        client = Client(f"{XINFERENCE_BASE_URL}/{service_model}/")
-        result = client.predict(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_frames=num_frames,
-            fps=fps,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            width=width,
-            height=height,
-            api_name="/text_generate_video",
-        )
-        video_bytes = _read_result_bytes(result)
-    except Exception as exc:  # pylint: disable=broad-except
-        logger.exception("video generation request failed")
-        message = str(exc)
-        if "ftfy" in message.lower():
-            message = "xinference 模型环境缺少 ftfy，请在运行 xinference 的环境执行 `pip install ftfy` 并重启服务。"
-        return JsonResponse({"error": "视频生成失败", "detail": message}, status=502)
-
-    suffix = ".mp4"
-    if isinstance(result, str):
-        suffix = Path(result).suffix or suffix
-    filename = f"video_{uuid4().hex}{suffix}"
-    saved_path = default_storage.save(f"video/{filename}", ContentFile(video_bytes))
-    record = MediaRecord.objects.create(
-        media_type="video",
-        model=model_name,
-        prompt=prompt,
-        file=saved_path,
-        result_url=default_storage.url(saved_path),
+        job = GenerationJob.objects.select_related("record").get(pk=pk)
+    except GenerationJob.DoesNotExist:
+        return HttpResponseNotFound("job not found")
+    return JsonResponse({"job": _serialize_job(job)})
+
+
+@login_required
+@require_POST
+def cancel_job(request, pk: int):
+    """Cancel a queued or running job; finished jobs are returned unchanged."""
+    job = cancel(pk)
+    if job is None:
+        return HttpResponseNotFound("job not found")
+    return JsonResponse({"job": _serialize_job(job)}, status=202 if not job.is_finished else 200)
+
+
+@login_required
+@require_GET
+def job_events(request, pk: int):
+    """
+    Server-Sent Events stream of a job: a ``progress`` event whenever its
+    status, queue position or step progress changes and a final ``done``
+    event. The stream closes after ``JOB_EVENTS_MAX_DURATION`` so a blocked
+    WSGI thread is released; EventSource reconnects on its own.
+    """
+    if not GenerationJob.objects.filter(pk=pk).exists():
+        return HttpResponseNotFound("job not found")
+    return _job_events_response(_iter_job_events(pk, settings.JOB_EVENTS_MAX_DURATION))
+
+
+def _batch_from_request(request) -> GenerationBatch:
+    """Create a batch from an uploaded ``file`` or a raw CSV/JSONL body."""
+    upload = request.FILES.get("file")
+    if upload is not None:
+        data, name = upload.read(), upload.name
+        fmt = request.POST.get("format") or bulk.detect_format(name, upload.content_type or "")
+        media_type = request.POST.get("media_type")
+    else:
+        data, name = request.body, ""
+        fmt = request.GET.get("format") or bulk.detect_format("", request.content_type or "")
+        media_type = request.GET.get("media_type")
+    rows = bulk.read_rows(data, fmt)
+    return bulk.create_batch(rows, media_type=media_type, user=request.user, source_name=name)
+
+
+def _iter_batch_results(batch: GenerationBatch, concurrency: int):
+    """NDJSON lines: the batch, each item as it finishes, then the totals."""
+    yield json.dumps({"batch": _serialize_batch(batch)}, ensure_ascii=False).encode() + b"\n"
+    # items that failed validation are reported before any generation starts
+    for item in batch.items.filter(status=GenerationBatchItem.STATUS_FAILED):
+        yield json.dumps({"item": _serialize_batch_item(item)}, ensure_ascii=False).encode() + b"\n"
+    for item in bulk.run_batch(batch, concurrency):
+        yield json.dumps({"item": _serialize_batch_item(item)}, ensure_ascii=False).encode() + b"\n"
+    batch.refresh_from_db()
+    yield json.dumps({"batch": _serialize_batch(batch)}, ensure_ascii=False).encode() + b"\n"
+
+
+def _batch_stream_response(batch: GenerationBatch, concurrency: int, wrap=None):
+    stream = _iter_batch_results(batch, concurrency)
+    response = StreamingHttpResponse(
+        wrap(stream) if wrap else stream, content_type="application/x-ndjson", status=201
     )
+    response["X-Accel-Buffering"] = "no"
+    return response
 
-    return JsonResponse({"record": _serialize_record(record)}, status=201)
+
+def _prepare_batch(request, pk=None):
+    """``(batch, concurrency)`` for a new or resumed batch, or an error response."""
+    try:
+        concurrency = bulk.get_concurrency(request.GET.get("concurrency"))
+        if pk is None:
+            return _batch_from_request(request), concurrency
+    except bulk.InvalidBatch as exc:
+        return HttpResponseBadRequest(str(exc)), None
+    batch = GenerationBatch.objects.filter(pk=pk).first()
+    if batch is None:
+        return HttpResponseNotFound("batch not found"), None
+    return batch, concurrency
+
+
+@login_required
+@require_POST
+def submit_batch(request):
+    """
+    Generate every row of a CSV/JSONL upload and stream one NDJSON line per
+    finished item. A dropped connection leaves the remaining items pending
+    for ``resume_batch`` or ``manage.py generate_batch --resume``.
+    """
+    batch, concurrency = _prepare_batch(request)
+    if concurrency is None:
+        return batch
+    return _batch_stream_response(batch, concurrency)
+
+
+@login_required
+@require_POST
+def resume_batch(request, pk: int):
+    batch, concurrency = _prepare_batch(request, pk)
+    if concurrency is None:
+        return batch
+    return _batch_stream_response(batch, concurrency)
 
 
 @login_required
 @require_GET
-def download_record(request, pk: int):
+def batch_status(request, pk: int):
+    batch = GenerationBatch.objects.filter(pk=pk).first()
+    if batch is None:
+        return HttpResponseNotFound("batch not found")
+    items = batch.items.select_related("record")
+    return JsonResponse({
+        "batch": _serialize_batch(batch),
+        "items": [_serialize_batch_item(item) for item in items],
+    })
+
+
+def _record_file_response(request, pk: int, as_attachment: bool, wrap=None):
     try:
         record = MediaRecord.objects.get(pk=pk)
     except MediaRecord.DoesNotExist:
         return HttpResponseNotFound("record not found")
 
-    if record.file:
-        file_path = Path(record.file.path)
-        if file_path.exists():
-            return FileResponse(
-                file_path.open("rb"),
-                as_attachment=True,
-                filename=file_path.name,
-            )
+    if record.file and default_storage.exists(record.file.name):
+        lifecycle.touch(record.file.name)
+        suffix = Path(record.file.name).suffix
+        return serve_file(
+            request,
+            record.file.name,
+            as_attachment=as_attachment,
+            filename=f"{record.media_type}_{record.id}{suffix}",
+            media_type=record.media_type,
+            wrap=wrap,
+        )
     if record.result_url:
         return redirect(record.result_url)
     return HttpResponseNotFound("file not found")
 
 
+@login_required
+@require_GET
+def download_record(request, pk: int):
+    return _record_file_response(request, pk, as_attachment=True)
+
+
+@login_required
+@require_GET
+def stream_record(request, pk: int):
+    """Inline, seekable playback of a record's file for <video>/<audio> players."""
+    return _record_file_response(request, pk, as_attachment=False)
+
+
 @login_required
 @require_POST
 def download_records_zip(request):
@@ -404,31 +644,51 @@ def download_records_zip(request):
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid JSON body")
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest("Invalid JSON body")
 
     ids = payload.get("ids") or []
     if not isinstance(ids, list) or not ids:
         return HttpResponseBadRequest("ids is required")
+    if not all(isinstance(pk, int) for pk in ids):
+        return HttpResponseBadRequest("ids must be integers")
+
+    files = _zip_files(ids)
+    if not files:
+        return HttpResponseNotFound("no files to download")
+
+    return _zip_response(metrics.timed_iter("zip", iter_zip(unique_arcnames(files))))
 
-    records = MediaRecord.objects.filter(id__in=ids)
+
+def _zip_files(ids) -> list:
     files = []
-    for rec in records:
+    for rec in MediaRecord.objects.filter(id__in=ids):
         if rec.file and default_storage.exists(rec.file.name):
             files.append(Path(default_storage.path(rec.file.name)))
+    return files
 
-    if not files:
-        return HttpResponseNotFound("no files to download")
 
-    import io
-    import zipfile
+def _zip_response(content) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(content, content_type="application/zip")
+    response["Content-Disposition"] = content_disposition_header(
+        True, "media_batch.zip"
+    )
+    return response
 
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for file_path in files:
-            zip_file.write(file_path, arcname=file_path.name)
-    buffer.seek(0)
 
-    return FileResponse(
-        buffer,
-        as_attachment=True,
-        filename="media_batch.zip",
+@require_GET
+def metrics_endpoint(request):
+    """
+    Stage timings and backend state in the Prometheus text format, for
+    scrapers presenting ``METRICS_TOKEN`` and for staff users. Without a
+    token configured it is open only while DEBUG is on.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = (
+        token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+    ) or request.user.is_staff or (not token and settings.DEBUG)
+    if not authorized:
+        return HttpResponse(status=401 if token else 403)
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
     )
@@ -1,15 +1,23 @@
 const API_AUDIO_URL = "/api/audio/";
-const API_VIDEO_URL = "/api/video/";
-const API_IMAGE_URL = "/api/image/";
+const API_GENERATE_URL = (mediaType) => `/api/${mediaType}/`;
+const API_JOBS_URL = "/api/jobs/";
+const API_JOB_EVENTS_URL = (id) => `/api/jobs/${id}/events/`;
+const API_CANCEL_JOB_URL = (id) => `/api/jobs/${id}/cancel/`;
 const API_RECORDS_URL = "/api/records/";
 const API_CREATE_RECORD_URL = "/api/records/create/";
 const API_DELETE_RECORD_URL = (id) => `/api/records/${id}/delete/`;
+const API_DELETE_RECORDS_URL = "/api/records/delete/";
 const API_DOWNLOAD_RECORD_URL = (id) => `/api/records/${id}/download/`;
 const API_DOWNLOAD_BATCH_URL = "/api/records/download/";
 
 const delay = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
 
 async function getErrorMessage(resp) {
+  const retryAfter = resp.status === 429 ? resp.headers.get("Retry-After") : null;
+  if (retryAfter) {
+    const data = await resp.clone().json().catch(() => ({}));
+    return `${data.error || "请求被限流"}：${data.detail ? `${data.detail}，` : ""}请 ${retryAfter} 秒后重试`;
+  }
   try {
     const data = await resp.clone().json();
     if (data.error && data.detail) return `${data.error}：${data.detail}`;
@@ -34,6 +42,14 @@ function getCSRFToken() {
   return "";
 }
 
+// 时长与分辨率由服务端保存时读取，列表无需加载媒体文件
+function mediaInfoText(item) {
+  const parts = [];
+  if (item.width && item.height) parts.push(`${item.width}×${item.height}`);
+  if (item.duration) parts.push(`${item.duration.toFixed(1)} 秒`);
+  return parts.length ? `${parts.join(" · ")} · ` : "";
+}
+
 function hydrateRecordFromServer(rec) {
   if (!rec) return null;
   const createdAt = rec.created_at || new Date().toISOString();
@@ -41,10 +57,16 @@ function hydrateRecordFromServer(rec) {
     id: rec.id ?? Date.now(),
     type: rec.media_type || rec.type,
     path: rec.url || rec.path || "",
+    // 支持 Range 请求的播放地址，音视频可直接拖动进度
+    stream: rec.stream_url || rec.url || rec.path || "",
+    thumbnail: rec.thumbnail_url || "",
     model: rec.model || "",
     prompt: rec.prompt || "",
     style: rec.style || "",
     voice: rec.voice || "",
+    duration: rec.duration ?? null,
+    width: rec.width ?? null,
+    height: rec.height ?? null,
     createdAt,
     time: new Date(createdAt).toLocaleTimeString("zh-CN", { hour12: false }),
   };
@@ -54,9 +76,14 @@ let currentMode = "image"; // image | audio | video
 let generating = false;
 let mediaStore = [];
 let currentFilter = "all";
-let libraryPage = 1;
-let libraryPageSize = 10;
+let libraryQuery = "";
+let librarySearchTimer = null;
+let libraryPageSize = 20;
 let libraryTotal = 0;
+let libraryTotalEstimated = false;
+let libraryCursor = ""; // next page cursor, null once everything is loaded
+let libraryLoading = false;
+let libraryObserver = null;
 let selectedIds = new Set();
 let hasLoadedRecords = false;
 
@@ -66,28 +93,43 @@ function addRecord(record) {
   renderLibrary();
 }
 
-async function loadRecords(page = 1) {
-  selectedIds = new Set();
-  libraryPage = page;
+// 基于游标的分页：append 为 true 时在列表末尾追加下一页
+async function loadRecords(append = false) {
+  if (libraryLoading) return;
+  if (!append) {
+    selectedIds = new Set();
+    libraryCursor = "";
+  }
+  if (libraryCursor === null) return;
+  libraryLoading = true;
   const params = new URLSearchParams({
-    page: libraryPage,
+    cursor: libraryCursor,
     page_size: libraryPageSize,
+    total: append ? "none" : "approx",
   });
   if (currentFilter !== "all") params.append("media_type", currentFilter);
+  if (libraryQuery) params.append("q", libraryQuery);
   try {
     const resp = await fetch(`${API_RECORDS_URL}?${params.toString()}`, {
       credentials: "same-origin",
     });
     if (!resp.ok) throw new Error(await resp.text());
     const data = await resp.json();
-    mediaStore = (data.records || [])
+    const records = (data.records || [])
       .map(hydrateRecordFromServer)
       .filter(Boolean);
-    libraryTotal = data.total || mediaStore.length;
+    mediaStore = append ? mediaStore.concat(records) : records;
+    libraryCursor = data.next_cursor || null;
+    if (!append) {
+      libraryTotal = data.total ?? mediaStore.length;
+      libraryTotalEstimated = !!data.total_estimated;
+    }
     hasLoadedRecords = true;
     renderLibrary();
   } catch (err) {
     console.warn("加载历史记录失败", err);
+  } finally {
+    libraryLoading = false;
   }
 }
 // 切换图像/音频/视频栏目
@@ -183,7 +225,7 @@ function switchToLibrary(elem) {
   if (hasLoadedRecords) {
     renderLibrary();
   } else {
-    loadRecords(libraryPage);
+    loadRecords();
   }
 }
 
@@ -233,26 +275,29 @@ async function handleGenerate() {
 
   if (currentMode === "audio") {
     try {
-      const resp = await fetch(API_AUDIO_URL, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-CSRFToken": getCSRFToken(),
-        },
-        body: JSON.stringify({ prompt, model, voice }),
-        credentials: "same-origin",
-      });
-
-      if (!resp.ok) {
-        const msg = await getErrorMessage(resp);
-        throw new Error(msg || "生成失败");
+      const onProgress = (progress) => {
+        loadingText.textContent = `正在生成${modeName}，${progress}（模型：${model}）`;
+      };
+      if (prompt.length > LONG_FORM_MIN_CHARS) {
+        const player = segmentPlayer(audioPlayer, audioPreview);
+        const record = await runLongFormAudio(
+          { prompt, model, voice },
+          player.push,
+          onProgress
+        );
+        loadingBox.style.display = "none";
+        player.finish(record.stream);
+        addRecord(record);
+        return;
       }
 
-      const data = await resp.json();
-      const record = hydrateRecordFromServer(data.record);
+      const record = await runGenerationJob(
+        { media_type: "audio", prompt, model, voice },
+        onProgress
+      );
 
       loadingBox.style.display = "none";
-      audioPlayer.src = record.path;
+      audioPlayer.src = record.stream;
       audioPreview.style.display = "block";
       audioPlayer.play();
       addRecord(record);
@@ -269,23 +314,12 @@ async function handleGenerate() {
 
   if (currentMode === "image") {
     try {
-      const resp = await fetch(API_IMAGE_URL, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-CSRFToken": getCSRFToken(),
-        },
-        body: JSON.stringify({ prompt, model, style }),
-        credentials: "same-origin",
-      });
-
-      if (!resp.ok) {
-        const msg = await getErrorMessage(resp);
-        throw new Error(msg || "生成失败");
-      }
-
-      const data = await resp.json();
-      const record = hydrateRecordFromServer(data.record);
+      const record = await runGenerationJob(
+        { media_type: "image", prompt, model, style },
+        (progress) => {
+          loadingText.textContent = `正在生成${modeName}，${progress}（模型：${model}）`;
+        }
+      );
 
       loadingBox.style.display = "none";
       imageResult.src = record.path;
@@ -304,26 +338,15 @@ async function handleGenerate() {
 
   if (currentMode === "video") {
     try {
-      const resp = await fetch(API_VIDEO_URL, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-CSRFToken": getCSRFToken(),
-        },
-        body: JSON.stringify({ prompt, model }),
-        credentials: "same-origin",
-      });
-
-      if (!resp.ok) {
-        const msg = await getErrorMessage(resp);
-        throw new Error(msg || "生成失败");
-      }
-
-      const data = await resp.json();
-      const record = hydrateRecordFromServer(data.record);
+      const record = await runGenerationJob(
+        { media_type: "video", prompt, model },
+        (progress) => {
+          loadingText.textContent = `正在生成${modeName}，${progress}（模型：${model}）`;
+        }
+      );
 
       loadingBox.style.display = "none";
-      videoPlayer.src = record.path;
+      videoPlayer.src = record.stream;
       videoPreview.style.display = "block";
       videoPlayer.play();
       addRecord(record);
@@ -376,6 +399,233 @@ async function handleGenerate() {
   generating = false;
 }
 
+function describeJobProgress(job) {
+  if (job.status === "queued") {
+    return job.queue_position
+      ? `排队中，前面还有 ${job.queue_position} 个任务`
+      : "排队中";
+  }
+  const progress = job.progress || {};
+  if (progress.queue_position != null) {
+    return `模型排队中，第 ${progress.queue_position + 1} 位`;
+  }
+  if (progress.fraction != null) {
+    return `已完成 ${Math.round(progress.fraction * 100)}%`;
+  }
+  return "请稍候…";
+}
+
+// 正在进行的生成任务，用于取消
+let activeJobId = null;
+
+function requestJobCancel(id, keepalive = false) {
+  return fetch(API_CANCEL_JOB_URL(id), {
+    method: "POST",
+    headers: { "X-CSRFToken": getCSRFToken() },
+    credentials: "same-origin",
+    keepalive,
+  });
+}
+
+async function cancelGeneration() {
+  if (activeStream) {
+    activeStream.abort();
+    return;
+  }
+  if (!activeJobId) return;
+  const cancelBtn = document.getElementById("cancelBtn");
+  cancelBtn.disabled = true;
+  document.getElementById("loadingText").textContent = "正在取消…";
+  try {
+    await requestJobCancel(activeJobId);
+  } catch (err) {
+    console.warn("取消失败", err);
+    cancelBtn.disabled = false;
+  }
+}
+
+// 关闭页面时取消未完成的任务，避免模型继续空跑
+window.addEventListener("pagehide", () => {
+  if (activeJobId) requestJobCancel(activeJobId, true);
+});
+
+// 同步生成：请求一直保持到结果保存完毕
+async function runGenerationRequest(body) {
+  const resp = await fetch(API_GENERATE_URL(body.media_type), {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCSRFToken(),
+    },
+    body: JSON.stringify(body),
+    credentials: "same-origin",
+  });
+  if (!resp.ok) {
+    const msg = await getErrorMessage(resp);
+    throw new Error(msg || "生成失败");
+  }
+  const data = await resp.json();
+  return hydrateRecordFromServer(data.record);
+}
+
+// 提交生成任务，并通过服务端推送（SSE）跟踪进度直到完成
+async function runGenerationJob(body, onProgress) {
+  const resp = await fetch(API_JOBS_URL, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCSRFToken(),
+    },
+    body: JSON.stringify(body),
+    credentials: "same-origin",
+  });
+  if (resp.status === 503) {
+    const data = await resp.clone().json().catch(() => ({}));
+    if (data.code === "no_workers") {
+      // 没有后台任务进程时直接同步生成，不显示排队进度
+      onProgress("请稍候…");
+      return runGenerationRequest(body);
+    }
+  }
+  if (!resp.ok) {
+    const msg = await getErrorMessage(resp);
+    throw new Error(msg || "生成失败");
+  }
+  const { job } = await resp.json();
+  onProgress(describeJobProgress(job));
+  activeJobId = job.id;
+  const cancelBtn = document.getElementById("cancelBtn");
+  cancelBtn.disabled = false;
+  cancelBtn.style.display = "block";
+
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(API_JOB_EVENTS_URL(job.id));
+    source.addEventListener("progress", (event) => {
+      onProgress(describeJobProgress(JSON.parse(event.data).job));
+    });
+    source.addEventListener("done", (event) => {
+      source.close();
+      activeJobId = null;
+      cancelBtn.style.display = "none";
+      const data = JSON.parse(event.data);
+      const finished = data.job;
+      if (finished && finished.status === "succeeded" && finished.record) {
+        resolve(hydrateRecordFromServer(finished.record));
+      } else if (finished) {
+        const msg = [finished.error, finished.detail].filter(Boolean).join("：");
+        reject(new Error(msg || "生成失败"));
+      } else {
+        reject(new Error(data.error || "生成失败"));
+      }
+    });
+    // 连接被服务端关闭后 EventSource 会自动重连，只有彻底失败才报错
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        activeJobId = null;
+        cancelBtn.style.display = "none";
+        reject(new Error("进度连接已断开"));
+      }
+    };
+  });
+}
+
+// 与服务端 TTS_LONG_FORM_MIN_CHARS 一致：更长的文本分段合成，合成好的段落先播放
+const LONG_FORM_MIN_CHARS = 300;
+
+// 正在接收分段音频的请求，取消时中断连接，服务端随之停止合成
+let activeStream = null;
+
+// 依次播放陆续到达的音频分段，全部结束后换成完整文件
+function segmentPlayer(audioPlayer, audioPreview) {
+  const queue = [];
+  let playing = false;
+  let finalSrc = null;
+
+  function playNext() {
+    const url = queue.shift();
+    if (url) {
+      playing = true;
+      audioPlayer.src = url;
+      audioPreview.style.display = "block";
+      audioPlayer.play();
+      return;
+    }
+    playing = false;
+    if (finalSrc) {
+      audioPlayer.onended = null;
+      audioPlayer.src = finalSrc;
+    }
+  }
+  audioPlayer.onended = playNext;
+
+  return {
+    push(segment) {
+      const bytes = Uint8Array.from(atob(segment.data), (c) => c.charCodeAt(0));
+      queue.push(URL.createObjectURL(new Blob([bytes], { type: segment.content_type })));
+      if (!playing) playNext();
+    },
+    finish(src) {
+      finalSrc = src;
+      if (!playing) playNext();
+    },
+  };
+}
+
+// 长文本语音：服务端按句分段并行合成，以 NDJSON 逐段返回，最后返回完整记录
+async function runLongFormAudio(body, onSegment, onProgress) {
+  const controller = new AbortController();
+  activeStream = controller;
+  const cancelBtn = document.getElementById("cancelBtn");
+  cancelBtn.disabled = false;
+  cancelBtn.style.display = "block";
+  try {
+    const resp = await fetch(API_AUDIO_URL, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": getCSRFToken(),
+      },
+      body: JSON.stringify({ ...body, long_form: true, stream: true }),
+      credentials: "same-origin",
+      signal: controller.signal,
+    });
+    if (!resp.ok) {
+      const msg = await getErrorMessage(resp);
+      throw new Error(msg || "生成失败");
+    }
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let newline;
+      while ((newline = buffer.indexOf("\n")) >= 0) {
+        const line = buffer.slice(0, newline).trim();
+        buffer = buffer.slice(newline + 1);
+        if (!line) continue;
+        const data = JSON.parse(line);
+        if (data.segment) {
+          onSegment(data.segment);
+          onProgress(`已合成 ${data.segment.index + 1}/${data.segment.total} 段`);
+        } else if (data.record) {
+          return hydrateRecordFromServer(data.record);
+        } else if (data.error) {
+          throw new Error([data.error, data.detail].filter(Boolean).join("："));
+        }
+      }
+    }
+    throw new Error("生成失败");
+  } catch (err) {
+    if (err.name === "AbortError") throw new Error("生成已取消");
+    throw err;
+  } finally {
+    activeStream = null;
+    cancelBtn.style.display = "none";
+  }
+}
+
 async function createRecordOnServer(payload) {
   try {
     const resp = await fetch(API_CREATE_RECORD_URL, {
@@ -402,7 +652,18 @@ function setLibraryFilter(filter, elem) {
     .querySelectorAll(".filter-pill")
     .forEach((btn) => btn.classList.remove("active"));
   elem.classList.add("active");
-  loadRecords(1);
+  loadRecords();
+}
+
+// 全文搜索：输入停止 300ms 后再请求，结果按相关度排序
+function setLibraryQuery(value) {
+  clearTimeout(librarySearchTimer);
+  librarySearchTimer = setTimeout(() => {
+    const query = value.trim();
+    if (query === libraryQuery) return;
+    libraryQuery = query;
+    loadRecords();
+  }, 300);
 }
 
 function renderLibrary() {
@@ -416,12 +677,13 @@ function renderLibrary() {
   });
 
   if (statsEl) {
+    const totalText = libraryTotalEstimated
+      ? `超过 ${libraryTotal}`
+      : `${Math.max(libraryTotal, mediaStore.length)}`;
     statsEl.textContent =
       mediaStore.length === 0
         ? "暂无记录"
-        : `共 ${libraryTotal || mediaStore.length} 条生成记录，当前显示 ${
-            filtered.length
-          } 条`;
+        : `共 ${totalText} 条生成记录，当前已加载 ${filtered.length} 条`;
   }
 
   if (filtered.length === 0) {
@@ -481,6 +743,16 @@ function renderLibrary() {
       previewFromRecord(item);
     };
 
+    // 缩略图（图像缩略图 / 视频封面 / 音频波形），尚未生成时不显示
+    if (item.thumbnail) {
+      const thumb = document.createElement("img");
+      thumb.className = `library-thumb library-thumb-${item.type}`;
+      thumb.loading = "lazy";
+      thumb.alt = "";
+      thumb.src = item.thumbnail;
+      row.appendChild(thumb);
+    }
+
     const infoMain = document.createElement("div");
     infoMain.className = "library-info-main";
 
@@ -513,7 +785,7 @@ function renderLibrary() {
     if (item.type === "image" || item.type === "video") {
       detail = `模型：${item.model || "-"} · 风格：${
         item.style || "-"
-      } · 文件：${item.path}`;
+      } · ${mediaInfoText(item)}文件：${item.path}`;
     } else if (item.type === "audio") {
       detail = `模型：${item.model || "-"} · 人声：${
         item.voice || "-"
@@ -586,11 +858,11 @@ function previewFromRecord(record) {
     imageResult.src = record.path;
     imageResult.style.display = "block";
   } else if (record.type === "audio") {
-    audioPlayer.src = record.path;
+    audioPlayer.src = record.stream;
     audioPreview.style.display = "block";
     audioPlayer.play();
   } else if (record.type === "video") {
-    videoPlayer.src = record.path;
+    videoPlayer.src = record.stream;
     videoPreview.style.display = "block";
     videoPlayer.play();
   }
@@ -602,27 +874,24 @@ if (document.readyState === "loading") {
   loadRecords();
 }
 
+// 列表底部的“加载更多”，滚动到可见时自动加载下一页
 function renderPagination(container) {
-  const totalPages = Math.ceil((libraryTotal || 0) / libraryPageSize) || 1;
-  if (totalPages <= 1) return;
+  if (libraryObserver) {
+    libraryObserver.disconnect();
+    libraryObserver = null;
+  }
+  if (libraryCursor === null) return;
   const nav = document.createElement("div");
   nav.className = "library-pagination";
-  nav.innerHTML = `
-    <button class="filter-pill" id="pagePrev"${
-      libraryPage === 1 ? " disabled" : ""
-    }>上一页</button>
-    <span>第 ${libraryPage} / ${totalPages} 页</span>
-    <button class="filter-pill" id="pageNext"${
-      libraryPage >= totalPages ? " disabled" : ""
-    }>下一页</button>
-  `;
-  nav.querySelector("#pagePrev").onclick = () => {
-    if (libraryPage > 1) loadRecords(libraryPage - 1);
-  };
-  nav.querySelector("#pageNext").onclick = () => {
-    if (libraryPage < totalPages) loadRecords(libraryPage + 1);
-  };
+  nav.innerHTML = `<button class="filter-pill" id="loadMore">加载更多</button>`;
+  nav.querySelector("#loadMore").onclick = () => loadRecords(true);
   container.appendChild(nav);
+  if ("IntersectionObserver" in window) {
+    libraryObserver = new IntersectionObserver((entries) => {
+      if (entries.some((e) => e.isIntersecting)) loadRecords(true);
+    });
+    libraryObserver.observe(nav);
+  }
 }
 
 function toggleSelect(id, checked) {
@@ -667,9 +936,22 @@ async function deleteSelected() {
   const ids = Array.from(selectedIds);
   if (!ids.length) return;
   if (!confirm(`确定删除选中的 ${ids.length} 条记录？`)) return;
-  await Promise.all(ids.map((id) => deleteRecord(id, false)));
+  try {
+    const resp = await fetch(API_DELETE_RECORDS_URL, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": getCSRFToken(),
+      },
+      body: JSON.stringify({ ids }),
+      credentials: "same-origin",
+    });
+    if (!resp.ok) throw new Error(await resp.text());
+  } catch (err) {
+    alert(`删除失败：${err.message}`);
+  }
   selectedIds.clear();
-  loadRecords(libraryPage);
+  loadRecords();
 }
 
 function downloadRecord(id) {